@@ -0,0 +1,147 @@
+# api/authentication.py
+"""
+JWT authentication done once per request, with cached users.
+
+JWTAuthenticationMiddleware verifies the bearer token and sets request.user.
+CachedJWTAuthentication, the DRF authentication class, reuses that result
+instead of verifying the token a second time.
+
+Users are looked up in a small per-process TTL cache, then in the default
+(Redis) cache, and only then in the database. When Redis is unavailable
+users are read from the database. Saving a user drops the Redis entry and
+the local one. Other processes may serve their local copy for up
+to USER_CACHE_LOCAL_TTL seconds.
+"""
+import copy
+import logging
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_LOCAL_TTL = getattr(settings, 'USER_CACHE_LOCAL_TTL', 5)
+USER_CACHE_LOCAL_SIZE = getattr(settings, 'USER_CACHE_LOCAL_SIZE', 10000)
+USER_CACHE_TIMEOUT = getattr(settings, 'USER_CACHE_TIMEOUT', 60 * 5)
+
+_local_users = TTLCache(maxsize=USER_CACHE_LOCAL_SIZE, ttl=USER_CACHE_LOCAL_TTL)
+_local_lock = threading.Lock()
+
+
+def _user_key(user_id):
+    return f"auth_user:{user_id}"
+
+
+def get_cached_user(user_id):
+    """
+    Returns the user or None if there is no such user. Every call gets its own
+    copy, requests may modify it.
+    """
+    from .models import User
+
+    # simplejwt puts the id in the token as a string
+    user_id = int(user_id)
+    with _local_lock:
+        user = _local_users.get(user_id)
+    if user is not None:
+        return copy.copy(user)
+
+    try:
+        user = cache.get(_user_key(user_id))
+    except Exception as e:
+        logger.warning(f"User cache unavailable, reading user {user_id} from the database: {e}")
+        user = None
+    if user is None:
+        try:
+            # The embedding is large and not needed to serve a request
+            user = User.objects.defer('embedding').get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        try:
+            cache.set(_user_key(user_id), user, timeout=USER_CACHE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"User cache unavailable, user {user_id} not cached: {e}")
+
+    with _local_lock:
+        _local_users[user_id] = user
+    return copy.copy(user)
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(_user_key(user_id))
+    with _local_lock:
+        _local_users.pop(user_id, None)
+
+
+def invalidate_cached_users(user_ids):
+    cache.delete_many([_user_key(user_id) for user_id in user_ids])
+    with _local_lock:
+        for user_id in user_ids:
+            _local_users.pop(user_id, None)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    simplejwt's JWTAuthentication with cached user lookups. Within a request
+    that went through JWTAuthenticationMiddleware it returns the middleware's
+    result, or raises its error.
+    """
+
+    def authenticate(self, request):
+        django_request = getattr(request, '_request', request)
+        outcome = getattr(django_request, '_jwt_auth', None)
+        if outcome is None:
+            return super().authenticate(request)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome[0]
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+
+class JWTAuthenticationMiddleware:
+    """
+    Authenticates the bearer token once and sets request.user. The outcome
+    is kept on the request for CachedJWTAuthentication.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.authenticator = CachedJWTAuthentication()
+
+    def __call__(self, request):
+        try:
+            # Wrapped in a tuple so that no token (None) is told apart from not having run
+            request._jwt_auth = (self.authenticator.authenticate(request),)
+        except exceptions.AuthenticationFailed as e:
+            request._jwt_auth = e
+        else:
+            if request._jwt_auth[0] is not None:
+                request.user = request._jwt_auth[0][0]
+
+        return self.get_response(request)
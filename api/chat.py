@@ -0,0 +1,247 @@
+# api/chat.py
+"""
+Chat memory of a project.
+
+Every message is appended to ChatMemory. A prompt is the system message, the
+project's ChatSummary, the messages after it, then the new message. The
+messages after the summary are read newest first through the (project,
+created_at) index and cut to CHAT_HISTORY_TOKEN_BUDGET, so prompt size stays
+bounded however long the conversation gets.
+
+Facts about the message retrieved from the project's knowledge graph (see
+api.retrieval) are added right before it. The first message of a chat may be
+answered from the semantic cache (see api.semantic_cache).
+
+Once the unsummarized messages pass CHAT_SUMMARIZE_AT tokens a Celery task
+folds the older ones into the summary. Between two summaries the prompt only
+grows at its end, so it starts with the previous prompt of the project and
+Ollama evaluates only the new turns (see api.llm).
+"""
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from . import semantic_cache
+from .graph import get_graph_version
+from .llm import chat_messages, llm_registry, stream_chat
+from .models import ChatMemory, ChatSummary
+from .retrieval import retrieve_facts
+
+logger = logging.getLogger(__name__)
+
+CHAT_HISTORY_MAX_MESSAGES = getattr(settings, 'CHAT_HISTORY_MAX_MESSAGES', 50)
+CHAT_HISTORY_TOKEN_BUDGET = getattr(settings, 'CHAT_HISTORY_TOKEN_BUDGET', 3000)
+CHAT_SUMMARIZE_AT = getattr(settings, 'CHAT_SUMMARIZE_AT', 2000)
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain the memory of a conversation. Merge the new messages into the "
+    "existing summary. Keep facts, decisions, names and open questions, drop "
+    "small talk. Answer with the updated summary only, in under 300 words."
+)
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for the models in use
+    return len(text) // 4 + 1
+
+
+def _history_message(role, content):
+    return HumanMessage(content=content) if role == 'human' else AIMessage(content=content)
+
+
+def load_context(project_id):
+    """
+    Returns (summary message or None, earlier messages, unsummarized tokens).
+    """
+    summary = ChatSummary.objects.filter(project_id=project_id).first()
+
+    memories = ChatMemory.objects.filter(project_id=project_id)
+    if summary is not None and summary.covered_until is not None:
+        memories = memories.filter(created_at__gt=summary.covered_until)
+    recent = list(
+        memories.order_by('-created_at', '-id').values_list('role', 'content', 'token_count')[:CHAT_HISTORY_MAX_MESSAGES]
+    )
+    unsummarized = sum(tokens for _, _, tokens in recent)
+
+    budget = CHAT_HISTORY_TOKEN_BUDGET - (summary.token_count if summary else 0)
+    kept = []
+    for role, content, tokens in recent:
+        if tokens > budget:
+            break
+        budget -= tokens
+        kept.append((role, content))
+    kept.reverse()
+    # Whole turns only, the history starts with a human message
+    while kept and kept[0][0] != 'human':
+        kept.pop(0)
+
+    summary_message = None
+    if summary is not None and summary.content:
+        summary_message = SystemMessage(content=f"Summary of the earlier conversation:\n{summary.content}")
+    if len(recent) == CHAT_HISTORY_MAX_MESSAGES:
+        # More messages wait behind the ones read, summarize regardless of their size
+        unsummarized = max(unsummarized, CHAT_SUMMARIZE_AT)
+    return summary_message, [_history_message(role, content) for role, content in kept], unsummarized
+
+
+def schedule_summary(project_id):
+    """
+    Queues a summary of the project's chat unless one is already queued.
+    """
+    from .tasks import summarize_chat
+
+    if cache.add(f"chat_summary_pending:{project_id}", 1, timeout=60 * 10):
+        summarize_chat.delay(project_id)
+
+
+async def _answer(messages, question, embedding, scope, usage):
+    """
+    Streams the cached answer of a similar question, or generates one and
+    caches it. Without an embedding the cache is skipped.
+    """
+    if embedding is not None:
+        started = time.perf_counter()
+        entry = await semantic_cache.alookup(embedding, scope)
+        await sync_to_async(semantic_cache.record_lookup)(entry, (time.perf_counter() - started) * 1000)
+        if entry is not None:
+            yield entry.answer
+            return
+
+    started = time.perf_counter()
+    parts = []
+    async for text in stream_chat(messages, usage=usage):
+        parts.append(text)
+        yield text
+
+    if embedding is not None:
+        generation_ms = (time.perf_counter() - started) * 1000
+        await semantic_cache.astore(question, embedding, ''.join(parts), scope, generation_ms)
+
+
+async def stream_answer(user_message):
+    """
+    Streams the answer to a message outside of any project.
+    """
+    embedding = await semantic_cache.embed(user_message) if semantic_cache.SEMANTIC_CACHE_ENABLED else None
+    async for text in _answer(chat_messages(user_message), user_message, embedding, '', {}):
+        yield text
+
+
+async def stream_reply(project, user_message):
+    """
+    Streams the answer to a message and appends both to the project's chat.
+    The knowledge graph facts are retrieved while the chat history is loaded
+    and, for the first message, while it is embedded for the semantic cache.
+    A reply that is cut off is not kept.
+    """
+    asked_at = timezone.now()
+    retrieval = asyncio.ensure_future(retrieve_facts(project.cognee_nodeset_name, user_message))
+    summary_message, history, unsummarized = await sync_to_async(load_context)(project.pk)
+
+    # Only answers that do not depend on earlier turns can be shared
+    embedding = None
+    if summary_message is None and not unsummarized and semantic_cache.SEMANTIC_CACHE_ENABLED:
+        embedding = await semantic_cache.embed(user_message)
+    facts = await retrieval
+
+    scope = ''
+    if summary_message is not None:
+        history = [summary_message, *history]
+    elif facts and embedding is not None:
+        scope = semantic_cache.scope_for(
+            project.cognee_nodeset_name,
+            await get_graph_version(project.cognee_nodeset_name),
+            facts,
+        )
+
+    usage = {}
+    parts = []
+    async for text in _answer(chat_messages(user_message, history, facts), user_message, embedding, scope, usage):
+        parts.append(text)
+        yield text
+
+    reply = ''.join(parts)
+    await ChatMemory.objects.abulk_create([
+        ChatMemory(
+            project=project,
+            role='human',
+            content=user_message,
+            token_count=estimate_tokens(user_message),
+            created_at=asked_at,
+        ),
+        ChatMemory(
+            project=project,
+            role='ai',
+            content=reply,
+            token_count=usage.get('eval_count') or estimate_tokens(reply),
+        ),
+    ])
+
+    if unsummarized + estimate_tokens(user_message) + estimate_tokens(reply) >= CHAT_SUMMARIZE_AT:
+        await sync_to_async(schedule_summary)(project.pk)
+
+
+def _messages_to_fold(memories):
+    """
+    The oldest whole turns of memories (oldest first) whose removal leaves at
+    most half of CHAT_SUMMARIZE_AT tokens unsummarized.
+    """
+    remaining = sum(memory.token_count for memory in memories)
+    fold = []
+    for memory in memories:
+        if remaining <= CHAT_SUMMARIZE_AT // 2 and memory.role == 'human':
+            break
+        fold.append(memory)
+        remaining -= memory.token_count
+    return fold
+
+
+async def summarize(summary_text, memories):
+    llm = llm_registry.build('summary')
+    transcript = '\n'.join(f"{memory.role}: {memory.content}" for memory in memories)
+    answer = await llm.ainvoke([
+        SystemMessage(content=SUMMARY_INSTRUCTIONS),
+        HumanMessage(content=f"Existing summary:\n{summary_text or '(none)'}\n\nNew messages:\n{transcript}"),
+    ])
+    return answer.content, answer.response_metadata.get('eval_count') or estimate_tokens(answer.content)
+
+
+def summarize_project_chat(project_id):
+    """
+    Folds the older unsummarized messages of a project into its summary.
+    Returns the number of messages folded.
+    """
+    try:
+        summary, _ = ChatSummary.objects.get_or_create(project_id=project_id)
+        memories = ChatMemory.objects.filter(project_id=project_id)
+        if summary.covered_until is not None:
+            memories = memories.filter(created_at__gt=summary.covered_until)
+        fold = _messages_to_fold(list(memories.order_by('created_at', 'id')))
+        if not fold:
+            return 0
+
+        # The model call can take a while, no transaction is held meanwhile
+        content, token_count = asyncio.run(summarize(summary.content, fold))
+
+        # Conditional on covered_until, a concurrent run may have moved it
+        updated = ChatSummary.objects.filter(
+            pk=summary.pk,
+            covered_until=summary.covered_until,
+        ).update(
+            content=content,
+            token_count=token_count,
+            covered_until=fold[-1].created_at,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            logger.warning(f"Chat summary of project {project_id} changed meanwhile, dropping this one")
+            return 0
+        return len(fold)
+    finally:
+        cache.delete(f"chat_summary_pending:{project_id}")
@@ -1,63 +1,91 @@
 import json
+import logging
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from urllib.parse import parse_qs
-from channels.db import database_sync_to_async
+
+from .ratelimit import WEBSOCKET_CLOSE_CODE, take_user
+from .ws_tickets import InvalidTicket, aredeem_ticket
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
-    
-    @database_sync_to_async
-    def get_user_from_jwt(self, token):
+
+    user_id = None
+    tier_name = None
+    _user = None
+
+    def claims_from_jwt(self, token):
         """
-        Retrieve the user from a JWT access token.
+        Reads the user id from a JWT access token, the signature and expiry
+        are checked locally.
         """
         from rest_framework_simplejwt.tokens import AccessToken
         from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
-        from django.contrib.auth import get_user_model
-        
-        User = get_user_model()
 
         try:
-            # Validate and decode the JWT token
-            access_token = AccessToken(token)
-            user_id = access_token['user_id']
-            
-            # Get the user from the database
-            user = User.objects.get(pk=user_id)
-            return user
-        except (TokenError, InvalidToken, User.DoesNotExist) as e:
-            print(f"JWT validation error: {e}")
+            return {'uid': AccessToken(token)['user_id'], 'tier': None}
+        except (TokenError, InvalidToken, KeyError) as e:
+            logging.info(f"JWT validation error: {e}")
             return None
+
+    async def authenticate(self, token):
+        """
+        Accepts a ticket from get_ws_token, or a JWT access token from older clients.
+        Neither costs a DB query.
+        """
+        try:
+            return await aredeem_ticket(token)
+        except InvalidTicket as e:
+            claims = self.claims_from_jwt(token)
+            if claims is None:
+                logging.info(f"WebSocket ticket rejected: {e}")
+            return claims
+
+    async def get_user(self):
+        """
+        Loads the user on first use, for handlers that need more than the id.
+        """
+        if self._user is None:
+            from django.contrib.auth import get_user_model
+
+            self._user = await get_user_model().objects.aget(pk=self.user_id)
+        return self._user
+
+    async def take_token(self):
+        """
+        Draws from the user's rate limit bucket, closing the socket when it is empty.
+        """
+        allowed, _ = await sync_to_async(take_user)(self.user_id, self.tier_name)
+        if not allowed:
+            logging.info(f"WebSocket of user {self.user_id} rate limited")
+            await self.close(code=WEBSOCKET_CLOSE_CODE)
+        return allowed
     
     async def connect(self):
-        print(f"WebSocket connect attempt")
-        
-        # Try to get JWT token from query parameters
+        # Try to get the ticket from query parameters
         query_string = self.scope.get('query_string', b'').decode()
         query_params = parse_qs(query_string)
         token = query_params.get('token', [None])[0]
         
-        print(f"Token from query params: {token[:20] if token else None}...")
-        
         if not token:
-            print("Connection REJECTED: No token provided.")
+            logging.info("WebSocket connection rejected: no token provided")
             await self.close(code=4001)
             return
         
-        # Authenticate user via JWT
-        user = await self.get_user_from_jwt(token)
+        claims = await self.authenticate(token)
         
-        if not user:
-            print("Connection REJECTED: Invalid or expired token.")
+        if not claims:
             await self.close(code=4001)
             return
         
-        # Set the authenticated user in scope
-        self.scope['user'] = user
-        print(f"Connection ACCEPTED for user: {user.email} (ID: {user.id})")
+        self.user_id = claims['uid']
+        self.tier_name = claims['tier']
+
+        if not await self.take_token():
+            return
         
         # Create a unique group name for each user
-        self.group_name = f'user_{user.id}'
+        self.group_name = f'user_{self.user_id}'
         
         # Add this user's channel to the group
         await self.channel_layer.group_add(
@@ -67,7 +95,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         await self.accept()
 
     async def disconnect(self, close_code):
-        print(f"WebSocket disconnected: {close_code}")
+        logging.info(f"WebSocket disconnected: {close_code}")
         # Remove the channel from the group when disconnected
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(
@@ -80,6 +108,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         """
         Handle incoming WebSocket messages (e.g., ping/pong)
         """
+        if not await self.take_token():
+            return
+
         try:
             data = json.loads(text_data)
             message_type = data.get('type')
@@ -90,7 +121,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                     'type': 'pong'
                 }))
         except json.JSONDecodeError:
-            print("Received invalid JSON")
+            logging.warning("Received invalid JSON")
 
     # This method is called when a message is sent to the user's group
     async def task_notification(self, event):
@@ -0,0 +1,120 @@
+# api/embeddings.py
+"""
+Incremental maintenance of ``User.embedding``.
+
+Learning events (a vocab was seen, known or failed) are pushed onto a Redis
+list by the request path. A Celery beat task drains the list in micro-batches
+and folds each event into the stored vector with an exponential moving
+average, so the embedding is never re-derived from the full history:
+
+    embedding += weight * (vocab_embedding - embedding)
+
+Negative weights move the embedding away from the vocab.
+
+A batch is only removed from the list once its embeddings are written, so a
+failed write is retried by the next run. A crash between the write and the
+trim applies that batch twice, which only nudges the embeddings a bit further.
+"""
+import json
+import logging
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+EVENT_QUEUE_KEY = 'embedding_events'
+
+LEARNING_EVENT_WEIGHTS = getattr(settings, 'LEARNING_EVENT_WEIGHTS', {
+    'seen': 0.02,
+    'known': 0.05,
+    'failed': -0.02,
+})
+
+
+def record_learning_events(user_id, events):
+    """
+    Queues [{'vocab_id': ..., 'kind': 'seen' | 'known' | 'failed'}, ...] for a user.
+    Raises ValueError for events that are not objects and for unknown kinds.
+    """
+    payloads = []
+    for event in events:
+        if not isinstance(event, dict):
+            raise ValueError(f"Learning events must be objects, got {type(event).__name__}")
+        if event.get('kind') not in LEARNING_EVENT_WEIGHTS:
+            raise ValueError(f"Unknown learning event kind: {event.get('kind')}")
+        payloads.append(json.dumps({
+            'user_id': int(user_id),
+            'vocab_id': int(event['vocab_id']),
+            'kind': event['kind'],
+        }))
+
+    if payloads:
+        get_redis_connection('default').rpush(EVENT_QUEUE_KEY, *payloads)
+    return len(payloads)
+
+
+def fold_events(embedding, vocab_embeddings, kinds):
+    """
+    Applies events in order to an embedding and returns the new vector.
+    A user without an embedding starts at the first vocab they move towards.
+    """
+    for vocab_embedding, kind in zip(vocab_embeddings, kinds):
+        weight = LEARNING_EVENT_WEIGHTS[kind]
+        if embedding is None:
+            if weight <= 0:
+                continue
+            embedding = vocab_embedding.copy()
+            continue
+        embedding += weight * (vocab_embedding - embedding)
+    return embedding
+
+
+def apply_embedding_events(batch_size=1000):
+    """
+    Applies the oldest micro-batch of events with one query for vocabs, one
+    for users and one bulk update, then drops it from the list. Only one run
+    may drain the list at a time. Returns the number of events applied.
+    """
+    from .models import User, Vocabulary
+
+    redis = get_redis_connection('default')
+    raw_events = redis.lrange(EVENT_QUEUE_KEY, 0, batch_size - 1)
+    events = [json.loads(raw_event) for raw_event in raw_events]
+    if not events:
+        return 0
+
+    vocab_embeddings = {
+        vocab_id: np.asarray(embedding, dtype=np.float32)
+        for vocab_id, embedding in Vocabulary.objects.filter(
+            id__in={event['vocab_id'] for event in events}
+        ).exclude(embedding=None).values_list('id', 'embedding')
+    }
+
+    events_by_user = defaultdict(list)
+    for event in events:
+        if event['vocab_id'] in vocab_embeddings:
+            events_by_user[event['user_id']].append(event)
+
+    current = dict(User.objects.filter(id__in=events_by_user).values_list('id', 'embedding'))
+
+    updated = []
+    for user_id, user_events in events_by_user.items():
+        if user_id not in current:
+            continue
+        embedding = current[user_id]
+        embedding = None if embedding is None else np.asarray(embedding, dtype=np.float32).copy()
+        embedding = fold_events(
+            embedding,
+            [vocab_embeddings[event['vocab_id']] for event in user_events],
+            [event['kind'] for event in user_events],
+        )
+        if embedding is not None:
+            updated.append(User(id=user_id, embedding=embedding))
+
+    User.objects.bulk_update(updated, ['embedding'])
+    # Events pushed meanwhile are behind the batch and stay queued
+    redis.ltrim(EVENT_QUEUE_KEY, len(raw_events), -1)
+    return len(events)
@@ -0,0 +1,262 @@
+# api/graph.py
+"""
+Helpers for serving per-project subgraphs of the Cognee knowledge graph.
+
+Every project owns a Cognee nodeset (``Project.cognee_nodeset_name``) and a
+dataset of the same name. The subgraph for that nodeset is extracted once and
+kept in the default Redis cache until the project is re-cognified.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from cognee.infrastructure.databases.graph import get_graph_engine
+from cognee.modules.engine.models.node_set import NodeSet
+
+logger = logging.getLogger(__name__)
+
+# Subgraphs only change on cognify, so they can live in the cache for a long time.
+GRAPH_CACHE_TIMEOUT = getattr(settings, 'GRAPH_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# Number of nodes (or edges) stored under one cache key
+GRAPH_CHUNK_SIZE = getattr(settings, 'GRAPH_CHUNK_SIZE', 1000)
+
+GRAPH_PAGE_DEFAULT_LIMIT = 500
+GRAPH_PAGE_MAX_LIMIT = 5000
+
+CURSOR_SALT = 'api.graph.cursor'
+
+
+def _version_key(nodeset_name):
+    return f"graph:{nodeset_name}:version"
+
+
+def _graph_key(nodeset_name, version):
+    return f"graph:{nodeset_name}:v{version}"
+
+
+def _chunk_key(nodeset_name, version, kind, index):
+    return f"graph:{nodeset_name}:v{version}:{kind}:{index}"
+
+
+async def get_graph_version(nodeset_name):
+    """
+    Returns the current cache version of a nodeset, creating it on first use.
+    """
+    version = await cache.aget(_version_key(nodeset_name))
+    if version is None:
+        await cache.aadd(_version_key(nodeset_name), 1, timeout=None)
+        version = await cache.aget(_version_key(nodeset_name), 1)
+    return version
+
+
+def invalidate_project_graph(nodeset_name):
+    """
+    Drops the cached subgraph of a nodeset by bumping its version.
+    Old entries are never read again and simply expire.
+    """
+    cache.add(_version_key(nodeset_name), 1, timeout=None)
+    try:
+        cache.incr(_version_key(nodeset_name))
+    except ValueError:
+        # The key was evicted between add() and incr()
+        cache.set(_version_key(nodeset_name), 1, timeout=None)
+
+
+async def ainvalidate_project_graph(nodeset_name):
+    await cache.aadd(_version_key(nodeset_name), 1, timeout=None)
+    try:
+        await cache.aincr(_version_key(nodeset_name))
+    except ValueError:
+        await cache.aset(_version_key(nodeset_name), 1, timeout=None)
+
+
+async def add_project_data(nodeset_name, data):
+    """
+    Adds text or files to the project's dataset, tagged with its nodeset.
+    The cognify_project task turns them into graph data.
+    """
+    import cognee
+
+    await cognee.add(data, dataset_name=nodeset_name, node_set=[nodeset_name])
+
+
+async def extract_project_subgraph(nodeset_name):
+    """
+    Pulls only the nodes and edges that belong to a nodeset from the graph engine.
+    """
+    graph_engine = await get_graph_engine()
+    nodes_data, edges_data = await graph_engine.get_nodeset_subgraph(
+        node_type=NodeSet,
+        node_name=[nodeset_name],
+    )
+    return list(nodes_data), list(edges_data)
+
+
+class GraphCacheMiss(Exception):
+    """Raised when a chunk of a cached graph expired before its manifest."""
+
+
+class ProjectGraph:
+    """
+    A cached subgraph stored as fixed-size chunks of nodes and edges.
+
+    Only a small manifest is read up front, chunks are fetched on demand so
+    that a page or a stream never holds more than a chunk or two in memory.
+    """
+
+    def __init__(self, nodeset_name, version, node_count, edge_count, chunk_size, cache_hit):
+        self.nodeset_name = nodeset_name
+        self.version = version
+        self.node_count = node_count
+        self.edge_count = edge_count
+        self.chunk_size = chunk_size
+        self.cache_hit = cache_hit
+
+    @property
+    def total(self):
+        return self.node_count + self.edge_count
+
+    async def _chunk(self, kind, index):
+        key = _chunk_key(self.nodeset_name, self.version, kind, index)
+        chunk = await cache.aget(key)
+        if chunk is None:
+            raise GraphCacheMiss(self.nodeset_name)
+        return chunk
+
+    async def _slice(self, kind, count, start, stop):
+        """
+        Returns items [start, stop) of one kind, reading only the chunks it spans.
+        """
+        stop = min(stop, count)
+        items = []
+        if start >= stop:
+            return items
+        for index in range(start // self.chunk_size, (stop - 1) // self.chunk_size + 1):
+            chunk = await self._chunk(kind, index)
+            offset = index * self.chunk_size
+            items.extend(chunk[max(start - offset, 0):stop - offset])
+        return items
+
+    async def page(self, offset, limit):
+        """
+        Returns (nodes, edges) for a window over the node list followed by the edge list.
+        """
+        stop = offset + limit
+        nodes = await self._slice('nodes', self.node_count, offset, stop)
+        edges = await self._slice(
+            'edges', self.edge_count,
+            max(offset - self.node_count, 0), stop - self.node_count,
+        )
+        return nodes, edges
+
+    async def iter_chunks(self, kind):
+        count = self.node_count if kind == 'nodes' else self.edge_count
+        for index in range((count + self.chunk_size - 1) // self.chunk_size):
+            yield await self._chunk(kind, index)
+
+    async def all(self):
+        nodes_data = [node async for chunk in self.iter_chunks('nodes') for node in chunk]
+        edges_data = [edge async for chunk in self.iter_chunks('edges') for edge in chunk]
+        return nodes_data, edges_data
+
+
+async def _store_project_graph(nodeset_name, version, nodes_data, edges_data):
+    chunk_size = GRAPH_CHUNK_SIZE
+    chunks = {}
+    for kind, items in (('nodes', nodes_data), ('edges', edges_data)):
+        for index in range(0, len(items), chunk_size):
+            key = _chunk_key(nodeset_name, version, kind, index // chunk_size)
+            chunks[key] = items[index:index + chunk_size]
+
+    await cache.aset_many(chunks, timeout=GRAPH_CACHE_TIMEOUT)
+    # The manifest goes in last so readers never see it without its chunks
+    await cache.aset(
+        _graph_key(nodeset_name, version),
+        {'node_count': len(nodes_data), 'edge_count': len(edges_data), 'chunk_size': chunk_size},
+        timeout=GRAPH_CACHE_TIMEOUT,
+    )
+
+
+async def load_project_graph(nodeset_name):
+    """
+    Returns the ProjectGraph of a nodeset, extracting and caching it on a miss.
+    """
+    version = await get_graph_version(nodeset_name)
+
+    manifest = await cache.aget(_graph_key(nodeset_name, version))
+    if manifest is not None:
+        return ProjectGraph(nodeset_name, version, cache_hit=True, **manifest)
+
+    nodes_data, edges_data = await extract_project_subgraph(nodeset_name)
+    await _store_project_graph(nodeset_name, version, nodes_data, edges_data)
+
+    return ProjectGraph(
+        nodeset_name, version,
+        node_count=len(nodes_data),
+        edge_count=len(edges_data),
+        chunk_size=GRAPH_CHUNK_SIZE,
+        cache_hit=False,
+    )
+
+
+async def get_project_graph(nodeset_name):
+    """
+    Returns (nodes_data, edges_data, cache_hit) for a nodeset.
+    """
+    graph = await load_project_graph(nodeset_name)
+    try:
+        nodes_data, edges_data = await graph.all()
+    except GraphCacheMiss:
+        await ainvalidate_project_graph(nodeset_name)
+        graph = await load_project_graph(nodeset_name)
+        nodes_data, edges_data = await graph.all()
+    return nodes_data, edges_data, graph.cache_hit
+
+
+def encode_cursor(graph, offset):
+    return signing.dumps({'n': graph.nodeset_name, 'v': graph.version, 'o': offset}, salt=CURSOR_SALT)
+
+
+def decode_cursor(graph, cursor):
+    """
+    Returns the offset stored in a cursor, or raises ValueError if it does not
+    belong to this version of the graph.
+    """
+    try:
+        payload = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise ValueError("Invalid cursor")
+    if payload.get('n') != graph.nodeset_name or payload.get('v') != graph.version:
+        raise ValueError("Cursor expired, the graph changed since it was issued")
+    return payload['o']
+
+
+async def stream_project_graph(graph):
+    """
+    Yields the graph as NDJSON lines, one chunk in memory at a time.
+
+    The status is sent before the body, so a chunk that expires mid-stream
+    ends it with an error line instead of truncating it silently.
+    """
+    yield json.dumps({
+        'type': 'meta',
+        'node_count': graph.node_count,
+        'edge_count': graph.edge_count,
+    }) + '\n'
+
+    try:
+        for kind, line_type in (('nodes', 'node'), ('edges', 'edge')):
+            async for chunk in graph.iter_chunks(kind):
+                yield ''.join(
+                    json.dumps({'type': line_type, 'data': item}, cls=DjangoJSONEncoder) + '\n'
+                    for item in chunk
+                )
+    except GraphCacheMiss:
+        logger.warning(f"Graph cache of {graph.nodeset_name} expired mid-stream")
+        await ainvalidate_project_graph(graph.nodeset_name)
+        yield json.dumps({'type': 'error', 'error': 'stale'}) + '\n'
@@ -0,0 +1,261 @@
+# api/graph_clusters.py
+"""
+Level-of-detail summaries of project graphs.
+
+The subgraph of a nodeset is collapsed bottom-up into a hierarchy of
+super-nodes: each level groups the clusters of the level below by label
+propagation, falling back to degree-based bucketing when communities stop
+merging. A request with a node budget is answered from the finest level that
+fits, and any cluster can be expanded one level at a time.
+"""
+import logging
+from collections import Counter, defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .graph import GRAPH_CACHE_TIMEOUT, load_project_graph
+
+logger = logging.getLogger(__name__)
+
+# Stop building levels once a level is this small
+CLUSTER_TOP_LEVEL_SIZE = getattr(settings, 'GRAPH_CLUSTER_TOP_LEVEL_SIZE', 20)
+
+LABEL_PROPAGATION_ROUNDS = 10
+
+# A level that keeps more than this share of its inputs counts as stalled
+STALL_RATIO = 0.9
+
+BUCKET_SIZE = 4
+
+
+def cluster_id(level, index):
+    return f"cluster:{level}:{index}"
+
+
+def parse_cluster_id(value):
+    """
+    Returns (level, index) of a cluster id, or raises ValueError.
+    """
+    prefix, level, index = str(value).split(':')
+    if prefix != 'cluster':
+        raise ValueError(f"{value} is not a cluster id")
+    return int(level), int(index)
+
+
+def _adjacency(ids, weighted_edges):
+    adjacency = {node_id: Counter() for node_id in ids}
+    for source, target, weight in weighted_edges:
+        if source == target or source not in adjacency or target not in adjacency:
+            continue
+        adjacency[source][target] += weight
+        adjacency[target][source] += weight
+    return adjacency
+
+
+def label_propagation(ids, adjacency):
+    """
+    Deterministic label propagation. Returns {node_id: label}.
+    """
+    labels = {node_id: node_id for node_id in ids}
+    # Visiting hubs first lets their labels spread before the periphery settles
+    order = sorted(ids, key=lambda node_id: (-sum(adjacency[node_id].values()), str(node_id)))
+
+    for _ in range(LABEL_PROPAGATION_ROUNDS):
+        changed = False
+        for node_id in order:
+            neighbours = adjacency[node_id]
+            if not neighbours:
+                continue
+            scores = Counter()
+            for neighbour, weight in neighbours.items():
+                scores[labels[neighbour]] += weight
+            best = max(scores.values())
+            label = min((candidate for candidate, score in scores.items() if score == best), key=str)
+            if label != labels[node_id]:
+                labels[node_id] = label
+                changed = True
+        if not changed:
+            break
+
+    return labels
+
+
+def degree_buckets(ids, adjacency, target_count):
+    """
+    Keeps the target_count highest-degree nodes as hubs, attaches every other
+    node to its most strongly connected hub, and packs the rest into small buckets.
+    Returns a list of groups.
+    """
+    order = sorted(ids, key=lambda node_id: (-sum(adjacency[node_id].values()), str(node_id)))
+    hubs = {node_id: [node_id] for node_id in order[:target_count]}
+    leftovers = []
+
+    for node_id in order[target_count:]:
+        linked_hubs = [(weight, str(hub), hub) for hub, weight in adjacency[node_id].items() if hub in hubs]
+        if linked_hubs:
+            hubs[max(linked_hubs, key=lambda linked: linked[:2])[2]].append(node_id)
+        else:
+            leftovers.append(node_id)
+
+    groups = list(hubs.values())
+    groups.extend(leftovers[i:i + BUCKET_SIZE] for i in range(0, len(leftovers), BUCKET_SIZE))
+    return groups
+
+
+def _group(ids, weighted_edges):
+    adjacency = _adjacency(ids, weighted_edges)
+    labels = label_propagation(ids, adjacency)
+
+    groups = defaultdict(list)
+    for node_id in ids:
+        groups[labels[node_id]].append(node_id)
+    groups = list(groups.values())
+
+    if len(groups) > STALL_RATIO * len(ids):
+        groups = degree_buckets(ids, adjacency, max(1, len(ids) // BUCKET_SIZE))
+
+    return groups, adjacency
+
+
+def build_cluster_hierarchy(nodes_data, edges_data):
+    """
+    Collapses a graph into levels of super-nodes.
+
+    Returns a list of levels, level 1 first. Each level is a dict with
+    ``clusters`` ({cluster_id: {'children', 'size', 'label'}}) and ``edges``
+    ([(source, target, weight)] between clusters of that level).
+    """
+    names = {node_id: (props or {}).get('name') or str(node_id) for node_id, props in nodes_data}
+    ids = list(names)
+    sizes = {node_id: 1 for node_id in ids}
+    weighted_edges = [(edge[0], edge[1], 1) for edge in edges_data]
+
+    levels = []
+    while len(ids) > CLUSTER_TOP_LEVEL_SIZE:
+        groups, adjacency = _group(ids, weighted_edges)
+        if len(groups) >= len(ids):
+            break
+
+        level = len(levels) + 1
+        parents = {}
+        clusters = {}
+        for index, children in enumerate(groups):
+            new_id = cluster_id(level, index)
+            # Name the cluster after its best connected member
+            anchor = max(children, key=lambda child: (sum(adjacency[child].values()), str(child)))
+            clusters[new_id] = {
+                'children': children,
+                'size': sum(sizes[child] for child in children),
+                'label': names[anchor],
+            }
+            for child in children:
+                parents[child] = new_id
+
+        merged = Counter()
+        for source, target, weight in weighted_edges:
+            a, b = parents.get(source), parents.get(target)
+            if a is None or b is None or a == b:
+                continue
+            merged[tuple(sorted((a, b)))] += weight
+        weighted_edges = [(a, b, weight) for (a, b), weight in merged.items()]
+
+        levels.append({'clusters': clusters, 'edges': weighted_edges})
+        names = {new_id: cluster['label'] for new_id, cluster in clusters.items()}
+        sizes = {new_id: cluster['size'] for new_id, cluster in clusters.items()}
+        ids = list(clusters)
+
+    return levels
+
+
+def _cluster_node(level, cluster_key, cluster):
+    return (cluster_key, {
+        'name': cluster['label'],
+        'type': 'Cluster',
+        'level': level,
+        'size': cluster['size'],
+    })
+
+
+def _cluster_edge(source, target, weight):
+    return (source, target, 'clustered_with', {'weight': weight})
+
+
+def _hierarchy_key(graph):
+    return f"graph:{graph.nodeset_name}:v{graph.version}:clusters"
+
+
+async def load_cluster_hierarchy(graph):
+    """
+    Returns the cached hierarchy of a ProjectGraph, building it on a miss.
+    The build is pure Python and runs in a worker thread, off the event loop.
+    """
+    key = _hierarchy_key(graph)
+    levels = await cache.aget(key)
+    if levels is None:
+        nodes_data, edges_data = await graph.all()
+        levels = await sync_to_async(build_cluster_hierarchy, thread_sensitive=False)(nodes_data, edges_data)
+        await cache.aset(key, levels, timeout=GRAPH_CACHE_TIMEOUT)
+        logger.info(f"Built {len(levels)} cluster levels for {graph.nodeset_name}")
+    return levels
+
+
+async def precompute_cluster_hierarchy(nodeset_name):
+    graph = await load_project_graph(nodeset_name)
+    return await load_cluster_hierarchy(graph)
+
+
+async def summarize_graph(graph, max_nodes):
+    """
+    Returns (nodes_data, edges_data, level) with at most max_nodes nodes where
+    the hierarchy allows it. Level 0 is the raw graph.
+    """
+    if graph.node_count <= max_nodes:
+        nodes_data, edges_data = await graph.all()
+        return nodes_data, edges_data, 0
+
+    levels = await load_cluster_hierarchy(graph)
+    if not levels:
+        nodes_data, edges_data = await graph.all()
+        return nodes_data, edges_data, 0
+
+    # Finest level within budget, or the coarsest one we have
+    level = next(
+        (number for number, data in enumerate(levels, start=1) if len(data['clusters']) <= max_nodes),
+        len(levels),
+    )
+    data = levels[level - 1]
+    nodes_data = [_cluster_node(level, key, cluster) for key, cluster in data['clusters'].items()]
+    edges_data = [_cluster_edge(*edge) for edge in data['edges']]
+    return nodes_data, edges_data, level
+
+
+async def expand_cluster(graph, value):
+    """
+    Returns (nodes_data, edges_data, level) for the children of one cluster
+    and the edges between them. Raises ValueError for unknown clusters.
+    """
+    level, _ = parse_cluster_id(value)
+    levels = await load_cluster_hierarchy(graph)
+    if not 1 <= level <= len(levels) or value not in levels[level - 1]['clusters']:
+        raise ValueError(f"Unknown cluster {value}")
+
+    children = set(levels[level - 1]['clusters'][value]['children'])
+
+    if level == 1:
+        nodes_data, edges_data = await graph.all()
+        nodes_data = [node for node in nodes_data if node[0] in children]
+        edges_data = [edge for edge in edges_data if edge[0] in children and edge[1] in children]
+        return nodes_data, edges_data, 0
+
+    below = levels[level - 2]
+    nodes_data = [
+        _cluster_node(level - 1, key, below['clusters'][key])
+        for key in levels[level - 1]['clusters'][value]['children']
+    ]
+    edges_data = [
+        _cluster_edge(*edge) for edge in below['edges']
+        if edge[0] in children and edge[1] in children
+    ]
+    return nodes_data, edges_data, level - 1
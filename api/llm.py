@@ -0,0 +1,310 @@
+# api/llm.py
+"""
+Process-level registry of Ollama chat models.
+
+chat_response used to build a ChatOllama, with its own HTTP client, and to
+dedent the system prompt on every request. Here the system message is built
+once at import and one ChatOllama per model name is kept per event loop (an
+httpx client cannot be shared between loops), so its pooled keep-alive
+connections to Ollama are reused and a request goes straight to streaming.
+
+Models are configured in settings.LLM_MODELS by name, each entry holding
+ChatOllama arguments (model, temperature, num_ctx, ...).
+
+Ollama reuses the evaluated tokens of the previous prompt when the next one
+starts with the same text, as long as the model stays loaded. Models are
+therefore kept loaded with keep_alive and a fixed num_ctx (changing it reloads
+the model), every prompt starts with the same system message, and the first
+use of a model in a process evaluates that message ahead of any request.
+Prompt evaluation time and tokens of each generation are summed up per model
+in Redis, see generation_metrics().
+"""
+import asyncio
+import logging
+import textwrap
+import time
+import weakref
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django_redis import get_redis_connection
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'chat'
+
+DEFAULT_MODEL_SETTINGS = {
+    'model': 'gemma3:4b',
+    'temperature': 0,
+    'keep_alive': '30m',
+    'num_ctx': 8192,
+}
+
+METRICS_KEY_PREFIX = 'llm_metrics:'
+
+# Durations reported by Ollama, in nanoseconds
+METRIC_FIELDS = (
+    'prompt_eval_count',
+    'prompt_eval_duration',
+    'load_duration',
+    'eval_count',
+    'eval_duration',
+)
+
+SYSTEM_PROMPT = textwrap.dedent("""
+    PROMPT="You are a very strong reasoner and planner. Use these critical instructions to structure your plans, thoughts, and responses.
+
+    Before taking any action (either tool calls or responses to the user), you must proactively, methodically, and independently plan and reason about:
+
+    1) Logical dependencies and constraints:
+
+    Analyze the intended action against the following factors. Resolve conflicts in order of importance:
+    1.1) Policy-based rules, mandatory prerequisites, and constraints.
+    1.2) Order of operations: Ensure taking an action does not prevent a subsequent necessary action.
+
+    1.2.1) The user may request actions in a random order, but you may need to reorder operations to maximize successful completion of the task.
+    1.3) Other prerequisites (information and/or actions needed).
+    1.4) Explicit user constraints or preferences.
+
+    2) Risk assessment:
+
+    What are the consequences of taking the action? Will the new state cause any future issues?
+    2.1) For exploratory tasks (like searches), missing optional parameters is a LOW risk.
+    Prefer calling the tool with the available information over asking the user, unless your Rule 1 (Logical Dependencies) reasoning determines that optional information is required for a later step in your plan.
+
+    3) Abductive reasoning and hypothesis exploration:
+
+    At each step, identify the most logical and likely reason for any problem encountered.
+    3.1) Look beyond immediate or obvious causes. The most likely reason may not be the simplest and may require deeper inference.
+    3.2) Hypotheses may require additional research. Each hypothesis may take multiple steps to test.
+    3.3) Prioritize hypotheses based on likelihood, but do not discard less likely ones prematurely. A low-probability event may still be the root cause.
+
+    4) Outcome evaluation and adaptability:
+
+    Does the previous observation require any changes to your plan?
+    4.1) If your initial hypotheses are disproven, actively generate new ones based on gathered information.
+
+    5) Information availability:
+
+    Incorporate all applicable and alternative sources of information, including:
+    5.1) Using available tools and their capabilities
+    5.2) All policies, rules, checklists, and constraints
+    5.3) Previous observations and conversation history
+    5.4) Information only available by asking the user
+
+    6) Precision and Grounding:
+
+    Ensure your reasoning is extremely precise and relevant to each exact ongoing situation.
+    6.1) Verify your claims by quoting the exact applicable information (including policies) when referring to them.
+
+    7) Completeness:
+
+    Ensure that all requirements, constraints, options, and preferences are exhaustively incorporated into your plan.
+    7.1) Resolve conflicts using the order of importance in #1.
+    7.2) Avoid premature conclusions: There may be multiple relevant options for a given situation.
+
+    7.2.1) To check whether an option is relevant, reason about all information sources from #5.
+    7.2.2) You may need to consult the user to even know whether something is applicable. Do not assume it is not applicable without checking.
+    7.3) Review applicable sources of information from #5 to confirm which are relevant to the current state.
+
+    8) Persistence and patience:
+
+    Do not give up unless all the reasoning above is exhausted.
+    8.1) Don't be dissuaded by time taken or user frustration.
+    8.2) This persistence must be intelligent:
+    - On transient errors (e.g. please try again), you must retry unless an explicit retry limit (e.g. max x tries) has been reached. If such a limit is hit, you must stop.
+    - On other errors, you must change your strategy or arguments, not repeat the same failed call.
+
+    9) Inhibit your response:
+
+    Only take an action after all the above reasoning is completed. Once you’ve taken an action, you cannot take it back."
+""")
+
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+
+def chat_messages(user_message, history=(), facts=''):
+    """
+    The prompt for a turn: the system message, the earlier turns, facts
+    retrieved for this message, then the message. The facts go after the
+    history so that the system message and earlier turns stay a prefix the
+    model has already evaluated. They are not kept in the history, so the
+    next prompt differs from this one where they were, and the message and
+    reply after them are evaluated again on the next turn.
+    """
+    messages = [SYSTEM_MESSAGE, *history]
+    if facts:
+        messages.append(SystemMessage(content=f"Facts from the project's knowledge graph:\n{facts}"))
+    messages.append(HumanMessage(content=user_message))
+    return messages
+
+
+def model_settings(name=DEFAULT_MODEL):
+    return {**DEFAULT_MODEL_SETTINGS, **getattr(settings, 'LLM_MODELS', {}).get(name, {})}
+
+
+class LLMRegistry:
+
+    def __init__(self):
+        self._models = weakref.WeakKeyDictionary()
+        self._embeddings = weakref.WeakKeyDictionary()
+        # Ollama holds the evaluated prefix for the whole process, warm it once
+        self._warmed = set()
+        self._warmups = set()
+
+    def get(self, name=DEFAULT_MODEL):
+        """
+        Returns the running loop's ChatOllama for a configured model name.
+        """
+        models = self._models.setdefault(asyncio.get_running_loop(), {})
+        llm = models.get(name)
+        if llm is None:
+            llm = models[name] = self.build(name)
+        if name not in self._warmed and getattr(settings, 'LLM_WARMUP', True):
+            self._warmed.add(name)
+            task = asyncio.create_task(warm_up(llm))
+            self._warmups.add(task)
+            task.add_done_callback(self._warmups.discard)
+        return llm
+
+    def embeddings(self):
+        """
+        Returns the running loop's OllamaEmbeddings for OLLAMA_EMBEDDING_MODEL.
+        """
+        loop = asyncio.get_running_loop()
+        embeddings = self._embeddings.get(loop)
+        if embeddings is None:
+            embeddings = self._embeddings[loop] = OllamaEmbeddings(
+                model=getattr(settings, 'OLLAMA_EMBEDDING_MODEL', 'nomic-embed-text'),
+                keep_alive=60 * 30,
+                **self._connection_settings(),
+            )
+        return embeddings
+
+    def build(self, name=DEFAULT_MODEL):
+        return ChatOllama(**self._connection_settings(), **model_settings(name))
+
+    def _connection_settings(self):
+        timeout = getattr(settings, 'OLLAMA_TIMEOUT', 120.0)
+        return {
+            'base_url': getattr(settings, 'OLLAMA_BASE_URL', None),
+            'client_kwargs': {
+                'timeout': httpx.Timeout(timeout, connect=min(timeout, 5.0)),
+                'limits': httpx.Limits(max_connections=50, max_keepalive_connections=20),
+            },
+        }
+
+    def clear(self):
+        self._models = weakref.WeakKeyDictionary()
+        self._embeddings = weakref.WeakKeyDictionary()
+        self._warmed = set()
+
+
+llm_registry = LLMRegistry()
+
+
+async def warm_up(llm):
+    """
+    Loads the model and evaluates the system message, generating a single token.
+    """
+    options = {'num_predict': 1}
+    if llm.num_ctx:
+        options['num_ctx'] = llm.num_ctx
+    try:
+        await llm.ainvoke([SYSTEM_MESSAGE], options=options)
+    except Exception as e:
+        logger.warning(f"Warming up {llm.model} failed: {e}")
+
+
+async def stream_chat(messages, name=DEFAULT_MODEL, usage=None):
+    """
+    Yields the text of the model's answer as it is generated, then records
+    the generation's metrics. Ollama's final counts (prompt_eval_count,
+    eval_count, ...) are copied into the usage dict if one is given.
+    """
+    started = time.perf_counter()
+    first_token = None
+    metadata = {}
+    async for chunk in llm_registry.get(name).astream(messages):
+        if chunk.content:
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            yield chunk.content
+        if chunk.response_metadata.get('done'):
+            metadata = chunk.response_metadata
+
+    if usage is not None:
+        usage.update(metadata)
+    await sync_to_async(record_generation)(name, metadata, first_token)
+
+
+def record_generation(name, metadata, first_token):
+    prompt_eval_ms = (metadata.get('prompt_eval_duration') or 0) / 1e6
+    logger.info(
+        f"{name} evaluated {metadata.get('prompt_eval_count')} prompt tokens in {prompt_eval_ms:.1f}ms",
+        extra={
+            'model': name,
+            'prompt_eval_count': metadata.get('prompt_eval_count'),
+            'prompt_eval_ms': round(prompt_eval_ms, 1),
+            'ttft_ms': round(first_token * 1000, 1) if first_token is not None else None,
+        },
+    )
+    try:
+        key = f"{METRICS_KEY_PREFIX}{name}"
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        pipe.hincrby(key, 'requests', 1)
+        for field in METRIC_FIELDS:
+            pipe.hincrby(key, field, int(metadata.get(field) or 0))
+        if first_token is not None:
+            pipe.hincrby(key, 'first_token_requests', 1)
+            pipe.hincrby(key, 'first_token_duration', int(first_token * 1e9))
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record LLM metrics: {e}")
+
+
+def generation_metrics():
+    """
+    Returns averages per model since the counters were last reset.
+    """
+    conn = get_redis_connection('default')
+    metrics = {}
+    for key in conn.scan_iter(match=f"{METRICS_KEY_PREFIX}*"):
+        totals = {field.decode(): int(value) for field, value in conn.hgetall(key).items()}
+        requests = totals.get('requests', 0)
+        if not requests:
+            continue
+        first_token_requests = totals.get('first_token_requests', 0)
+        metrics[key.decode()[len(METRICS_KEY_PREFIX):]] = {
+            'requests': requests,
+            'avg_prompt_eval_tokens': totals.get('prompt_eval_count', 0) / requests,
+            'avg_prompt_eval_ms': totals.get('prompt_eval_duration', 0) / requests / 1e6,
+            'avg_load_ms': totals.get('load_duration', 0) / requests / 1e6,
+            'avg_ttft_ms': (
+                totals.get('first_token_duration', 0) / first_token_requests / 1e6
+                if first_token_requests else None
+            ),
+            'eval_tokens_per_second': (
+                totals.get('eval_count', 0) / (totals['eval_duration'] / 1e9)
+                if totals.get('eval_duration') else None
+            ),
+        }
+    return metrics
+
+
+def reset_generation_metrics():
+    conn = get_redis_connection('default')
+    keys = list(conn.scan_iter(match=f"{METRICS_KEY_PREFIX}*"))
+    if keys:
+        conn.delete(*keys)
+
+
+@receiver(setting_changed)
+def _reset_llm_registry(setting, **kwargs):
+    if setting in ('LLM_MODELS', 'LLM_WARMUP', 'OLLAMA_BASE_URL', 'OLLAMA_TIMEOUT', 'OLLAMA_EMBEDDING_MODEL'):
+        llm_registry.clear()
@@ -0,0 +1,176 @@
+# api/log.py
+"""
+Structured, non-blocking logging.
+
+Records are filtered in the calling thread, then handed to a QueueListener
+thread which formats them as one JSON object per line and writes them out, so
+a request never waits on log I/O.
+
+RequestIdMiddleware (and WebSocketScopeLogger for sockets) gives every request
+an id, taken from the X-Request-ID header when present, which is added to all
+records logged while handling it. It also decides once per request whether
+its INFO and DEBUG records are kept, from the rate configured for the route in
+LOG_SAMPLING_RATES. Warnings and errors are always kept.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+sampled_var = contextvars.ContextVar('log_sampled', default=True)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Attributes every LogRecord has, anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+
+def sampling_rate(route):
+    rates = getattr(settings, 'LOG_SAMPLING_RATES', {})
+    return rates.get(route, rates.get('default', 1.0))
+
+
+def begin(request_id=None, route=None):
+    """
+    Sets the request id and sampling decision for the current context.
+    Returns tokens for end().
+    """
+    if not request_id or not _VALID_REQUEST_ID.match(request_id):
+        request_id = uuid.uuid4().hex
+    rate = sampling_rate(route)
+    sampled = rate >= 1 or random.random() < rate
+    return request_id_var.set(request_id), sampled_var.set(sampled)
+
+
+def end(tokens):
+    request_id_token, sampled_token = tokens
+    request_id_var.reset(request_id_token)
+    sampled_var.reset(sampled_token)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Drops INFO and DEBUG records of requests that were not sampled.
+    """
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or sampled_var.get()
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+    def formatTime(self, record, datefmt=None):
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z'
+
+
+class QueueLogHandler(QueueHandler):
+    """
+    Puts records on an in-memory queue. A listener thread writes them to
+    stderr with this handler's formatter.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream)
+        self.listener = None
+        self._start()
+        atexit.register(self._stop)
+        # The listener thread does not survive a fork (Celery prefork, gunicorn)
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def _stop(self):
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """
+        Resolves the message now, the arguments may change before the
+        listener gets to them. Formatting is left to the listener.
+        """
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RequestIdMiddleware:
+    """
+    Gives every request an id and a sampling decision, echoes the id in the
+    X-Request-ID response header and logs one line per request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            route = resolve(request.path_info).url_name
+        except Resolver404:
+            route = None
+
+        tokens = begin(request.headers.get(REQUEST_ID_HEADER), route)
+        started = time.monotonic()
+        try:
+            response = self.get_response(request)
+            response[REQUEST_ID_HEADER] = request_id_var.get()
+            logger.log(
+                logging.ERROR if response.status_code >= 500 else logging.INFO,
+                f"{request.method} {request.path} {response.status_code}",
+                extra={
+                    'route': route,
+                    'method': request.method,
+                    'status': response.status_code,
+                    'duration_ms': round((time.monotonic() - started) * 1000, 1),
+                },
+            )
+            return response
+        finally:
+            end(tokens)
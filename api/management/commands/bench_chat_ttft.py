@@ -0,0 +1,142 @@
+# management/commands/bench_chat_ttft.py
+
+import asyncio
+import json
+import statistics
+import textwrap
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from langchain_ollama import ChatOllama
+
+from api.llm import SYSTEM_PROMPT, chat_messages, model_settings, stream_chat
+
+
+class FakeOllamaServer:
+    """
+    Answers /api/chat like Ollama, streaming `tokens` chunks over a keep-alive
+    connection. first_token_delay simulates the prompt evaluation.
+    """
+
+    def __init__(self, tokens=20, first_token_delay=0.0):
+        self.tokens = tokens
+        self.first_token_delay = first_token_delay
+        self.requests = []
+        self.connections = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                server.connections += 1
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                server.requests.append(body)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                time.sleep(server.first_token_delay)
+                for chunk in server.chunks(body):
+                    data = json.dumps(chunk).encode() + b'\n'
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def chunks(self, body):
+        for i in range(self.tokens):
+            yield {
+                'model': body.get('model'),
+                'created_at': '2025-01-01T00:00:00Z',
+                'message': {'role': 'assistant', 'content': f"token{i} "},
+                'done': False,
+            }
+        yield {
+            'model': body.get('model'),
+            'created_at': '2025-01-01T00:00:00Z',
+            'message': {'role': 'assistant', 'content': ''},
+            'done': True,
+            'done_reason': 'stop',
+            'prompt_eval_count': 1000,
+            'prompt_eval_duration': int(self.first_token_delay * 1e9),
+            'eval_count': self.tokens,
+            'eval_duration': 1_000_000 * self.tokens,
+        }
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class Command(BaseCommand):
+    help = 'Time to first token of chat_response, per-request clients against the shared registry'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=50)
+        parser.add_argument('--tokens', type=int, default=20)
+        parser.add_argument('--first-token-delay-ms', type=float, default=0.0)
+        parser.add_argument('--url', help='Benchmark a real Ollama at this URL instead of the fake server')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            self._report(options['url'], options['runs'])
+            return
+
+        with FakeOllamaServer(options['tokens'], options['first_token_delay_ms'] / 1000) as server:
+            self._report(server.url, options['runs'])
+            self.stdout.write(f"  {server.connections} connections for {len(server.requests)} requests")
+
+    def _report(self, url, runs):
+        with override_settings(OLLAMA_BASE_URL=url, LLM_WARMUP=False):
+            results = asyncio.run(self._run(url, runs))
+
+        self.stdout.write(f"Time to first token, {runs} runs against {url}")
+        for name, samples in results.items():
+            samples.sort()
+            p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            self.stdout.write(
+                f"  {name:<24} p50 {statistics.median(samples) * 1000:8.2f}ms  p95 {p95 * 1000:8.2f}ms"
+            )
+
+    async def _run(self, url, runs):
+        # The prompt as it was written inline in the view
+        inline_prompt = textwrap.indent(SYSTEM_PROMPT, ' ' * 8)
+
+        def per_request():
+            # The previous chat_response: a new client and a dedent per request
+            llm = ChatOllama(base_url=url, model=model_settings()['model'], temperature=0)
+            messages = [("system", textwrap.dedent(inline_prompt)), ("human", "hello")]
+            return (chunk.content async for chunk in llm.astream(messages) if chunk.content)
+
+        def registry():
+            return stream_chat(chat_messages("hello"))
+
+        results = {'per-request ChatOllama': [], 'registry': []}
+        for _ in range(runs):
+            for name, start_stream in (('per-request ChatOllama', per_request), ('registry', registry)):
+                started = time.perf_counter()
+                first = None
+                async for _ in start_stream():
+                    if first is None:
+                        first = time.perf_counter() - started
+                results[name].append(first)
+        return results
+
+# Run this command with: python manage.py bench_chat_ttft --runs 50
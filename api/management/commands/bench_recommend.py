@@ -0,0 +1,63 @@
+# management/commands/bench_recommend.py
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.models import User
+from api.recommendations import delete_recommendations
+from api.tasks import recommend_vocab, recommend_vocab_batch
+
+
+class Command(BaseCommand):
+    help = 'Compares recommendations per second of recommend_vocab against recommend_vocab_batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        user_ids = list(
+            User.objects.exclude(embedding=None)
+            .order_by('id')
+            .values_list('id', flat=True)[:options['users']]
+        )
+        if not user_ids:
+            self.stdout.write(self.style.ERROR('No users with an embedding to benchmark'))
+            return
+
+        def per_user():
+            for user_id in user_ids:
+                recommend_vocab(user_id)
+
+        def batched():
+            for offset in range(0, len(user_ids), options['batch_size']):
+                recommend_vocab_batch(user_ids[offset:offset + options['batch_size']])
+
+        # Tasks run inline here, the broker is not involved. Both compute phases
+        # start from an empty store, otherwise the second would only read it.
+        per_user_elapsed = self._time(per_user, user_ids)
+        batch_elapsed = self._time(batched, user_ids)
+        # Lists stored by the batch phase, as served between refreshes
+        stored_elapsed = self._time(batched, user_ids, clear=False)
+        delete_recommendations(user_ids)
+
+        self.stdout.write(f"{len(user_ids)} users")
+        self.stdout.write(f"  recommend_vocab:               {len(user_ids) / per_user_elapsed:8.1f} recs/s")
+        self.stdout.write(self.style.SUCCESS(
+            f"  recommend_vocab_batch:         {len(user_ids) / batch_elapsed:8.1f} recs/s "
+            f"({per_user_elapsed / batch_elapsed:.1f}x)"
+        ))
+        self.stdout.write(
+            f"  recommend_vocab_batch, stored: {len(user_ids) / stored_elapsed:8.1f} recs/s "
+            f"({per_user_elapsed / stored_elapsed:.1f}x)"
+        )
+
+    def _time(self, run, user_ids, clear=True):
+        if clear:
+            delete_recommendations(user_ids)
+        start = time.perf_counter()
+        run()
+        return time.perf_counter() - start
+
+# Run this command with: python manage.py bench_recommend --users 1000 --batch-size 200
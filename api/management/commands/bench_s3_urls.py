@@ -0,0 +1,86 @@
+# management/commands/bench_s3_urls.py
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.utils import S3URLResolver, resolve_audio_urls
+
+
+def _per_field_url(path):
+    # The previous get_s3_audio_url: settings are read on every call
+    if not path:
+        return None
+    if str(path).startswith('http://') or str(path).startswith('https://'):
+        return path
+    aws_domain = getattr(settings, 'AWS_S3_CUSTOM_DOMAIN', None)
+    clean_path = str(path).lstrip('/')
+    if aws_domain:
+        return f"https://{aws_domain}/{clean_path}"
+    media_url = getattr(settings, 'MEDIA_URL', '/media/')
+    return f"{media_url}{clean_path}"
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark of per-field S3 URL construction against the bulk resolver'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000)
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        def make_rows():
+            return [
+                {'word_audio': f"words/{i}.mp3", 'sentence_audio': f"/sentences/{i}.mp3"}
+                for i in range(options['rows'])
+            ]
+
+        def per_field(rows):
+            for item in rows:
+                if item.get('word_audio'):
+                    item['word_audio'] = _per_field_url(item['word_audio'])
+                if item.get('sentence_audio'):
+                    item['sentence_audio'] = _per_field_url(item['sentence_audio'])
+
+        results = {
+            'per-field get_s3_audio_url': self._time(per_field, make_rows, options['runs']),
+            'bulk resolve_audio_urls': self._time(resolve_audio_urls, make_rows, options['runs']),
+        }
+
+        signer = self._test_signer()
+        if signer is not None:
+            resolver = S3URLResolver(signer.domain, signer=signer)
+            results['bulk, CloudFront signed'] = self._time(resolver.resolve_rows, make_rows, options['runs'])
+
+        self.stdout.write(f"{options['rows']} rows, best of {options['runs']} runs")
+        for name, elapsed in results.items():
+            self.stdout.write(f"  {name:<28} {elapsed * 1000:8.2f}ms")
+
+    def _time(self, resolve, make_rows, runs):
+        best = float('inf')
+        for _ in range(runs):
+            rows = make_rows()
+            start = time.perf_counter()
+            resolve(rows)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    def _test_signer(self):
+        try:
+            from cryptography.hazmat.primitives import serialization
+            from cryptography.hazmat.primitives.asymmetric import rsa
+        except ImportError:
+            return None
+
+        from api.utils import CloudFrontPolicySigner
+
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        pem = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ).decode()
+        return CloudFrontPolicySigner('BENCHKEY', pem, 'cdn.example.com', 3600)
+
+# Run this command with: python manage.py bench_s3_urls --rows 10000
@@ -0,0 +1,107 @@
+# management/commands/bench_vocab_ann.py
+
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.vector_search import _set_search_params
+
+
+TABLE = 'bench_vocab_ann'
+
+
+def _vector_literal(vector):
+    return '[' + ','.join(f"{value:.6f}" for value in vector) + ']'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks ANN vocab search against an exact scan on scratch tables. '
+        'Reports p50/p99 latency and recall@k for each table size.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--dim', type=int, default=384)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--index', choices=['hnsw', 'ivfflat'], default='hnsw')
+        parser.add_argument('--ef-search', type=int, default=None)
+        parser.add_argument('--probes', type=int, default=None)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+
+        for size in options['sizes']:
+            self.stdout.write(f"Building {size} rows of dim {options['dim']}...")
+            self._build_table(size, options['dim'], options['index'])
+
+            queries = rng.random((options['queries'], options['dim']), dtype=np.float32)
+            ann_latencies, exact_latencies, recalls = [], [], []
+
+            for query in queries:
+                literal = _vector_literal(query)
+
+                start = time.perf_counter()
+                ann_ids = self._search(literal, options['k'], exact=False,
+                                       ef_search=options['ef_search'], probes=options['probes'])
+                ann_latencies.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                exact_ids = self._search(literal, options['k'], exact=True)
+                exact_latencies.append((time.perf_counter() - start) * 1000)
+
+                recalls.append(len(set(ann_ids) & set(exact_ids)) / options['k'])
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{size:>9} rows | {options['index']}: p50 {np.percentile(ann_latencies, 50):.2f}ms "
+                f"p99 {np.percentile(ann_latencies, 99):.2f}ms | exact: p50 "
+                f"{np.percentile(exact_latencies, 50):.2f}ms p99 {np.percentile(exact_latencies, 99):.2f}ms "
+                f"| recall@{options['k']} {np.mean(recalls):.3f}"
+            ))
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+    def _build_table(self, size, dim, index):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+            cursor.execute(f"CREATE TABLE {TABLE} (id bigserial PRIMARY KEY, embedding vector({dim}))")
+            # Referencing g.i keeps the inner select correlated, so every row gets its own vector
+            cursor.execute(
+                f"""
+                INSERT INTO {TABLE} (embedding)
+                SELECT (SELECT array_agg(random() + 0 * g.i) FROM generate_series(1, %s))::vector
+                FROM generate_series(1, %s) AS g(i)
+                """,
+                [dim, size],
+            )
+            if index == 'hnsw':
+                cursor.execute(
+                    f"CREATE INDEX ON {TABLE} USING hnsw (embedding vector_l2_ops) "
+                    f"WITH (m = 16, ef_construction = 64)"
+                )
+            else:
+                lists = max(1, int(size ** 0.5))
+                cursor.execute(
+                    f"CREATE INDEX ON {TABLE} USING ivfflat (embedding vector_l2_ops) WITH (lists = {lists})"
+                )
+            cursor.execute(f"ANALYZE {TABLE}")
+
+    def _search(self, literal, k, exact, ef_search=None, probes=None):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if exact:
+                    cursor.execute("SET LOCAL enable_indexscan = off")
+                else:
+                    _set_search_params(cursor, ef_search, probes)
+                cursor.execute(
+                    f"SELECT id FROM {TABLE} ORDER BY embedding <-> %s::vector LIMIT %s",
+                    [literal, k],
+                )
+                return [row[0] for row in cursor.fetchall()]
+
+# Run this command with: python manage.py bench_vocab_ann --sizes 10000 100000 1000000
@@ -0,0 +1,92 @@
+# management/commands/bench_vocab_sampling.py
+
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.sampling import probe_random_ids
+
+
+TABLE = 'bench_vocab_sampling'
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares ORDER BY random() with the id-probing sampler and TABLESAMPLE '
+        'SYSTEM_ROWS on scratch tables of growing size.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000, 5_000_000])
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--runs', type=int, default=50)
+        # Share of ids deleted after loading, to exercise gap handling
+        parser.add_argument('--gap-ratio', type=float, default=0.3)
+
+    def handle(self, *args, **options):
+        k = options['k']
+
+        for size in options['sizes']:
+            self._build_table(size, options['gap_ratio'])
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT min(id), max(id) FROM {TABLE}")
+                id_min, id_max = cursor.fetchone()
+
+            def fetch_existing(candidate_ids):
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SELECT id FROM {TABLE} WHERE id = ANY(%s)", [candidate_ids])
+                    return [row[0] for row in cursor.fetchall()]
+
+            results = {
+                'order by random()': self._time(
+                    lambda: self._fetch(f"SELECT id FROM {TABLE} ORDER BY random() LIMIT %s", [k]),
+                    options['runs'],
+                ),
+                'id probing': self._time(
+                    lambda: probe_random_ids(fetch_existing, id_min, id_max, k),
+                    options['runs'],
+                ),
+                'tablesample': self._time(
+                    lambda: self._fetch(f"SELECT id FROM {TABLE} TABLESAMPLE SYSTEM_ROWS(%s)", [k]),
+                    options['runs'],
+                ),
+            }
+
+            self.stdout.write(self.style.SUCCESS(f"{size:>9} rows"))
+            for name, latencies in results.items():
+                self.stdout.write(
+                    f"  {name:<18} p50 {np.percentile(latencies, 50):8.2f}ms "
+                    f"p99 {np.percentile(latencies, 99):8.2f}ms"
+                )
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+    def _build_table(self, size, gap_ratio):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS tsm_system_rows")
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+            cursor.execute(f"CREATE TABLE {TABLE} (id bigserial PRIMARY KEY, word text)")
+            cursor.execute(
+                f"INSERT INTO {TABLE} (word) SELECT md5(g::text) FROM generate_series(1, %s) g",
+                [int(size / (1 - gap_ratio))],
+            )
+            cursor.execute(f"DELETE FROM {TABLE} WHERE random() < %s", [gap_ratio])
+            cursor.execute(f"VACUUM ANALYZE {TABLE}")
+
+    def _fetch(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def _time(self, sample, runs):
+        latencies = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            sample()
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+# Run this command with: python manage.py bench_vocab_sampling --sizes 100000 1000000 5000000
@@ -0,0 +1,15 @@
+# management/commands/build_vocab_index.py
+
+from django.core.management.base import BaseCommand
+
+from api.vector_search import build_vocab_index
+
+
+class Command(BaseCommand):
+    help = 'Builds the memory-mapped vocab embedding matrix used by VOCAB_SEARCH_ENGINE=numpy'
+
+    def handle(self, *args, **options):
+        count = build_vocab_index()
+        self.stdout.write(self.style.SUCCESS(f'Vocab index built with {count} rows'))
+
+# Run this command with: python manage.py build_vocab_index
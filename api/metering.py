@@ -0,0 +1,210 @@
+# api/metering.py
+"""
+Translation usage metering in Redis.
+
+Each user has one counter per day and one per month. The period is part of
+the key, so a new day or month starts from a fresh key and the old one
+expires on its own, there is nothing to reset. A Lua script checks both
+limits and increments both counters atomically, which removes the
+read-modify-write on the api_user row. Touched users are recorded in a dirty
+set and a periodic task writes the counters back to the User fields.
+"""
+from datetime import date
+
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+DIRTY_SET_KEY = 'usage:dirty'
+
+DAILY_TTL = 60 * 60 * 24 * 2
+MONTHLY_TTL = 60 * 60 * 24 * 40
+
+# Missing counters are seeded from the User row so a flushed Redis does not reset usage
+CHECK_AND_INCREMENT = """
+redis.call('SET', KEYS[1], ARGV[3], 'NX', 'EX', ARGV[5])
+redis.call('SET', KEYS[2], ARGV[4], 'NX', 'EX', ARGV[6])
+local daily = tonumber(redis.call('GET', KEYS[1]))
+local monthly = tonumber(redis.call('GET', KEYS[2]))
+if daily >= tonumber(ARGV[1]) then
+    return {0, daily, monthly, 1}
+end
+if monthly >= tonumber(ARGV[2]) then
+    return {0, daily, monthly, 2}
+end
+if ARGV[8] == '1' then
+    daily = redis.call('INCR', KEYS[1])
+    monthly = redis.call('INCR', KEYS[2])
+    redis.call('SADD', KEYS[3], ARGV[7])
+end
+return {1, daily, monthly, 0}
+"""
+
+DAILY_LIMIT_MESSAGE = "Daily analysis limit reached. Please upgrade or wait until tomorrow."
+MONTHLY_LIMIT_MESSAGE = "Monthly analysis limit reached. Please upgrade or wait until next month."
+
+# Large enough to never trip, used for unconditional increments
+NO_LIMIT = 2 ** 62
+
+_script = None
+
+
+def _get_script():
+    global _script
+    if _script is None:
+        _script = get_redis_connection('default').register_script(CHECK_AND_INCREMENT)
+    return _script
+
+
+def _daily_key(user_id, day):
+    return f"usage:{user_id}:d:{day:%Y%m%d}"
+
+
+def _monthly_key(user_id, day):
+    return f"usage:{user_id}:m:{day:%Y%m}"
+
+
+def _seeds(user, today):
+    """
+    Counters stored on the User row, if they belong to the current period.
+    """
+    daily = user.daily_translations_used if user.last_translation_date == today else 0
+    last_reset = user.last_monthly_reset
+    monthly = (
+        user.monthly_translations_used
+        if last_reset and (last_reset.year, last_reset.month) == (today.year, today.month)
+        else 0
+    )
+    return daily, monthly
+
+
+def _run(user, increment, enforce_limits=True):
+    today = timezone.now().date()
+    daily_seed, monthly_seed = _seeds(user, today)
+
+    if enforce_limits:
+        tier = user.get_current_tier()
+        daily_limit, monthly_limit = tier.daily_translation_limit, tier.monthly_translation_limit
+    else:
+        daily_limit = monthly_limit = NO_LIMIT
+
+    allowed, daily, monthly, reason = _get_script()(
+        keys=[_daily_key(user.pk, today), _monthly_key(user.pk, today), DIRTY_SET_KEY],
+        args=[
+            daily_limit, monthly_limit,
+            daily_seed, monthly_seed,
+            DAILY_TTL, MONTHLY_TTL,
+            f"{user.pk}:{today:%Y%m%d}",
+            '1' if increment else '0',
+        ],
+    )
+
+    # Keep the in-memory instance in line with the counters
+    user.daily_translations_used = daily
+    user.monthly_translations_used = monthly
+    user.last_translation_date = today
+    user.last_monthly_reset = today.replace(day=1)
+
+    if allowed:
+        return True, "OK"
+    return False, DAILY_LIMIT_MESSAGE if reason == 1 else MONTHLY_LIMIT_MESSAGE
+
+
+def check(user):
+    """
+    Returns (allowed, message) without consuming anything.
+    """
+    return _run(user, increment=False)
+
+
+def consume(user):
+    """
+    Atomically checks the limits and counts one translation if they allow it.
+    Returns (allowed, message).
+    """
+    return _run(user, increment=True)
+
+
+def increment(user):
+    """
+    Counts one translation regardless of the limits.
+    """
+    _run(user, increment=True, enforce_limits=False)
+
+
+def usage(user):
+    """
+    Returns (daily, monthly) translations used in the current day and month.
+    The User fields lag behind the counters and still hold the last period
+    after it ended, they only count for a period that has no counter yet.
+    """
+    today = timezone.now().date()
+    daily, monthly = get_redis_connection('default').mget(
+        _daily_key(user.pk, today),
+        _monthly_key(user.pk, today),
+    )
+    daily_seed, monthly_seed = _seeds(user, today)
+    return (
+        int(daily) if daily is not None else daily_seed,
+        int(monthly) if monthly is not None else monthly_seed,
+    )
+
+
+def reset(user_id):
+    """
+    Starts the current day and month over, e.g. after a new subscription.
+    The User fields should be zeroed as well, they seed the next counters.
+    """
+    today = timezone.now().date()
+    get_redis_connection('default').delete(_daily_key(user_id, today), _monthly_key(user_id, today))
+
+
+def flush_usage(batch_size=1000):
+    """
+    Writes the counters of recently metered users back to their User rows
+    with one bulk update. Returns the number of users written.
+    """
+    from .models import User
+
+    redis = get_redis_connection('default')
+    # Members leave the set only once their rows are written, a failed flush is retried
+    members = redis.srandmember(DIRTY_SET_KEY, batch_size) or []
+    if not members:
+        return 0
+
+    # Only the most recent period of each user matters
+    latest = {}
+    for member in members:
+        user_id, day = member.decode().split(':')
+        day = date(int(day[:4]), int(day[4:6]), int(day[6:]))
+        user_id = int(user_id)
+        if user_id not in latest or latest[user_id] < day:
+            latest[user_id] = day
+
+    user_ids = list(latest)
+    keys = []
+    for user_id in user_ids:
+        keys += [_daily_key(user_id, latest[user_id]), _monthly_key(user_id, latest[user_id])]
+    values = redis.mget(keys)
+
+    users = []
+    for index, user_id in enumerate(user_ids):
+        daily, monthly = values[2 * index], values[2 * index + 1]
+        if daily is None or monthly is None:
+            continue
+        day = latest[user_id]
+        users.append(User(
+            id=user_id,
+            daily_translations_used=int(daily),
+            monthly_translations_used=int(monthly),
+            last_translation_date=day,
+            last_monthly_reset=day.replace(day=1),
+        ))
+
+    User.objects.bulk_update(users, [
+        'daily_translations_used',
+        'monthly_translations_used',
+        'last_translation_date',
+        'last_monthly_reset',
+    ])
+    redis.srem(DIRTY_SET_KEY, *members)
+    return len(users)
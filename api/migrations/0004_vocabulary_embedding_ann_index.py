@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+# The Vocabulary table is managed outside of this app's migration history,
+# so the index is only created where the table and its embedding column exist.
+CREATE_ANN_INDEX = """
+CREATE EXTENSION IF NOT EXISTS vector;
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'api_vocabulary' AND column_name = 'embedding'
+    ) THEN
+        CREATE INDEX IF NOT EXISTS api_vocabulary_embedding_hnsw_idx
+            ON api_vocabulary USING hnsw (embedding vector_l2_ops)
+            WITH (m = 16, ef_construction = 64);
+    END IF;
+END
+$$;
+"""
+
+DROP_ANN_INDEX = "DROP INDEX IF EXISTS api_vocabulary_embedding_hnsw_idx;"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_project_cognee_nodeset_name"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_ANN_INDEX, reverse_sql=DROP_ANN_INDEX),
+    ]
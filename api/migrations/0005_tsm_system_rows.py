@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_vocabulary_embedding_ann_index"),
+    ]
+
+    operations = [
+        # Provides TABLESAMPLE SYSTEM_ROWS for api.sampling
+        migrations.RunSQL(
+            "CREATE EXTENSION IF NOT EXISTS tsm_system_rows;",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:56
+
+import pgvector.django.vector
+from django.db import migrations
+from pgvector.django import VectorExtension
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_tsm_system_rows"),
+    ]
+
+    operations = [
+        VectorExtension(),
+        migrations.AddField(
+            model_name="user",
+            name="embedding",
+            field=pgvector.django.vector.VectorField(blank=True, null=True),
+        ),
+    ]
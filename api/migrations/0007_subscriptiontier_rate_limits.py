@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_user_embedding"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="subscriptiontier",
+            name="requests_per_minute",
+            field=models.IntegerField(default=60),
+        ),
+        migrations.AddField(
+            model_name="subscriptiontier",
+            name="request_burst",
+            field=models.IntegerField(default=20),
+        ),
+    ]
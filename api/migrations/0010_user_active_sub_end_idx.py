@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:20
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Building the index concurrently keeps api_user writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ("api", "0009_paypalwebhookevent"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="user",
+            index=models.Index(
+                condition=models.Q(("is_subscription_active", True)),
+                fields=["subscription_end_date"],
+                name="user_active_sub_end_idx",
+            ),
+        ),
+    ]
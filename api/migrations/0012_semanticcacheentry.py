@@ -0,0 +1,59 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:05
+
+import django.utils.timezone
+import pgvector.django.indexes
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_chatmemory_chatsummary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SemanticCacheEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model", models.CharField(max_length=100)),
+                ("prompt_version", models.CharField(max_length=64)),
+                ("scope", models.CharField(blank=True, max_length=255)),
+                ("question", models.TextField()),
+                ("embedding", pgvector.django.vector.VectorField(dimensions=768)),
+                ("answer", models.TextField()),
+                ("generation_ms", models.FloatField(default=0)),
+                ("hits", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "last_hit_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+            options={
+                "indexes": [
+                    pgvector.django.indexes.HnswIndex(
+                        ef_construction=64,
+                        fields=["embedding"],
+                        m=16,
+                        name="semantic_cache_hnsw_idx",
+                        opclasses=["vector_cosine_ops"],
+                    ),
+                    models.Index(
+                        fields=["model", "prompt_version", "scope"],
+                        name="semantic_cache_scope_idx",
+                    ),
+                    models.Index(fields=["last_hit_at"], name="semantic_cache_lru_idx"),
+                ],
+            },
+        ),
+    ]
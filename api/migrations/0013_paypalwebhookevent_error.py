@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_semanticcacheentry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paypalwebhookevent",
+            name="error",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
@@ -1,12 +1,11 @@
 # api/models.py
 
 from django.db import models
-from django.db.models import F
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from datetime import timedelta
-from pgvector.django import VectorField
+from pgvector.django import HnswIndex, VectorField
 import uuid
 
 
@@ -26,6 +25,9 @@ class SubscriptionTier(models.Model):
     monthly_translation_limit = models.IntegerField()
     daily_translation_limit = models.IntegerField()
     features = models.JSONField(default=list)  # List of features for this tier
+    # Token bucket enforced by api.ratelimit: sustained rate and burst size
+    requests_per_minute = models.IntegerField(default=60)
+    request_burst = models.IntegerField(default=20)
     
     def __str__(self):
         return self.display_name
@@ -60,82 +62,65 @@ class User(AbstractUser):
     last_translation_date = models.DateField(null=True, blank=True)
     last_monthly_reset = models.DateField(null=True, blank=True)
 
+    # Learner position in vocab embedding space, maintained by api.embeddings
+    embedding = VectorField(null=True, blank=True)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Drives the expiry sweep in api.subscriptions, only paying users are in it
+            models.Index(
+                fields=['subscription_end_date'],
+                condition=models.Q(is_subscription_active=True),
+                name='user_active_sub_end_idx',
+            ),
+        ]
+
+
+    def has_active_subscription(self):
+        """The flag may lag behind the end date until the next expiry sweep"""
+        return self.is_subscription_active and (
+            self.subscription_end_date is None or self.subscription_end_date > timezone.now()
+        )
 
-    def reset_usage_counters_if_needed(self):
-        """
-        Atomically checks and resets usage counters if a new day or month has begun.
-        This should be called before checking limits.
-        """
-        today = timezone.now().date()
-        
-        # Reset daily counter if it's a new day
-        if self.last_translation_date != today:
-            self.daily_translations_used = 0
-            self.last_translation_date = today
-
-        # Reset monthly counter if it's a new month
-        if not self.last_monthly_reset or self.last_monthly_reset.month != today.month:
-            self.monthly_translations_used = 0
-            self.last_monthly_reset = today
-        
-        # Note: We don't call self.save() here. 
-        # The save will happen when usage is incremented.
 
-    
     def get_current_tier(self):
-        """Get the current subscription tier or return free tier"""
-        if self.subscription_tier and self.is_subscription_active:
-            return self.subscription_tier
-        else:
-            # Return free tier
-            free_tier, created = SubscriptionTier.objects.get_or_create(
-                name='free',
-                defaults={
-                    'display_name': 'Free',
-                    'price': 0,
-                    'monthly_translation_limit': 150,
-                    'daily_translation_limit': 5,
-                    'features': ['Basic translation', 'Limited vocabulary tracking']
-                }
-            )
-            return free_tier
+        """Get the current subscription tier or return free tier, without touching the DB"""
+        from .tiers import tier_registry
+
+        if self.subscription_tier_id and self.has_active_subscription():
+            tier = tier_registry.get(self.subscription_tier_id)
+            if tier is not None:
+                return tier
+
+        # Return free tier
+        return tier_registry.free()
     
 
     def can_translate(self):
         """Check if user can perform translation based on their tier limits"""
-        self.reset_usage_counters_if_needed()  # Update internal state but don't save yet
-
-        tier = self.get_current_tier()
-        
-        # Check limits
-        if self.daily_translations_used >= tier.daily_translation_limit:
-            return False, "Daily analysis limit reached. Please upgrade or wait until tomorrow."
-        
-        if self.monthly_translations_used >= tier.monthly_translation_limit:
-            return False, "Monthly analysis limit reached. Please upgrade or wait until next month."
-        
-        return True, "OK"
+        from . import metering
+
+        return metering.check(self)
+
+
+    def consume_translation(self):
+        """
+        Checks the tier limits and counts one translation in a single atomic
+        step. Returns (allowed, message); nothing is counted when not allowed.
+        """
+        from . import metering
+
+        return metering.consume(self)
 
     
     def increment_translation_usage(self):
         """
-        Atomically increments translation usage counters using F() expressions
-        to prevent race conditions.
+        Atomically increments translation usage counters in Redis. The User
+        fields are written back periodically by api.tasks.flush_translation_usage.
         """
-        # Ensure counters are correctly set for today before incrementing
-        self.reset_usage_counters_if_needed() 
-        
-        # Atomically increment the counters in the database
-        self.daily_translations_used = F('daily_translations_used') + 1
-        self.monthly_translations_used = F('monthly_translations_used') + 1
-        
-        # Save all changes at once (reset dates and incremented counters)
-        self.save(update_fields=[
-            'daily_translations_used', 
-            'monthly_translations_used', 
-            'last_translation_date',
-            'last_monthly_reset'
-        ])
+        from . import metering
+
+        metering.increment(self)
 
 
 class PaymentTransaction(models.Model):
@@ -144,6 +129,7 @@ class PaymentTransaction(models.Model):
     """
     STATUS_CHOICES = [
         ('pending', 'Pending'),
+        ('capturing', 'Capturing'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
         ('cancelled', 'Cancelled'),
@@ -168,11 +154,49 @@ class PaymentTransaction(models.Model):
     # Payment verification
     is_verified = models.BooleanField(default=False)
     verification_date = models.DateTimeField(null=True, blank=True)
+
+    # Set when the capture call to PayPal starts, see api.payments
+    capture_started_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['capture_started_at'],
+                condition=models.Q(status='capturing'),
+                name='payment_capturing_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"Payment {self.paypal_order_id} - {self.user.email} - {self.amount} {self.currency}"
     
 
+class PayPalWebhookEvent(models.Model):
+    """
+    Raw PayPal webhook deliveries, stored as received after the signature check.
+    Rows are only ever inserted; api.webhooks marks them processed in batches.
+    An event that could not be applied is marked processed with its error.
+    """
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['received_at'],
+                condition=models.Q(processed_at__isnull=True),
+                name='webhook_unprocessed_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id}"
+
+
 class Project(models.Model):
     """
     Model to store data for each Project
@@ -190,8 +214,74 @@ class Project(models.Model):
 
 class ChatMemory(models.Model):
     """
-    Model to store chat data for each Project
+    One chat message of a Project. Rows are only ever inserted, older ones
+    are folded into the project's ChatSummary by api.chat.
     """
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    ROLE_CHOICES = [
+        ('human', 'Human'),
+        ('ai', 'AI'),
+    ]
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='chat_memories')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    content = models.TextField()
+    token_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'created_at'], name='chat_memory_project_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.role}: {self.content[:50]}"
+
+
+class ChatSummary(models.Model):
+    """
+    Running summary of a project's chat messages up to covered_until.
+    """
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, related_name='chat_summary')
+    content = models.TextField(blank=True)
+    token_count = models.PositiveIntegerField(default=0)
+    covered_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class SemanticCacheEntry(models.Model):
+    """
+    A generated chat answer, found again by the embedding of its question.
+    Entries only match within the same model, system prompt version and scope
+    (the knowledge graph facts the answer was based on), see api.semantic_cache.
+    """
+    model = models.CharField(max_length=100)
+    prompt_version = models.CharField(max_length=64)
+    # '' for answers without facts, otherwise the nodeset and its graph version
+    scope = models.CharField(max_length=255, blank=True)
 
-    
\ No newline at end of file
+    question = models.TextField()
+    # nomic-embed-text vectors
+    embedding = VectorField(dimensions=768)
+    answer = models.TextField()
+    # How long generating the answer took, a hit saves about that much
+    generation_ms = models.FloatField(default=0)
+
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            HnswIndex(
+                name='semantic_cache_hnsw_idx',
+                fields=['embedding'],
+                m=16,
+                ef_construction=64,
+                opclasses=['vector_cosine_ops'],
+            ),
+            models.Index(fields=['model', 'prompt_version', 'scope'], name='semantic_cache_scope_idx'),
+            models.Index(fields=['last_hit_at'], name='semantic_cache_lru_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} [{self.scope or 'global'}]: {self.question[:50]}"
@@ -0,0 +1,201 @@
+# api/payments.py
+"""
+Two-phase PayPal capture.
+
+1. A short UPDATE moves the transaction from ``pending`` to ``capturing``.
+   Only one request can win it, so no row lock is held afterwards.
+2. PayPal is called outside of any transaction. The PayPal-Request-Id is
+   derived from the order, so a retry of the same capture (by the client or
+   by reconciliation) is answered from PayPal's record of the first one.
+3. A second short transaction marks the payment completed and activates the
+   subscription, or marks it failed.
+
+If the outcome of step 2 is unknown (timeout, PayPal down) the transaction is
+left in ``capturing`` and ``reconcile_stuck_captures`` settles it later from
+the order status at PayPal.
+"""
+import logging
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import metering
+from .models import PaymentTransaction
+from .paypal import PayPalError, get_paypal_client
+
+logger = logging.getLogger(__name__)
+
+# Captures in flight for longer than this are handed to reconciliation
+CAPTURE_RECONCILE_AFTER = getattr(settings, 'PAYMENT_CAPTURE_RECONCILE_AFTER', 120)
+
+SUBSCRIPTION_PERIOD = timedelta(days=30)
+
+
+def capture_request_id(order_id):
+    return f"capture-{order_id}"
+
+
+def _capture_id(order):
+    """
+    The capture id sits in the first purchase unit, older responses only have the order id.
+    """
+    try:
+        return order['purchase_units'][0]['payments']['captures'][0]['id']
+    except (KeyError, IndexError, TypeError):
+        return order['id']
+
+
+def start_capture(order_id, user):
+    """
+    Claims a pending transaction for capture. Raises PaymentTransaction.DoesNotExist
+    if there is no pending transaction for this order and user.
+    """
+    claimed = PaymentTransaction.objects.filter(
+        paypal_order_id=order_id,
+        user=user,
+        status='pending',
+    ).update(status='capturing', capture_started_at=timezone.now())
+    if not claimed:
+        raise PaymentTransaction.DoesNotExist
+    return PaymentTransaction.objects.get(paypal_order_id=order_id)
+
+
+USER_SUBSCRIPTION_FIELDS = [
+    'subscription_tier',
+    'subscription_start_date',
+    'subscription_end_date',
+    'is_subscription_active',
+    'daily_translations_used',
+    'monthly_translations_used',
+]
+
+
+def mark_completed(payment, capture_id, payer_id=None, now=None):
+    """
+    Completes the payment and activates the subscription on the loaded
+    payment and payment.user, without saving either.
+    """
+    now = now or timezone.now()
+    payment.status = 'completed'
+    payment.paypal_capture_id = capture_id
+    payment.is_verified = True
+    payment.verification_date = now
+    if payer_id:
+        payment.paypal_payer_id = payer_id
+
+    # Update user subscription
+    user = payment.user
+    user.subscription_tier = payment.subscription_tier
+    user.subscription_start_date = now
+    user.subscription_end_date = now + SUBSCRIPTION_PERIOD
+    user.is_subscription_active = True
+    # Reset usage counters upon new subscription
+    user.daily_translations_used = 0
+    user.monthly_translations_used = 0
+
+
+def finalize_capture(payment_id, order):
+    """
+    Completes a captured payment and activates the subscription.
+    Safe to call twice, a payment that left 'capturing' is returned as it is.
+    """
+    with transaction.atomic():
+        payment = PaymentTransaction.objects.select_for_update().select_related(
+            'user', 'subscription_tier'
+        ).get(pk=payment_id)
+        if payment.status != 'capturing':
+            return payment
+
+        mark_completed(payment, _capture_id(order), order.get('payer', {}).get('payer_id'))
+        payment.save()
+        payment.user.save(update_fields=USER_SUBSCRIPTION_FIELDS)
+        user_id = payment.user_id
+        transaction.on_commit(lambda: metering.reset(user_id))
+
+    return payment
+
+
+def fail_capture(payment_id):
+    PaymentTransaction.objects.filter(pk=payment_id, status='capturing').update(status='failed')
+
+
+def _is_definitive(error):
+    """
+    A 4xx answer means PayPal refused the capture, anything else may still have gone through.
+    """
+    return error.status_code is not None and 400 <= error.status_code < 500 and error.status_code != 429
+
+
+async def capture_payment(order_id, user):
+    """
+    Runs the whole capture for a user's order.
+    Returns the transaction status: 'completed', 'failed' or 'capturing'.
+    """
+    payment = await sync_to_async(start_capture)(order_id, user)
+
+    try:
+        order = await get_paypal_client().capture_order(order_id, request_id=capture_request_id(order_id))
+    except PayPalError as e:
+        if not _is_definitive(e):
+            logger.warning(f"Capture of {order_id} has an unknown outcome, leaving it to reconciliation: {e}")
+            return 'capturing'
+        logger.error(f"PayPal capture failed: {e}")
+        await sync_to_async(fail_capture)(payment.pk)
+        return 'failed'
+
+    payment = await sync_to_async(finalize_capture)(payment.pk, order)
+    return payment.status
+
+
+async def reconcile_capture(payment):
+    """
+    Settles one stuck capture from the order status at PayPal.
+    """
+    client = get_paypal_client()
+    order = await client.get_order(payment.paypal_order_id)
+
+    if order.get('status') == 'APPROVED':
+        # The capture never reached PayPal, retry it under the same key
+        order = await client.capture_order(
+            payment.paypal_order_id,
+            request_id=capture_request_id(payment.paypal_order_id),
+        )
+
+    if order.get('status') == 'COMPLETED':
+        payment = await sync_to_async(finalize_capture)(payment.pk, order)
+        return payment.status
+
+    await sync_to_async(fail_capture)(payment.pk)
+    return 'failed'
+
+
+async def reconcile_stuck_captures(limit=100):
+    """
+    Settles captures that stayed in 'capturing' past CAPTURE_RECONCILE_AFTER.
+    Returns {status: count}.
+    """
+    cutoff = timezone.now() - timedelta(seconds=CAPTURE_RECONCILE_AFTER)
+    payments = [
+        payment async for payment in PaymentTransaction.objects.filter(
+            status='capturing',
+            capture_started_at__lt=cutoff,
+        ).order_by('capture_started_at')[:limit]
+    ]
+
+    results = {}
+    for payment in payments:
+        try:
+            status = await reconcile_capture(payment)
+        except PayPalError as e:
+            if not _is_definitive(e):
+                logger.warning(f"Could not reconcile capture of {payment.paypal_order_id}: {e}")
+                status = 'capturing'
+            else:
+                logger.error(f"PayPal rejected capture of {payment.paypal_order_id}: {e}")
+                await sync_to_async(fail_capture)(payment.pk)
+                status = 'failed'
+        results[status] = results.get(status, 0) + 1
+    return results
@@ -0,0 +1,182 @@
+# api/paypal.py
+"""
+Async PayPal REST client.
+
+Connections are pooled in one ``httpx.AsyncClient`` per event loop, since a
+client cannot be shared between loops. The OAuth access token is kept in the
+Django cache until shortly before it expires, so payment calls do not fetch a
+new one each time. Every call has a timeout and is retried with exponential
+backoff on connection errors, 429 and 5xx. POSTs carry a PayPal-Request-Id
+that stays the same across retries, so PayPal never applies one twice.
+"""
+import asyncio
+import logging
+import random
+import uuid
+import weakref
+from functools import lru_cache
+
+import httpx
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Refresh the token this long before PayPal expires it
+TOKEN_EXPIRY_MARGIN = 60
+
+
+class PayPalError(Exception):
+    """
+    PayPal answered with an error, or could not be reached after all retries.
+    """
+
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+class PayPalClient:
+
+    def __init__(self, base_url, client_id, client_secret, timeout=10.0, max_retries=3, backoff=0.5):
+        self.base_url = base_url.rstrip('/')
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, 5.0))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def _token_key(self):
+        return f"paypal:access_token:{self.client_id}"
+
+    def _http(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                headers={'Accept': 'application/json', 'Accept-Language': 'en_US'},
+            )
+            self._clients[loop] = client
+        return client
+
+    async def aclose(self):
+        """
+        Closes the pooled connections of the running loop. Code that runs on
+        a short-lived loop, such as asyncio.run in a Celery task, calls it
+        before the loop ends.
+        """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    async def _send(self, method, path, **kwargs):
+        """
+        Sends a request, retrying connection errors and retryable statuses.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self._http().request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise PayPalError(f"PayPal unreachable: {e}") from e
+                logger.warning(f"PayPal {method} {path} failed ({e}), retrying")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    return response
+                logger.warning(f"PayPal {method} {path} returned {response.status_code}, retrying")
+
+            await asyncio.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+
+    async def get_access_token(self, refresh=False):
+        if not refresh:
+            token = await cache.aget(self._token_key)
+            if token:
+                return token
+
+        response = await self._send(
+            'POST',
+            '/v1/oauth2/token',
+            data={'grant_type': 'client_credentials'},
+            auth=(self.client_id, self.client_secret),
+        )
+        if response.status_code != 200:
+            raise PayPalError(
+                f"Failed to get PayPal access token: {response.text}",
+                response.status_code,
+                response.text,
+            )
+
+        payload = response.json()
+        token = payload['access_token']
+        timeout = max(int(payload.get('expires_in', 0)) - TOKEN_EXPIRY_MARGIN, 0)
+        if timeout:
+            await cache.aset(self._token_key, token, timeout=timeout)
+        return token
+
+    async def request(self, method, path, json=None, request_id=None, expected=(200, 201)):
+        """
+        Calls an authenticated endpoint and returns the decoded body.
+        A rejected token is refreshed once.
+        """
+        headers = {'Content-Type': 'application/json'}
+        if method == 'POST':
+            headers['PayPal-Request-Id'] = request_id or str(uuid.uuid4())
+
+        for refresh in (False, True):
+            token = await self.get_access_token(refresh=refresh)
+            response = await self._send(
+                method,
+                path,
+                json=json,
+                headers={**headers, 'Authorization': f'Bearer {token}'},
+            )
+            if response.status_code != 401:
+                break
+
+        if response.status_code not in expected:
+            raise PayPalError(
+                f"PayPal {method} {path} failed with {response.status_code}: {response.text}",
+                response.status_code,
+                response.text,
+            )
+        return response.json() if response.content else {}
+
+    async def create_order(self, order_data, request_id=None):
+        return await self.request('POST', '/v2/checkout/orders', json=order_data, request_id=request_id)
+
+    async def capture_order(self, order_id, request_id=None):
+        return await self.request('POST', f'/v2/checkout/orders/{order_id}/capture', request_id=request_id)
+
+    async def get_order(self, order_id):
+        return await self.request('GET', f'/v2/checkout/orders/{order_id}')
+
+
+@lru_cache(maxsize=None)
+def get_paypal_client():
+    """
+    Returns the process-wide client built from settings.
+    """
+    return PayPalClient(
+        settings.PAYPAL_BASE_URL,
+        settings.PAYPAL_CLIENT_ID,
+        settings.PAYPAL_CLIENT_SECRET,
+        timeout=getattr(settings, 'PAYPAL_TIMEOUT', 10.0),
+        max_retries=getattr(settings, 'PAYPAL_MAX_RETRIES', 3),
+        backoff=getattr(settings, 'PAYPAL_RETRY_BACKOFF', 0.5),
+    )
+
+
+@receiver(setting_changed)
+def _reset_paypal_client(setting, **kwargs):
+    if setting.startswith('PAYPAL_'):
+        get_paypal_client.cache_clear()
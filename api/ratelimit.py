@@ -0,0 +1,180 @@
+# api/ratelimit.py
+"""
+Per-client request rate limiting.
+
+Every client gets a token bucket in Redis sized from its subscription tier
+(``requests_per_minute`` and ``request_burst``). Authenticated users are keyed
+by id, anonymous clients by address and the free tier. Behind a proxy the
+address is read from X-Forwarded-For, ``RATE_LIMIT_PROXY_DEPTH`` hops from the
+right. Expensive routes take more than one token, see ``RATE_LIMIT_COSTS``,
+and routes called by machines are not limited, see ``RATE_LIMIT_EXEMPT``. The
+bucket is refilled and drawn from inside a Lua script using the Redis clock,
+so every process sees the same state.
+
+WebSockets draw from the user's bucket once NotificationConsumer has redeemed
+the ticket, on connect and for every message.
+
+If Redis is unreachable requests are let through rather than failing the site.
+"""
+import logging
+import math
+
+from django.conf import settings
+from django.http import JsonResponse
+from django_redis import get_redis_connection
+
+from .authentication import get_cached_user
+from .tiers import tier_registry
+
+logger = logging.getLogger(__name__)
+
+# Tokens taken per request, by URL name. Anything else costs one.
+RATE_LIMIT_COSTS = getattr(settings, 'RATE_LIMIT_COSTS', {
+    'chat_response': 5,
+    'get_graph_data': 2,
+})
+
+# URL names that are never limited: PayPal delivers webhooks in bursts from
+# shared addresses, and the platform polls the health check
+RATE_LIMIT_EXEMPT = getattr(settings, 'RATE_LIMIT_EXEMPT', {'paypal_webhook', 'health_check'})
+
+# Proxies in front of the app that append to X-Forwarded-For
+RATE_LIMIT_PROXY_DEPTH = getattr(settings, 'RATE_LIMIT_PROXY_DEPTH', 0)
+
+# Close code sent to WebSocket clients over their limit
+WEBSOCKET_CLOSE_CODE = 4029
+
+TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+_script = None
+
+
+def _get_script():
+    global _script
+    if _script is None:
+        _script = get_redis_connection('default').register_script(TOKEN_BUCKET)
+    return _script
+
+
+def client_address(forwarded_for, remote_addr):
+    """
+    Returns the address of the client as seen by the outermost trusted proxy.
+    Entries left of it in X-Forwarded-For are sent by the client and can be forged.
+    """
+    if RATE_LIMIT_PROXY_DEPTH and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+        if len(hops) >= RATE_LIMIT_PROXY_DEPTH:
+            return hops[-RATE_LIMIT_PROXY_DEPTH]
+    return remote_addr
+
+
+def _client_identity(user, address):
+    """
+    Returns (bucket key, tier) for a user or an anonymous address.
+    """
+    if user is not None and user.is_authenticated:
+        return f"ratelimit:user:{user.pk}", user.get_current_tier()
+    return f"ratelimit:addr:{address or 'unknown'}", tier_registry.free()
+
+
+def _user_identity(user_id, tier_name):
+    """
+    Returns (bucket key, tier) for a user known by id and, from a ticket, tier name.
+    """
+    tier = tier_registry.get_by_name(tier_name) if tier_name else None
+    if tier is None:
+        user = get_cached_user(user_id)
+        tier = user.get_current_tier() if user is not None else tier_registry.free()
+    return f"ratelimit:user:{user_id}", tier
+
+
+def _take(identity, args, cost):
+    if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+        return True, 0
+
+    try:
+        key, tier = identity(*args)
+        rate = tier.requests_per_minute / 60
+        capacity = max(tier.request_burst, 1)
+        allowed, retry_after = _get_script()(keys=[key], args=[rate, capacity, min(cost, capacity)])
+    except Exception as e:
+        logger.warning(f"Rate limiter unavailable, letting request through: {e}")
+        return True, 0
+
+    return bool(allowed), float(retry_after)
+
+
+def take(user, address, cost=1):
+    """
+    Draws cost tokens from the client's bucket.
+    Returns (allowed, seconds until enough tokens are available).
+    """
+    return _take(_client_identity, (user, address), cost)
+
+
+def take_user(user_id, tier_name, cost=1):
+    """
+    Like take, for a user that is only known by id, such as a WebSocket's.
+    """
+    return _take(_user_identity, (user_id, tier_name), cost)
+
+
+def _too_many_requests(retry_after):
+    response = JsonResponse(
+        {'error': 'Too many requests. Please slow down.'},
+        status=429,
+    )
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class RateLimitMiddleware:
+    """
+    Rejects HTTP requests over the client's tier rate with 429 and Retry-After.
+    Must come after the middleware that resolves the JWT user.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        if url_name in RATE_LIMIT_EXEMPT:
+            return None
+
+        allowed, retry_after = take(
+            getattr(request, 'user', None),
+            client_address(request.META.get('HTTP_X_FORWARDED_FOR'), request.META.get('REMOTE_ADDR')),
+            RATE_LIMIT_COSTS.get(url_name, 1),
+        )
+        if not allowed:
+            logger.info(f"Rate limited {request.path}, retry after {retry_after:.1f}s")
+            return _too_many_requests(retry_after)
+        return None
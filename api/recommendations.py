@@ -0,0 +1,212 @@
+# api/recommendations.py
+"""
+Precomputed vocab recommendations per user.
+
+Each user's top-N list is kept in the default Redis cache already serialized,
+together with the embedding it was computed from and the vocabulary version
+at the time. Pushing recommendations is a single cache read; the vector
+search only runs again when the user's embedding drifted past
+``RECOMMENDATION_DRIFT_THRESHOLD`` or the vocabulary changed.
+
+Stored lists keep the audio storage paths. Signed URLs expire long before a
+list does, so they are resolved when the list is pushed, see with_audio_urls.
+"""
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import resolve_audio_urls
+from .vector_search import nearest_vocab_ids_for_users
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_TOP_N = getattr(settings, 'RECOMMENDATION_TOP_N', 5)
+
+# Cosine distance between the stored and the current embedding
+RECOMMENDATION_DRIFT_THRESHOLD = getattr(settings, 'RECOMMENDATION_DRIFT_THRESHOLD', 0.05)
+
+RECOMMENDATION_TIMEOUT = 60 * 60 * 24 * 7
+
+VOCAB_VERSION_KEY = 'vocab_recs:vocab_version'
+
+
+def _recs_key(user_id):
+    return f"vocab_recs:{user_id}"
+
+
+def get_vocab_version():
+    version = cache.get(VOCAB_VERSION_KEY)
+    if version is None:
+        cache.add(VOCAB_VERSION_KEY, 1, timeout=None)
+        version = cache.get(VOCAB_VERSION_KEY, 1)
+    return version
+
+
+def bump_vocab_version():
+    """
+    Marks every stored list as stale, the next refresh recomputes them all.
+    """
+    cache.add(VOCAB_VERSION_KEY, 1, timeout=None)
+    try:
+        cache.incr(VOCAB_VERSION_KEY)
+    except ValueError:
+        cache.set(VOCAB_VERSION_KEY, 1, timeout=None)
+
+
+def serialize_vocabs(vocab_items, resolve=True):
+    """
+    Returns the serialized vocabs in order, with full S3 audio URLs unless
+    resolve is False.
+    """
+    from .serializers import VocabularySerializer
+
+    data = VocabularySerializer(vocab_items, many=True).data
+    return resolve_audio_urls(data) if resolve else data
+
+
+def with_audio_urls(data):
+    """
+    Returns a copy of a stored list with its audio paths turned into URLs.
+    Lists built together share their rows, so these are not changed in place.
+    """
+    return resolve_audio_urls([dict(row) for row in data])
+
+
+def build_recommendations(user_ids, k=RECOMMENDATION_TOP_N):
+    """
+    Returns {user_id: serialized vocab list} from one batched search.
+    Every distinct vocab is loaded and serialized once, audio fields keep
+    their storage paths.
+    """
+    from .models import Vocabulary
+
+    ids_by_user = nearest_vocab_ids_for_users(user_ids, k=k)
+
+    vocab_by_id = Vocabulary.objects.in_bulk(
+        {vocab_id for vocab_ids in ids_by_user.values() for vocab_id in vocab_ids}
+    )
+    vocab_items = list(vocab_by_id.values())
+    serialized = {vocab.pk: item for vocab, item in zip(vocab_items, serialize_vocabs(vocab_items, resolve=False))}
+
+    return {
+        user_id: [serialized[vocab_id] for vocab_id in vocab_ids if vocab_id in serialized]
+        for user_id, vocab_ids in ids_by_user.items()
+    }
+
+
+def store_recommendations(recommendations, embeddings, vocab_version=None):
+    """
+    Saves freshly built lists along with the embeddings they came from.
+    """
+    vocab_version = vocab_version or get_vocab_version()
+    now = time.time()
+    cache.set_many({
+        _recs_key(user_id): {
+            'data': data,
+            'embedding': [float(value) for value in embeddings[user_id]],
+            'vocab_version': vocab_version,
+            'computed_at': now,
+        }
+        for user_id, data in recommendations.items() if user_id in embeddings
+    }, timeout=RECOMMENDATION_TIMEOUT)
+
+
+def get_many_recommendations(user_ids):
+    """
+    Returns {user_id: stored list or None} in one cache round trip. Lists
+    built before the last vocabulary change count as missing.
+    """
+    entries = cache.get_many([_recs_key(user_id) for user_id in user_ids] + [VOCAB_VERSION_KEY])
+    vocab_version = entries.get(VOCAB_VERSION_KEY, 1)
+
+    results = {}
+    for user_id in user_ids:
+        entry = entries.get(_recs_key(user_id))
+        results[user_id] = entry['data'] if entry and entry['vocab_version'] == vocab_version else None
+    return results
+
+
+def get_recommendations(user_id):
+    return get_many_recommendations([user_id])[user_id]
+
+
+def delete_recommendations(user_ids):
+    """
+    Drops the stored lists of the given users, their next push recomputes them.
+    """
+    cache.delete_many([_recs_key(user_id) for user_id in user_ids])
+
+
+def embedding_drift(stored, current):
+    """
+    Cosine distance between two embeddings.
+    """
+    stored = np.asarray(stored, dtype=np.float32)
+    current = np.asarray(current, dtype=np.float32)
+    norm = float(np.linalg.norm(stored) * np.linalg.norm(current))
+    if norm == 0.0:
+        return 1.0
+    return 1.0 - float(stored @ current) / norm
+
+
+def is_stale(entry, embedding, vocab_version):
+    return (
+        entry is None
+        or entry['vocab_version'] != vocab_version
+        or embedding_drift(entry['embedding'], embedding) > RECOMMENDATION_DRIFT_THRESHOLD
+    )
+
+
+def compute_and_store(user_ids):
+    """
+    Rebuilds and stores the lists of the given users. Returns them.
+    """
+    from .models import User
+
+    vocab_version = get_vocab_version()
+    embeddings = dict(
+        User.objects.filter(id__in=user_ids).exclude(embedding=None).values_list('id', 'embedding')
+    )
+    recommendations = build_recommendations(list(embeddings))
+    store_recommendations(recommendations, embeddings, vocab_version)
+    return recommendations
+
+
+def refresh_stale_recommendations(chunk_size=1000):
+    """
+    Walks every user with an embedding and rebuilds only the stale lists.
+    Returns the number of users recomputed.
+    """
+    from .models import User
+
+    vocab_version = get_vocab_version()
+    refreshed = 0
+
+    rows = User.objects.exclude(embedding=None).order_by('id').values_list('id', 'embedding')
+    chunk = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            refreshed += _refresh_chunk(chunk, vocab_version)
+            chunk = []
+    if chunk:
+        refreshed += _refresh_chunk(chunk, vocab_version)
+
+    return refreshed
+
+
+def _refresh_chunk(rows, vocab_version):
+    entries = cache.get_many([_recs_key(user_id) for user_id, _ in rows])
+    embeddings = {
+        user_id: embedding for user_id, embedding in rows
+        if is_stale(entries.get(_recs_key(user_id)), embedding, vocab_version)
+    }
+    if not embeddings:
+        return 0
+
+    recommendations = build_recommendations(list(embeddings))
+    store_recommendations(recommendations, embeddings, vocab_version)
+    return len(embeddings)
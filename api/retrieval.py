@@ -0,0 +1,122 @@
+# api/retrieval.py
+"""
+Knowledge graph retrieval for chat.
+
+The message is looked up in the project's Cognee nodeset with a
+GRAPH_COMPLETION search that only returns the context (the top-k triplets as
+text), so Cognee does not call its own LLM. Results are cached per nodeset
+and normalized query, under the nodeset's graph version from api.graph, so
+re-cognifying a project also drops its cached retrievals.
+
+A chat never waits longer than RETRIEVAL_TIMEOUT for the facts. A search that
+takes longer is left running in the background, still fills the cache, and
+the chat goes on without facts.
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .graph import get_graph_version
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_TOP_K = getattr(settings, 'RETRIEVAL_TOP_K', 5)
+RETRIEVAL_TIMEOUT = getattr(settings, 'RETRIEVAL_TIMEOUT', 1.0)
+RETRIEVAL_CACHE_TIMEOUT = getattr(settings, 'RETRIEVAL_CACHE_TIMEOUT', 60 * 60)
+RETRIEVAL_MAX_CHARS = getattr(settings, 'RETRIEVAL_MAX_CHARS', 4000)
+
+# Searches still running after their deadline, and identical ones in flight
+_pending = {}
+
+
+def normalize_query(text):
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+
+
+def _cache_key(nodeset_name, version, query):
+    digest = hashlib.sha256(query.encode()).hexdigest()
+    return f"retrieval:{nodeset_name}:v{version}:{digest}"
+
+
+def _context_text(results):
+    """
+    Flattens what cognee.search returns for only_context (strings, or dicts of
+    dataset name to text) into one block of text.
+    """
+    if isinstance(results, str):
+        return results.strip()
+    if isinstance(results, dict):
+        return '\n'.join(_context_text(value) for value in results.values() if value)
+    if isinstance(results, (list, tuple)):
+        return '\n'.join(text for text in (_context_text(result) for result in results) if text)
+    return str(results).strip() if results else ''
+
+
+async def search_project(nodeset_name, query):
+    """
+    Returns the nodeset's context for a query as text, searching Cognee on a cache miss.
+    """
+    import cognee
+    from cognee.modules.engine.models.node_set import NodeSet
+
+    version = await get_graph_version(nodeset_name)
+    key = _cache_key(nodeset_name, version, query)
+    facts = await cache.aget(key)
+    if facts is not None:
+        return facts
+
+    started = time.perf_counter()
+    results = await cognee.search(
+        query_text=query,
+        query_type=cognee.SearchType.GRAPH_COMPLETION,
+        node_type=NodeSet,
+        node_name=[nodeset_name],
+        top_k=RETRIEVAL_TOP_K,
+        only_context=True,
+    )
+    facts = _context_text(results)[:RETRIEVAL_MAX_CHARS]
+    logger.info(
+        f"Retrieved {len(facts)} characters from {nodeset_name} in {(time.perf_counter() - started) * 1000:.1f}ms",
+        extra={'nodeset': nodeset_name},
+    )
+    await cache.aset(key, facts, timeout=RETRIEVAL_CACHE_TIMEOUT)
+    return facts
+
+
+def _forget(pending_key, task):
+    if _pending.get(pending_key) is task:
+        del _pending[pending_key]
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Retrieval for {pending_key[0]} failed: {task.exception()}")
+
+
+async def retrieve_facts(nodeset_name, message, timeout=None):
+    """
+    Returns the facts for a chat message, or '' if there are none or they
+    are not ready within the timeout.
+    """
+    query = normalize_query(message)
+    if not nodeset_name or not query:
+        return ''
+
+    pending_key = (nodeset_name, query)
+    task = _pending.get(pending_key)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.ensure_future(search_project(nodeset_name, query))
+        _pending[pending_key] = task
+        task.add_done_callback(lambda done: _forget(pending_key, done))
+
+    try:
+        # shield() keeps the search running past the deadline so it still fills the cache
+        return await asyncio.wait_for(asyncio.shield(task), timeout or RETRIEVAL_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Retrieval from {nodeset_name} missed its deadline, answering without facts")
+        return ''
+    except Exception:
+        # Logged by _forget
+        return ''
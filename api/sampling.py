@@ -0,0 +1,119 @@
+# api/sampling.py
+"""
+Uniform random sampling of vocab rows without ORDER BY random().
+
+Random ids are drawn from the cached [min, max] id range and looked up
+through the primary key index. Gaps left by deleted rows and rows rejected
+by filters only lower the hit rate, so the next round draws more probes
+based on the rate observed so far. Each call touches O(k) rows however
+large the table is.
+"""
+import logging
+import random
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max, Min
+
+logger = logging.getLogger(__name__)
+
+ID_RANGE_TIMEOUT = 60 * 10
+
+MAX_PROBE_ROUNDS = 5
+
+# Never probe more than this many ids in one round
+MAX_PROBES_PER_ROUND = 5000
+
+
+def probe_random_ids(fetch_existing, id_min, id_max, k, rng=random):
+    """
+    Returns up to k distinct ids drawn uniformly from the rows that exist.
+
+    fetch_existing(candidate_ids) must return the subset of candidate_ids that
+    exist and pass any filters.
+    """
+    if id_min is None or id_max is None:
+        return []
+
+    found = []
+    seen = set()
+    hit_rate = 1.0
+    span = id_max - id_min + 1
+
+    for _ in range(MAX_PROBE_ROUNDS):
+        missing = k - len(found)
+        if missing <= 0:
+            break
+
+        count = min(int(missing / max(hit_rate, 0.01) * 1.5) + 1, MAX_PROBES_PER_ROUND, span)
+        candidates = {rng.randint(id_min, id_max) for _ in range(count)} - seen
+        if not candidates:
+            continue
+        seen.update(candidates)
+
+        hits = list(fetch_existing(list(candidates)))
+        rng.shuffle(hits)
+        found.extend(hits[:missing])
+
+        hit_rate = max(len(hits) / len(candidates), 1.0 / span)
+
+    return found
+
+
+def _id_range_key(model):
+    return f"sampling:{model._meta.db_table}:id_range"
+
+
+def get_id_range(model):
+    """
+    Returns the cached (min id, max id) of a table.
+    Both ends come straight off the primary key index.
+    """
+    key = _id_range_key(model)
+    id_range = cache.get(key)
+    if id_range is None:
+        bounds = model.objects.aggregate(id_min=Min('id'), id_max=Max('id'))
+        id_range = (bounds['id_min'], bounds['id_max'])
+        cache.set(key, id_range, timeout=ID_RANGE_TIMEOUT)
+    return id_range
+
+
+def tablesample_ids(model, k):
+    """
+    Reads k rows from random pages with TABLESAMPLE SYSTEM_ROWS.
+    Cheaper than probing on very sparse id ranges, but rows come in page-sized runs.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT id FROM {model._meta.db_table} TABLESAMPLE SYSTEM_ROWS(%s)",
+            [k],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def sample_vocab(k=10, **filters):
+    """
+    Returns up to k random vocabs, e.g. sample_vocab(10, language='ko', level='B2').
+    """
+    from .models import Vocabulary
+
+    queryset = Vocabulary.objects.filter(**filters)
+    id_min, id_max = get_id_range(Vocabulary)
+
+    def fetch_existing(candidate_ids):
+        return queryset.filter(id__in=candidate_ids).values_list('id', flat=True)
+
+    ids = probe_random_ids(fetch_existing, id_min, id_max, k)
+
+    if len(ids) < k:
+        if filters:
+            # Filters this selective leave a small set, sorting it is cheap
+            logger.info(f"Vocab sampling fell back to ORDER BY random() for {filters}")
+            ids += list(
+                queryset.exclude(id__in=ids).order_by('?').values_list('id', flat=True)[:k - len(ids)]
+            )
+        else:
+            ids += [vocab_id for vocab_id in tablesample_ids(Vocabulary, k) if vocab_id not in ids][:k - len(ids)]
+
+    vocab_by_id = Vocabulary.objects.in_bulk(ids)
+    return [vocab_by_id[vocab_id] for vocab_id in ids if vocab_id in vocab_by_id]
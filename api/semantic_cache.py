@@ -0,0 +1,189 @@
+# api/semantic_cache.py
+"""
+Semantic cache of chat answers.
+
+The first message of a conversation is embedded and looked up among earlier
+questions in SemanticCacheEntry (pgvector, cosine distance over an HNSW
+index). An answer whose question is at least SEMANTIC_CACHE_THRESHOLD similar
+is sent back at once instead of generating a new one. Later messages of a
+conversation depend on its history and are never served from the cache.
+
+Entries match only for the same model and system prompt version, and for the
+same scope: answers without knowledge graph facts are shared by everyone,
+answers based on facts only within the nodeset and graph version they came
+from. A periodic task drops entries not hit for SEMANTIC_CACHE_TTL and the
+least recently hit ones beyond SEMANTIC_CACHE_MAX_ENTRIES.
+
+pgvector applies the model, prompt and scope filters after the HNSW scan, so
+with many scopes the ef_search nearest entries may all belong to others. On
+pgvector 0.8 and later lookups use an iterative scan that keeps going until
+enough entries pass the filters. Older versions only log a warning.
+
+Lookups, hits and the generation time saved are counted in Redis, see stats().
+"""
+import hashlib
+import logging
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django_redis import get_redis_connection
+from pgvector.django import CosineDistance
+
+from .llm import DEFAULT_MODEL, SYSTEM_PROMPT, llm_registry, model_settings
+from .models import SemanticCacheEntry
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = getattr(settings, 'SEMANTIC_CACHE_ENABLED', True)
+SEMANTIC_CACHE_THRESHOLD = getattr(settings, 'SEMANTIC_CACHE_THRESHOLD', 0.95)
+SEMANTIC_CACHE_TTL = getattr(settings, 'SEMANTIC_CACHE_TTL', 60 * 60 * 24 * 7)
+SEMANTIC_CACHE_MAX_ENTRIES = getattr(settings, 'SEMANTIC_CACHE_MAX_ENTRIES', 100_000)
+SEMANTIC_CACHE_EF_SEARCH = getattr(settings, 'SEMANTIC_CACHE_EF_SEARCH', 40)
+
+# Entries read per lookup, an iterative scan may return them slightly out of order
+SEMANTIC_CACHE_CANDIDATES = getattr(settings, 'SEMANTIC_CACHE_CANDIDATES', 5)
+
+PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT.encode()).hexdigest()[:16]
+
+STATS_KEY = 'semantic_cache:stats'
+
+# Whether the database's pgvector has hnsw.iterative_scan, checked once per process
+_iterative_scan = None
+
+
+def scope_for(nodeset_name, graph_version, facts):
+    return f"{nodeset_name}:v{graph_version}" if facts else ''
+
+
+def _model():
+    return model_settings(DEFAULT_MODEL)['model']
+
+
+async def embed(question):
+    """
+    Returns the embedding of a question, or None if it cannot be embedded.
+    """
+    try:
+        return await llm_registry.embeddings().aembed_query(' '.join(question.split()))
+    except Exception as e:
+        logger.warning(f"Could not embed question for the semantic cache: {e}")
+        return None
+
+
+def _supports_iterative_scan(cursor):
+    global _iterative_scan
+    if _iterative_scan is None:
+        cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cursor.fetchone()
+        version = tuple(int(part) for part in row[0].split('.')[:2]) if row else (0, 0)
+        _iterative_scan = version >= (0, 8)
+        if not _iterative_scan:
+            logger.warning(
+                f"pgvector {row[0] if row else '(missing)'} has no iterative index scans, "
+                f"semantic cache lookups may miss entries of uncommon scopes"
+            )
+    return _iterative_scan
+
+
+def lookup(embedding, scope):
+    """
+    Returns the closest fresh entry above the threshold, marking it hit, or None.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL hnsw.ef_search = %s", [int(SEMANTIC_CACHE_EF_SEARCH)])
+                if _supports_iterative_scan(cursor):
+                    cursor.execute("SET LOCAL hnsw.iterative_scan = relaxed_order")
+        candidates = list(
+            SemanticCacheEntry.objects.filter(
+                model=_model(),
+                prompt_version=PROMPT_VERSION,
+                scope=scope,
+                last_hit_at__gte=timezone.now() - timedelta(seconds=SEMANTIC_CACHE_TTL),
+            )
+            .annotate(distance=CosineDistance('embedding', embedding))
+            .order_by('distance')
+            .only('answer', 'generation_ms')[:SEMANTIC_CACHE_CANDIDATES]
+        )
+    entry = min(candidates, key=lambda candidate: candidate.distance, default=None)
+    if entry is None or 1 - entry.distance < SEMANTIC_CACHE_THRESHOLD:
+        return None
+
+    SemanticCacheEntry.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_hit_at=timezone.now())
+    return entry
+
+
+def store(question, embedding, answer, scope, generation_ms):
+    SemanticCacheEntry.objects.create(
+        model=_model(),
+        prompt_version=PROMPT_VERSION,
+        scope=scope,
+        question=question,
+        embedding=embedding,
+        answer=answer,
+        generation_ms=generation_ms,
+    )
+
+
+alookup = sync_to_async(lookup)
+astore = sync_to_async(store)
+
+
+def record_lookup(entry, lookup_ms):
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        pipe.hincrby(STATS_KEY, 'lookups', 1)
+        pipe.hincrbyfloat(STATS_KEY, 'lookup_ms', lookup_ms)
+        if entry is not None:
+            pipe.hincrby(STATS_KEY, 'hits', 1)
+            pipe.hincrbyfloat(STATS_KEY, 'saved_ms', max(entry.generation_ms - lookup_ms, 0))
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record semantic cache stats: {e}")
+
+
+def stats():
+    totals = {
+        field.decode(): float(value)
+        for field, value in get_redis_connection('default').hgetall(STATS_KEY).items()
+    }
+    lookups = int(totals.get('lookups', 0))
+    hits = int(totals.get('hits', 0))
+    return {
+        'lookups': lookups,
+        'hits': hits,
+        'hit_rate': hits / lookups if lookups else None,
+        'avg_lookup_ms': totals.get('lookup_ms', 0) / lookups if lookups else None,
+        'saved_ms': totals.get('saved_ms', 0),
+        'avg_saved_ms_per_hit': totals.get('saved_ms', 0) / hits if hits else None,
+    }
+
+
+def reset_stats():
+    get_redis_connection('default').delete(STATS_KEY)
+
+
+def evict_entries(batch_size=1000, now=None):
+    """
+    Deletes one batch of expired entries, then of the least recently hit ones
+    over SEMANTIC_CACHE_MAX_ENTRIES. Returns the number deleted.
+    """
+    now = now or timezone.now()
+    expired = SemanticCacheEntry.objects.filter(last_hit_at__lt=now - timedelta(seconds=SEMANTIC_CACHE_TTL))
+    deleted, _ = SemanticCacheEntry.objects.filter(
+        pk__in=expired.order_by('last_hit_at').values('pk')[:batch_size]
+    ).delete()
+    if deleted:
+        return deleted
+
+    excess = SemanticCacheEntry.objects.count() - SEMANTIC_CACHE_MAX_ENTRIES
+    if excess <= 0:
+        return 0
+    least_recent = SemanticCacheEntry.objects.order_by('last_hit_at').values('pk')[:min(excess, batch_size)]
+    deleted, _ = SemanticCacheEntry.objects.filter(pk__in=least_recent).delete()
+    return deleted
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import User, Project, SubscriptionTier
+from .models import User, Project
+from .tiers import tier_registry
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -26,15 +27,5 @@ class RegisterSerializer(serializers.ModelSerializer):
     
     def custom_signup(self, request, user):
         # Set free tier for new users
-        free_tier, _ = SubscriptionTier.objects.get_or_create(
-            name='free',
-            defaults={
-                'display_name': 'Free',
-                'price': 0,
-                'monthly_translation_limit': 50,
-                'daily_translation_limit': 5,
-                'features': []
-            }
-        )
-        user.subscription_tier = free_tier
+        user.subscription_tier = tier_registry.free()
         user.save()
\ No newline at end of file
@@ -0,0 +1,78 @@
+# api/signals.py
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django_redis import get_redis_connection
+
+from .authentication import invalidate_cached_user
+from .recommendations import bump_vocab_version
+from .sampling import _id_range_key
+from .tiers import tier_registry
+from .vector_search import DIRTY_SET_KEY
+
+
+def mark_vocab_dirty(sender, instance, **kwargs):
+    """
+    Queues a changed vocab for the next incremental refresh of the NumPy index.
+    """
+    if getattr(settings, 'VOCAB_SEARCH_ENGINE', 'pgvector') != 'numpy':
+        return
+    get_redis_connection('default').sadd(DIRTY_SET_KEY, instance.pk)
+
+
+def extend_vocab_id_range(sender, instance, created, **kwargs):
+    """
+    New rows may lie past the cached max id, make the sampler see them.
+    """
+    if created:
+        cache.delete(_id_range_key(sender))
+
+
+def invalidate_recommendations(sender, instance, **kwargs):
+    """
+    Stored recommendation lists may point at changed vocabs, rebuild them on the next refresh.
+    """
+    bump_vocab_version()
+
+
+VOCAB_RECEIVERS = (
+    (post_save, mark_vocab_dirty),
+    (post_delete, mark_vocab_dirty),
+    (post_save, extend_vocab_id_range),
+    (post_save, invalidate_recommendations),
+    (post_delete, invalidate_recommendations),
+)
+
+
+def connect_vocab_receivers(app_config):
+    """
+    Connects the Vocabulary receivers if the app defines the model. A lazy
+    sender pointing at a missing model fails the system checks.
+    """
+    try:
+        vocabulary = app_config.get_model('Vocabulary')
+    except LookupError:
+        return False
+    for signal, handler in VOCAB_RECEIVERS:
+        signal.connect(handler, sender=vocabulary, dispatch_uid=handler.__name__)
+    return True
+
+
+@receiver(post_save, sender='api.SubscriptionTier')
+@receiver(post_delete, sender='api.SubscriptionTier')
+def invalidate_tier_registry(sender, instance, **kwargs):
+    """
+    Every process reloads its tiers once the change is committed.
+    """
+    transaction.on_commit(tier_registry.publish_invalidation)
+
+
+@receiver(post_save, sender='api.User')
+@receiver(post_delete, sender='api.User')
+def invalidate_user_cache(sender, instance, **kwargs):
+    """
+    Profile and subscription changes must reach authenticated requests.
+    """
+    transaction.on_commit(lambda: invalidate_cached_user(instance.pk))
@@ -0,0 +1,29 @@
+# api/subscriptions.py
+"""
+Subscription expiry.
+
+Users whose subscription_end_date has passed are downgraded in batches. Each
+batch is a single UPDATE whose subquery walks the partial index
+``user_active_sub_end_idx`` (active users only, ordered by end date) and stops
+after batch_size rows, so a sweep touches only the rows it changes no matter
+how many users there are.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+SUBSCRIPTION_SWEEP_BATCH_SIZE = getattr(settings, 'SUBSCRIPTION_SWEEP_BATCH_SIZE', 1000)
+
+
+def expire_subscriptions(batch_size=SUBSCRIPTION_SWEEP_BATCH_SIZE, now=None):
+    """
+    Deactivates one batch of expired subscriptions. Returns the number of users downgraded.
+    """
+    from .models import User
+
+    now = now or timezone.now()
+    expired = User.objects.filter(is_subscription_active=True, subscription_end_date__lt=now)
+    batch = expired.order_by('subscription_end_date').values('pk')[:batch_size]
+
+    # The outer filter is rechecked on each locked row, so a renewal that
+    # commits during the sweep is not undone
+    return expired.filter(pk__in=batch).update(is_subscription_active=False)
@@ -1,31 +1,30 @@
 from celery import shared_task
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-from .models import User
-from .utils import get_s3_audio_url
-from pgvector.django import L2Distance
+from .models import User, Project
+from .recommendations import (
+    compute_and_store,
+    serialize_vocabs,
+    get_many_recommendations,
+    get_recommendations,
+    refresh_stale_recommendations,
+    with_audio_urls,
+)
+from .sampling import sample_vocab
 import numpy as np
 import math
+import asyncio
 
 @shared_task
-def get_vocab_random(user_id):  # user id here means one of the names of group
+def get_vocab_random(user_id, filters=None):  # user id here means one of the names of group
     """
-    Randomly recommend 10 vocabs
+    Randomly recommend 10 vocabs, optionally filtered (e.g. {"language": "ko"})
     """
     
-    vocab_items = Vocabulary.objects.order_by('?').all()[:10]
+    vocab_items = sample_vocab(10, **(filters or {}))
 
-    # Serialize the queryset
-    serializer = VocabularySerializer(vocab_items, many=True)
-    data = serializer.data
-    
-    # Enhance the serialized data with full S3 URLs
-    for item in data:
-        if item.get('word_audio'):
-            item['word_audio'] = get_s3_audio_url(item['word_audio'])
-        
-        if item.get('sentence_audio'):
-            item['sentence_audio'] = get_s3_audio_url(item['sentence_audio'])
+    # Serialize the queryset and turn storage paths into full S3 URLs
+    data = serialize_vocabs(vocab_items)
 
     # Get the channel layer
     channel_layer = get_channel_layer()
@@ -49,26 +48,13 @@ def get_vocab_random(user_id):  # user id here means one of the names of group
 @shared_task
 def recommend_vocab(user_id):
     """
-    Get 10 most close vocab embedding based on current user embedding 
+    Push the precomputed closest vocabs of a user, computing them on a miss
     """
 
-    user = User.objects.get(user_id=user_id)
-
-    vocab_items = Vocabulary.objects.order_by(
-        L2Distance('embedding', user.embedding)
-    )[:5]
-
-    # Serialize the queryset
-    serializer = VocabularySerializer(vocab_items, many=True)
-    data = serializer.data
-    
-    # Enhance the serialized data with full S3 URLs
-    for item in data:
-        if item.get('word_audio'):
-            item['word_audio'] = get_s3_audio_url(item['word_audio'])
-        
-        if item.get('sentence_audio'):
-            item['sentence_audio'] = get_s3_audio_url(item['sentence_audio'])
+    data = get_recommendations(user_id)
+    if data is None:
+        data = compute_and_store([user_id]).get(user_id, [])
+    data = with_audio_urls(data)
 
     # Get the channel layer
     channel_layer = get_channel_layer()
@@ -88,6 +74,219 @@ def recommend_vocab(user_id):
 
     return "Recommended Result sent"
 
+
+@shared_task
+def recommend_vocab_batch(user_ids):
+    """
+    Push recommendations to many users at once.
+    Stored lists are read in one round trip, the missing ones come from a
+    single batched search, and all results go out in one event loop pass.
+    Every user gets what recommend_vocab would send, an empty list included.
+    """
+    user_ids = [int(user_id) for user_id in user_ids]
+
+    results = get_many_recommendations(user_ids)
+    missing = [user_id for user_id, data in results.items() if data is None]
+    if missing:
+        computed = compute_and_store(missing)
+        # Users without an embedding have nothing to compute
+        results.update({user_id: computed.get(user_id, []) for user_id in missing})
+
+    channel_layer = get_channel_layer()
+
+    async def fan_out():
+        await asyncio.gather(*(
+            channel_layer.group_send(
+                f'user_{user_id}',
+                {
+                    "type": "task_result",
+                    "data": with_audio_urls(data),
+                }
+            )
+            for user_id, data in results.items()
+        ))
+
+    async_to_sync(fan_out)()
+
+    return f"Recommended Result sent to {len(results)} users"
+
+
+@shared_task
+def refresh_recommendations():
+    """
+    Recompute the stored lists whose user embedding drifted or whose vocabulary changed
+    """
+    refreshed = refresh_stale_recommendations()
+
+    return f"Refreshed recommendations of {refreshed} users"
+
+@shared_task
+def apply_embedding_events(batch_size=1000, max_batches=20):
+    """
+    Fold queued learning events into user embeddings, one micro-batch at a time
+    """
+    from django.core.cache import cache
+    from .embeddings import apply_embedding_events as apply_batch
+
+    # Batches are read before they are trimmed, two runs would apply them twice
+    if not cache.add('embedding_events:running', 1, timeout=60 * 10):
+        return "Learning events are already being applied"
+
+    applied = 0
+    try:
+        for _ in range(max_batches):
+            count = apply_batch(batch_size)
+            applied += count
+            if count < batch_size:
+                break
+    finally:
+        cache.delete('embedding_events:running')
+
+    return f"Applied {applied} learning events"
+
+
+@shared_task
+def refresh_vocab_index(batch_size=1000):
+    """
+    Fold vocab rows changed since the last run into the NumPy search index
+    """
+    from django_redis import get_redis_connection
+    from . import vector_search
+
+    redis = get_redis_connection('default')
+    # Ids leave the set only once the index has them, a failed refresh is retried
+    members = redis.srandmember(vector_search.DIRTY_SET_KEY, batch_size) or []
+    vocab_ids = [int(vocab_id) for vocab_id in members]
+    if not vocab_ids:
+        return "Vocab index up to date"
+
+    vector_search.refresh_vocab_index(vocab_ids)
+    redis.srem(vector_search.DIRTY_SET_KEY, *members)
+
+    return f"Refreshed {len(vocab_ids)} vocab rows"
+
+
+@shared_task
+def flush_translation_usage(batch_size=1000, max_batches=20):
+    """
+    Write the Redis translation counters back to the User usage fields
+    """
+    from .metering import flush_usage
+
+    flushed = 0
+    for _ in range(max_batches):
+        count = flush_usage(batch_size)
+        flushed += count
+        if count < batch_size:
+            break
+
+    return f"Flushed translation usage of {flushed} users"
+
+
+@shared_task
+def reconcile_stuck_captures(limit=100):
+    """
+    Settle PayPal captures left in 'capturing' from the order status at PayPal
+    """
+    from .payments import reconcile_stuck_captures as reconcile
+    from .paypal import get_paypal_client
+
+    async def run():
+        try:
+            return await reconcile(limit)
+        finally:
+            # The loop of asyncio.run ends with the task, so does the client pooled for it
+            await get_paypal_client().aclose()
+
+    results = asyncio.run(run())
+
+    return f"Reconciled captures: {results}"
+
+
+@shared_task
+def process_paypal_webhook_events(batch_size=500, max_batches=20):
+    """
+    Apply stored PayPal webhook events to payments and subscriptions, in batches
+    """
+    from .webhooks import process_webhook_events
+
+    processed = 0
+    for _ in range(max_batches):
+        count = process_webhook_events(batch_size)
+        processed += count
+        if count < batch_size:
+            break
+
+    return f"Processed {processed} PayPal webhook events"
+
+
+@shared_task
+def expire_subscriptions(max_batches=100):
+    """
+    Downgrade users whose subscription ended, one indexed batch at a time
+    """
+    from .subscriptions import SUBSCRIPTION_SWEEP_BATCH_SIZE, expire_subscriptions as expire_batch
+
+    expired = 0
+    for _ in range(max_batches):
+        count = expire_batch(SUBSCRIPTION_SWEEP_BATCH_SIZE)
+        expired += count
+        if count < SUBSCRIPTION_SWEEP_BATCH_SIZE:
+            break
+
+    return f"Expired {expired} subscriptions"
+
+
+@shared_task
+def summarize_chat(project_id):
+    """
+    Fold the older messages of a project's chat into its running summary
+    """
+    from .chat import summarize_project_chat
+
+    folded = summarize_project_chat(project_id)
+
+    return f"Summarized {folded} chat messages of project {project_id}"
+
+
+@shared_task
+def evict_semantic_cache(batch_size=1000, max_batches=100):
+    """
+    Drop semantic cache entries that expired or are the least recently hit over capacity
+    """
+    from .semantic_cache import evict_entries
+
+    evicted = 0
+    for _ in range(max_batches):
+        count = evict_entries(batch_size)
+        evicted += count
+        if count < batch_size:
+            break
+
+    return f"Evicted {evicted} semantic cache entries"
+
+@shared_task
+def cognify_project(project_id):
+    """
+    Cognify the data added to a project's dataset and rebuild its cached subgraph
+    """
+    import cognee
+    from .graph import invalidate_project_graph
+    from .graph_clusters import precompute_cluster_hierarchy
+
+    project = Project.objects.get(project_id=project_id)
+
+    # Only this project's dataset, the others are left alone
+    asyncio.run(cognee.cognify(datasets=[project.cognee_nodeset_name]))
+
+    # The next get_graph_data call re-extracts the nodeset
+    invalidate_project_graph(project.cognee_nodeset_name)
+
+    # Warm the new subgraph and its cluster hierarchy before anyone asks for them
+    asyncio.run(precompute_cluster_hierarchy(project.cognee_nodeset_name))
+
+    return f"Project {project_id} cognified"
+
 @shared_task
 def chatResponse(user_id):
     """
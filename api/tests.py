@@ -1,4 +1,6 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, SimpleTestCase, override_settings
 
 # Create your tests here.
 # your_app/tests/test_views.py
@@ -6,9 +8,158 @@ from django.test import TestCase
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from unittest.mock import patch, MagicMock
+from unittest import skipUnless
+from unittest.mock import AsyncMock, patch, MagicMock
 from api.models import User, SubscriptionTier, PaymentTransaction, Vocabulary
+from api.graph import _chunk_key, add_project_data, load_project_graph, ainvalidate_project_graph, encode_cursor, decode_cursor, stream_project_graph
+from api.graph_clusters import build_cluster_hierarchy, load_cluster_hierarchy
+from api.vector_search import VocabIndex, _pgvector_nearest_ids_for_users, _write_index, get_vocab_index, refresh_vocab_index
+from api.signals import connect_vocab_receivers
+from api.sampling import probe_random_ids
+from api.recommendations import is_stale, store_recommendations, with_audio_urls
+from api.embeddings import EVENT_QUEUE_KEY, apply_embedding_events, fold_events, record_learning_events
+from api.utils import CloudFrontPolicySigner, get_s3_audio_url, resolve_audio_urls
+from api.tiers import tier_registry
+from api import metering
+from api.ratelimit import client_address, take, take_user
+from api.paypal import PayPalClient, PayPalError, get_paypal_client
+from api.payments import reconcile_stuck_captures
+from api.webhooks import WebhookVerificationError, process_webhook_events, signed_message, verify_signature
+from api.models import PayPalWebhookEvent
+from api.subscriptions import expire_subscriptions
+from api import tasks
+from api.tasks import cognify_project, recommend_vocab, recommend_vocab_batch
+from api.ws_tickets import InvalidTicket, aredeem_ticket, issue_ticket
+from api import authentication
+from api.authentication import CachedJWTAuthentication, JWTAuthenticationMiddleware, get_cached_user
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+from api.consumers import NotificationConsumer
+from api import log
+from api.llm import SYSTEM_PROMPT, chat_messages, llm_registry, stream_chat
+from api.retrieval import retrieve_facts
+from api.chat import load_context, stream_answer, stream_reply, summarize_project_chat
+from api.models import ChatMemory, ChatSummary, Project, SemanticCacheEntry
+from api import semantic_cache
+from api.management.commands.bench_chat_ttft import FakeOllamaServer
+from channels.testing import WebsocketCommunicator
+from asgiref.sync import async_to_sync
+from django.utils import timezone
+from datetime import date, datetime, timedelta
+import asyncio
+import base64
+import io
 import json
+import logging
+import random
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class FakePayPalServer:
+    """
+    Stand-in for the PayPal REST API on a local port.
+    fail(path, times) makes the next calls to a path answer 503.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.failures = {}
+        self.order_status = 'COMPLETED'
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                server.requests.append((self.path, dict(self.headers)))
+                status_code, payload = server.respond(self.path)
+                body = json.dumps(payload).encode()
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset(self):
+        self.requests.clear()
+        self.failures.clear()
+        self.order_status = 'COMPLETED'
+
+    def fail(self, path, times):
+        self.failures[path] = times
+
+    def paths(self):
+        return [path for path, _ in self.requests]
+
+    def respond(self, path):
+        if self.failures.get(path):
+            self.failures[path] -= 1
+            return 503, {'name': 'SERVICE_UNAVAILABLE'}
+        if path == '/v1/oauth2/token':
+            return 200, {'access_token': 'FAKE_ACCESS_TOKEN', 'expires_in': 32400}
+        if path == '/v2/checkout/orders':
+            return 201, {'id': 'PAYPAL_ORDER_ID', 'links': [{'rel': 'approve', 'href': 'http://paypal.com/approve'}]}
+        if path.endswith('/capture'):
+            return 201, {'id': 'CAPTURE_ID', 'status': 'COMPLETED', 'payer': {'payer_id': 'PAYER_ID'}}
+        if path.startswith('/v2/checkout/orders/'):
+            return 200, {
+                'id': path.rsplit('/', 1)[1],
+                'status': self.order_status,
+                'purchase_units': [{'payments': {'captures': [{'id': 'CAPTURE_ID'}]}}],
+            }
+        return 404, {'name': 'RESOURCE_NOT_FOUND'}
+
+
+class FakePayPalMixin:
+    """
+    Points the PayPal client at a FakePayPalServer shared by the test class.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.paypal = FakePayPalServer()
+        cls.paypal.start()
+        cls.addClassCleanup(cls.paypal.stop)
+
+    def setUp(self):
+        super().setUp()
+        self.paypal.reset()
+        self.enterContext(self.settings(
+            CACHES=LOCMEM_CACHES,
+            PAYPAL_BASE_URL=self.paypal.url,
+            PAYPAL_CLIENT_ID='test-client',
+            PAYPAL_CLIENT_SECRET='test-secret',
+            PAYPAL_MAX_RETRIES=1,
+            PAYPAL_RETRY_BACKOFF=0,
+        ))
+        # Earlier tests leave the access token of the same client id cached
+        cache.clear()
+
 
 class AuthViewsTest(APITestCase):
     def test_register_success(self):
@@ -49,27 +200,16 @@ class AuthViewsTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
-class SubscriptionViewsTest(APITestCase):
+class SubscriptionViewsTest(FakePayPalMixin, APITestCase):
     def setUp(self):
+        super().setUp()
         self.user = User.objects.create_user(username='subuser', email='sub@example.com', password='pqgdfgafhareyasg')
         self.client.force_authenticate(user=self.user)
         self.free_tier = SubscriptionTier.objects.create(name='free', price=0, monthly_translation_limit=5, daily_translation_limit=1)
         self.premium_tier = SubscriptionTier.objects.create(name='premium', price=9.99, monthly_translation_limit=100, daily_translation_limit=10)
 
-    @patch('uppercut_api.views.get_paypal_access_token')
-    @patch('requests.post')
-    def test_create_paypal_order_success(self, mock_requests_post, mock_get_token):
+    def test_create_paypal_order_success(self):
         """Ensure we can create a PayPal order."""
-        # Mock external calls
-        mock_get_token.return_value = 'FAKE_ACCESS_TOKEN'
-        mock_requests_post.return_value = MagicMock(
-            status_code=201, 
-            json=lambda: {
-                'id': 'PAYPAL_ORDER_ID',
-                'links': [{'rel': 'approve', 'href': 'http://paypal.com/approve'}]
-            }
-        )
-
         url = reverse('create_paypal_order')
         data = {'tier_id': self.premium_tier.id}
         response = self.client.post(url, data, format='json')
@@ -78,9 +218,7 @@ class SubscriptionViewsTest(APITestCase):
         self.assertEqual(response.data['order_id'], 'PAYPAL_ORDER_ID')
         self.assertTrue(PaymentTransaction.objects.filter(paypal_order_id='PAYPAL_ORDER_ID', status='pending').exists())
     
-    @patch('uppercut_api.views.get_paypal_access_token')
-    @patch('requests.post')
-    def test_capture_paypal_payment_success(self, mock_requests_post, mock_get_token):
+    def test_capture_paypal_payment_success(self):
         """Test successful payment capture and subscription activation."""
         transaction = PaymentTransaction.objects.create(
             user=self.user,
@@ -89,12 +227,6 @@ class SubscriptionViewsTest(APITestCase):
             amount=9.99,
             status='pending'
         )
-        # Mock external calls
-        mock_get_token.return_value = 'FAKE_ACCESS_TOKEN'
-        mock_requests_post.return_value = MagicMock(
-            status_code=201,
-            json=lambda: {'id': 'CAPTURE_ID', 'payer': {'payer_id': 'PAYER_ID'}}
-        )
 
         url = reverse('capture_paypal_payment')
         data = {'order_id': 'ORDER_TO_CAPTURE'}
@@ -110,6 +242,43 @@ class SubscriptionViewsTest(APITestCase):
         self.assertTrue(self.user.is_subscription_active)
         self.assertEqual(transaction.status, 'completed')
 
+    def test_capture_with_unknown_outcome_is_reconciled(self):
+        """A capture PayPal never answered stays 'capturing' until reconciliation settles it."""
+        transaction = PaymentTransaction.objects.create(
+            user=self.user,
+            subscription_tier=self.premium_tier,
+            paypal_order_id='SLOW_ORDER',
+            amount=9.99,
+            status='pending'
+        )
+        self.paypal.fail('/v2/checkout/orders/SLOW_ORDER/capture', 5)
+
+        response = self.client.post(reverse('capture_paypal_payment'), {'order_id': 'SLOW_ORDER'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        transaction.refresh_from_db()
+        self.assertEqual(transaction.status, 'capturing')
+
+        # A second attempt cannot capture twice
+        response = self.client.post(reverse('capture_paypal_payment'), {'order_id': 'SLOW_ORDER'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        PaymentTransaction.objects.filter(pk=transaction.pk).update(capture_started_at=timezone.now() - timedelta(hours=1))
+        results = async_to_sync(reconcile_stuck_captures)()
+
+        self.assertEqual(results, {'completed': 1})
+        transaction.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(transaction.status, 'completed')
+        self.assertEqual(transaction.paypal_capture_id, 'CAPTURE_ID')
+        self.assertTrue(self.user.is_subscription_active)
+
+        request_ids = {
+            headers['PayPal-Request-Id'] for path, headers in self.paypal.requests
+            if path.endswith('/capture')
+        }
+        self.assertEqual(request_ids, {'capture-SLOW_ORDER'})
+
 class CoreFunctionalityViewsTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='coreuser', email='core@example.com', password='pwmsgjwjsngnsaodigs')
@@ -118,6 +287,22 @@ class CoreFunctionalityViewsTest(APITestCase):
         self.user.save()
         self.client.force_authenticate(user=self.user)
 
+    @patch('api.views.cognify_project')
+    @patch('api.views.add_project_data', new_callable=AsyncMock)
+    def test_added_project_data_is_cognified(self, mock_add, mock_cognify):
+        project = Project.objects.create(user=self.user, project_name='Notes', cognee_nodeset_name='user_1-notes-abcd')
+        mock_cognify.delay.return_value.id = 'task-1'
+
+        response = self.client.post(
+            reverse('add_project_data'),
+            {'projectId': str(project.project_id), 'text': 'Some notes'},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        mock_add.assert_awaited_once_with('user_1-notes-abcd', ['Some notes'])
+        mock_cognify.delay.assert_called_once_with(str(project.project_id))
+
     @patch('uppercut_api.views.callOpenAI_TranslationwContext')
     def test_analyze_content_within_limits(self, mock_openai_call):
         """Test content analysis when user is within their usage limits."""
@@ -241,4 +426,1225 @@ class CoreFunctionalityViewsTest(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         vocab = Vocabulary.objects.get(baseForm='test')
-        self.assertTrue(self.user.unknown_words.filter(id=vocab.id).exists())
\ No newline at end of file
+        self.assertTrue(self.user.unknown_words.filter(id=vocab.id).exists())
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProjectGraphTest(SimpleTestCase):
+    def setUp(self):
+        # Earlier tests share the LocMemCache, a leftover subgraph would be a hit
+        cache.clear()
+        self.nodes = [(f"n{i}", {'name': f"node {i}"}) for i in range(25)]
+        self.edges = [(f"n{i}", f"n{i + 1}", 'related_to', {}) for i in range(24)]
+
+    async def load_graph(self):
+        with patch('api.graph.extract_project_subgraph', return_value=(self.nodes, self.edges)) as mock_extract, \
+                patch('api.graph.GRAPH_CHUNK_SIZE', 10):
+            graph = await load_project_graph('user_1-test-abcd')
+        return graph, mock_extract
+
+    async def test_subgraph_is_cached_per_nodeset(self):
+        """The second load is served from the cache without touching Cognee."""
+        graph, mock_extract = await self.load_graph()
+        self.assertFalse(graph.cache_hit)
+        mock_extract.assert_called_once_with('user_1-test-abcd')
+
+        graph, mock_extract = await self.load_graph()
+        self.assertTrue(graph.cache_hit)
+        mock_extract.assert_not_called()
+
+    async def test_project_data_goes_to_its_own_dataset(self):
+        with patch('cognee.add', new_callable=AsyncMock) as mock_add:
+            await add_project_data('user_1-test-abcd', ['some notes'])
+
+        mock_add.assert_awaited_once_with(['some notes'], dataset_name='user_1-test-abcd', node_set=['user_1-test-abcd'])
+
+    def test_cognify_is_scoped_to_the_project(self):
+        """Other users' datasets are not re-cognified, the project's graph is rebuilt."""
+        project = Project(cognee_nodeset_name='user_1-test-abcd')
+        with patch('api.tasks.Project') as mock_project, \
+                patch('cognee.cognify', new_callable=AsyncMock) as mock_cognify, \
+                patch('api.graph.invalidate_project_graph') as mock_invalidate, \
+                patch('api.graph_clusters.precompute_cluster_hierarchy', new_callable=AsyncMock) as mock_precompute:
+            mock_project.objects.get.return_value = project
+            cognify_project(str(project.project_id))
+
+        mock_cognify.assert_awaited_once_with(datasets=['user_1-test-abcd'])
+        mock_invalidate.assert_called_once_with('user_1-test-abcd')
+        mock_precompute.assert_awaited_once_with('user_1-test-abcd')
+
+    async def test_invalidation_forces_re_extraction(self):
+        await self.load_graph()
+        await ainvalidate_project_graph('user_1-test-abcd')
+
+        graph, mock_extract = await self.load_graph()
+        self.assertFalse(graph.cache_hit)
+        mock_extract.assert_called_once()
+
+    async def test_pages_cover_nodes_then_edges(self):
+        """Walking the cursor returns every node and edge exactly once, in order."""
+        graph, _ = await self.load_graph()
+
+        nodes, edges, offset = [], [], 0
+        while offset < graph.total:
+            page_nodes, page_edges = await graph.page(offset, 7)
+            nodes.extend(page_nodes)
+            edges.extend(page_edges)
+            offset = decode_cursor(graph, encode_cursor(graph, offset + 7))
+
+        self.assertEqual(nodes, self.nodes)
+        self.assertEqual(edges, self.edges)
+
+    async def test_stream_ends_with_an_error_when_a_chunk_expires(self):
+        graph, _ = await self.load_graph()
+        stream = stream_project_graph(graph)
+        lines = [await anext(stream), await anext(stream)]
+
+        await cache.adelete(_chunk_key(graph.nodeset_name, graph.version, 'nodes', 1))
+        lines += [line async for line in stream]
+
+        records = [json.loads(line) for chunk in lines for line in chunk.splitlines()]
+        self.assertEqual([record['type'] for record in records], ['meta'] + ['node'] * 10 + ['error'])
+        self.assertEqual(records[-1]['error'], 'stale')
+        # The next request re-extracts the graph instead of hitting the same hole
+        graph, mock_extract = await self.load_graph()
+        mock_extract.assert_called_once()
+
+    async def test_cursor_from_old_version_is_rejected(self):
+        graph, _ = await self.load_graph()
+        cursor = encode_cursor(graph, 10)
+
+        await ainvalidate_project_graph('user_1-test-abcd')
+        graph, _ = await self.load_graph()
+
+        with self.assertRaises(ValueError):
+            decode_cursor(graph, cursor)
+
+
+class ClusterHierarchyTest(SimpleTestCase):
+    def setUp(self):
+        # Two dense communities of 30 nodes joined by a single bridge
+        self.nodes = [(i, {'name': f"node {i}"}) for i in range(60)]
+        self.edges = [(i, j, 'related_to', {}) for i in range(30) for j in range(i + 1, 30) if (i + j) % 3 == 0]
+        self.edges += [(i, j, 'related_to', {}) for i in range(30, 60) for j in range(i + 1, 60) if (i + j) % 3 == 0]
+        self.edges.append((0, 30, 'related_to', {}))
+
+    def test_every_node_belongs_to_one_cluster(self):
+        levels = build_cluster_hierarchy(self.nodes, self.edges)
+        self.assertTrue(levels)
+
+        members = [child for cluster in levels[0]['clusters'].values() for child in cluster['children']]
+        self.assertCountEqual(members, [node_id for node_id, _ in self.nodes])
+
+    def test_levels_shrink_and_keep_sizes(self):
+        levels = build_cluster_hierarchy(self.nodes, self.edges)
+
+        counts = [len(level['clusters']) for level in levels]
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        for level in levels:
+            self.assertEqual(sum(cluster['size'] for cluster in level['clusters'].values()), len(self.nodes))
+
+    def test_small_graph_is_not_clustered(self):
+        self.assertEqual(build_cluster_hierarchy(self.nodes[:5], self.edges[:3]), [])
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    async def test_hierarchy_is_built_off_the_event_loop(self):
+        cache.clear()
+        graph = MagicMock(nodeset_name='user_1-test-abcd', version=1)
+        graph.all = AsyncMock(return_value=(self.nodes, self.edges))
+        loop_thread = threading.get_ident()
+        build_threads = []
+
+        def build(nodes_data, edges_data):
+            build_threads.append(threading.get_ident())
+            return build_cluster_hierarchy(nodes_data, edges_data)
+
+        with patch('api.graph_clusters.build_cluster_hierarchy', side_effect=build):
+            levels = await load_cluster_hierarchy(graph)
+            self.assertEqual(await load_cluster_hierarchy(graph), levels)
+
+        self.assertEqual(len(build_threads), 1)
+        self.assertNotEqual(build_threads[0], loop_thread)
+
+
+class VocabIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        rng = np.random.default_rng(0)
+        self.embeddings = rng.random((500, 16), dtype=np.float32)
+        self.ids = np.arange(1, 501, dtype=np.int64)
+        _write_index(self.directory, self.ids, self.embeddings)
+
+    @patch('api.vector_search.SEARCH_BLOCK_ROWS', 128)
+    def test_batched_search_matches_exact_scan(self):
+        """Blockwise argpartition returns the same top-k as a full sort."""
+        queries = np.random.default_rng(1).random((4, 16), dtype=np.float32)
+        results = VocabIndex(self.directory).search(queries, k=5)
+
+        for query, result in zip(queries, results):
+            distances = ((self.embeddings - query) ** 2).sum(axis=1)
+            expected = [int(vocab_id) for vocab_id in self.ids[np.argsort(distances)[:5]]]
+            self.assertEqual(result, expected)
+
+    def test_deleted_rows_stay_deleted_when_new_rows_are_added(self):
+        """Adding rows rewrites the files, which must not bring deleted rows back."""
+        new_embedding = np.random.default_rng(2).random(16, dtype=np.float32)
+
+        with patch('api.vector_search._index_dir', return_value=self.directory), \
+                patch('api.vector_search._index', None), \
+                patch('api.models.Vocabulary', create=True) as mock_vocab:
+            rows = mock_vocab.objects.filter.return_value.exclude.return_value.values_list
+            rows.return_value = []
+            refresh_vocab_index([1])
+            rows.return_value = [(501, new_embedding)]
+            refresh_vocab_index([501])
+
+            index = get_vocab_index()
+            results = index.search(np.stack([self.embeddings[0], new_embedding]), k=3)
+
+        self.assertNotIn(1, index.row_by_id)
+        self.assertNotIn(1, results[0])
+        self.assertEqual(results[1][0], 501)
+
+
+class VocabSignalsTest(SimpleTestCase):
+    def test_receivers_need_the_vocabulary_model(self):
+        """No lazy sender may point at a model the app does not define."""
+        from django.apps import apps
+        from django.core import checks
+
+        errors = [error for error in checks.run_checks(tags=[checks.Tags.signals]) if error.id == 'signals.E001']
+        self.assertEqual(errors, [])
+        if not any(model.__name__ == 'Vocabulary' for model in apps.get_app_config('api').get_models()):
+            self.assertFalse(connect_vocab_receivers(apps.get_app_config('api')))
+
+    def test_receivers_connect_once_the_model_exists(self):
+        from django.db.models.signals import post_delete, post_save
+
+        class Vocabulary:
+            pass
+
+        app_config = MagicMock()
+        app_config.get_model.return_value = Vocabulary
+        self.assertTrue(connect_vocab_receivers(app_config))
+        self.addCleanup(post_save.disconnect, sender=Vocabulary, dispatch_uid='extend_vocab_id_range')
+        for signal in (post_save, post_delete):
+            for name in ('mark_vocab_dirty', 'invalidate_recommendations'):
+                self.addCleanup(signal.disconnect, sender=Vocabulary, dispatch_uid=name)
+
+        self.assertTrue(post_save.has_listeners(Vocabulary))
+        self.assertTrue(post_delete.has_listeners(Vocabulary))
+
+
+class RandomIdProbingTest(SimpleTestCase):
+    def test_samples_only_existing_rows_across_gaps(self):
+        existing = set(range(1, 10001, 7))  # most ids are gaps
+
+        def fetch_existing(candidate_ids):
+            return [candidate for candidate in candidate_ids if candidate in existing]
+
+        ids = probe_random_ids(fetch_existing, 1, 10000, 10, rng=random.Random(0))
+
+        self.assertEqual(len(ids), 10)
+        self.assertEqual(len(set(ids)), 10)
+        self.assertTrue(set(ids) <= existing)
+
+    def test_selective_filter_returns_what_it_can(self):
+        def fetch_existing(candidate_ids):
+            return [candidate for candidate in candidate_ids if candidate == 42]
+
+        ids = probe_random_ids(fetch_existing, 1, 100, 10, rng=random.Random(0))
+        self.assertEqual(ids, [42])
+
+    def test_empty_table(self):
+        self.assertEqual(probe_random_ids(lambda candidate_ids: [], None, None, 10), [])
+
+
+class RecommendationStalenessTest(SimpleTestCase):
+    def setUp(self):
+        self.entry = {'data': [], 'embedding': [1.0, 0.0, 0.0], 'vocab_version': 3}
+
+    def test_small_drift_keeps_the_stored_list(self):
+        self.assertFalse(is_stale(self.entry, [1.0, 0.01, 0.0], vocab_version=3))
+
+    def test_large_drift_or_vocab_change_recomputes(self):
+        self.assertTrue(is_stale(self.entry, [0.0, 1.0, 0.0], vocab_version=3))
+        self.assertTrue(is_stale(self.entry, [1.0, 0.0, 0.0], vocab_version=4))
+        self.assertTrue(is_stale(None, [1.0, 0.0, 0.0], vocab_version=3))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RecommendVocabBatchTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        # User 1 has a stored list, user 2 a stored empty one, users 3 and 4
+        # have none and only user 3 has an embedding to compute it from
+        self.stored = {1: [{'id': 10, 'word': 'ten'}, {'id': 11, 'word': 'eleven'}], 2: []}
+        self.computed = {3: [{'id': 12, 'word': 'twelve'}]}
+        store_recommendations(self.stored, {1: [1.0, 0.0], 2: [0.0, 1.0]})
+
+    def send(self, task, *args):
+        """
+        Runs a task, returns {group: data} of what it pushed and the compute_and_store mock.
+        """
+        channel_layer = MagicMock()
+        channel_layer.group_send = AsyncMock()
+        with patch('api.tasks.get_channel_layer', return_value=channel_layer), \
+                patch('api.tasks.compute_and_store') as mock_compute:
+            mock_compute.side_effect = lambda user_ids: {user_id: self.computed[user_id] for user_id in user_ids if user_id in self.computed}
+            task(*args)
+        return {call.args[0]: call.args[1]['data'] for call in channel_layer.group_send.call_args_list}, mock_compute
+
+    def test_batch_sends_what_each_user_would_get(self):
+        expected = {}
+        for user_id in (1, 2, 3, 4):
+            sent, _ = self.send(recommend_vocab, user_id)
+            expected.update(sent)
+
+        sent, _ = self.send(recommend_vocab_batch, ['1', '2', '3', '4'])
+
+        self.assertEqual(sent, expected)
+
+    def test_only_missing_lists_are_computed(self):
+        sent, mock_compute = self.send(recommend_vocab_batch, [1, 2, 3, 4])
+
+        # An empty stored list is a result, not a miss
+        mock_compute.assert_called_once_with([3, 4])
+        self.assertEqual(sent, {
+            'user_1': self.stored[1],
+            'user_2': [],
+            'user_3': self.computed[3],
+            'user_4': [],
+        })
+
+    def test_users_without_neighbours_get_an_empty_list(self):
+        """Users the LATERAL join returns no rows for are still in the result."""
+        with patch('api.models.Vocabulary', create=True), \
+                patch('api.vector_search.transaction'), \
+                patch('api.vector_search.connection') as mock_connection:
+            cursor = mock_connection.cursor.return_value.__enter__.return_value
+            cursor.fetchall.return_value = [(1, 10), (1, 11), (3, 12)]
+            results = _pgvector_nearest_ids_for_users([1, 2, 3], k=2)
+
+        self.assertEqual(results, {1: [10, 11], 2: [], 3: [12]})
+
+
+class EmbeddingFoldTest(SimpleTestCase):
+    def test_known_vocab_pulls_embedding_closer(self):
+        embedding = np.array([0.0, 0.0], dtype=np.float32)
+        vocab = np.array([1.0, 1.0], dtype=np.float32)
+
+        folded = fold_events(embedding.copy(), [vocab, vocab], ['known', 'known'])
+
+        self.assertLess(np.linalg.norm(folded - vocab), np.linalg.norm(embedding - vocab))
+
+    def test_failed_vocab_pushes_embedding_away(self):
+        embedding = np.array([0.5, 0.5], dtype=np.float32)
+        vocab = np.array([1.0, 1.0], dtype=np.float32)
+
+        folded = fold_events(embedding.copy(), [vocab], ['failed'])
+
+        self.assertGreater(np.linalg.norm(folded - vocab), np.linalg.norm(embedding - vocab))
+
+    def test_first_positive_event_seeds_missing_embedding(self):
+        vocab = np.array([1.0, 2.0], dtype=np.float32)
+
+        self.assertIsNone(fold_events(None, [vocab], ['failed']))
+        np.testing.assert_array_equal(fold_events(None, [vocab], ['seen']), vocab)
+
+    def test_events_must_be_objects(self):
+        with self.assertRaises(ValueError):
+            record_learning_events(1, [[1, 'known']])
+
+    def test_failed_write_keeps_the_batch_queued(self):
+        from django.db import DatabaseError
+
+        redis = MagicMock()
+        redis.lrange.return_value = [json.dumps({'user_id': 1, 'vocab_id': 2, 'kind': 'known'}).encode()]
+        with patch('api.embeddings.get_redis_connection', return_value=redis), \
+                patch('api.models.Vocabulary', create=True) as mock_vocab, \
+                patch('api.models.User') as mock_user:
+            mock_vocab.objects.filter.return_value.exclude.return_value.values_list.return_value = [(2, [1.0, 0.0])]
+            mock_user.objects.filter.return_value.values_list.return_value = [(1, [0.0, 1.0])]
+
+            mock_user.objects.bulk_update.side_effect = DatabaseError
+            with self.assertRaises(DatabaseError):
+                apply_embedding_events()
+            redis.ltrim.assert_not_called()
+
+            mock_user.objects.bulk_update.side_effect = None
+            self.assertEqual(apply_embedding_events(), 1)
+
+        redis.ltrim.assert_called_once_with(EVENT_QUEUE_KEY, 1, -1)
+
+
+class S3URLResolverTest(SimpleTestCase):
+    @override_settings(AWS_S3_CUSTOM_DOMAIN='bucket.s3.amazonaws.com')
+    def test_bulk_resolution_matches_single_paths(self):
+        rows = [{'word_audio': '/words/a.mp3', 'sentence_audio': 'https://cdn.example.com/s.mp3'}, {'word_audio': None}]
+
+        resolve_audio_urls(rows)
+
+        self.assertEqual(rows[0]['word_audio'], 'https://bucket.s3.amazonaws.com/words/a.mp3')
+        self.assertEqual(rows[0]['sentence_audio'], 'https://cdn.example.com/s.mp3')
+        self.assertIsNone(rows[1]['word_audio'])
+        self.assertEqual(get_s3_audio_url('words/a.mp3'), rows[0]['word_audio'])
+
+    @override_settings(AWS_S3_CUSTOM_DOMAIN=None, MEDIA_URL='/media/')
+    def test_falls_back_to_media_url(self):
+        self.assertEqual(get_s3_audio_url('words/a.mp3'), '/media/words/a.mp3')
+
+    def test_stored_lists_are_resolved_on_a_copy(self):
+        """Rows shared between users' lists must not be resolved twice."""
+        row = {'word_audio': 'words/a.mp3'}
+        with override_settings(AWS_S3_CUSTOM_DOMAIN=None, MEDIA_URL='/media/'):
+            first, second = with_audio_urls([row]), with_audio_urls([row])
+
+        self.assertEqual(first, second)
+        self.assertEqual(first[0]['word_audio'], '/media/words/a.mp3')
+        self.assertEqual(row['word_audio'], 'words/a.mp3')
+
+
+class CloudFrontPolicySignerTest(SimpleTestCase):
+    def setUp(self):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.pem = self.key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ).decode()
+
+    def decode(self, value):
+        return base64.b64decode(value.replace('-', '+').replace('_', '=').replace('~', '/'))
+
+    def test_policy_is_signed_and_outlives_expires_in(self):
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        signer = CloudFrontPolicySigner('KEYID', self.pem, 'cdn.example.com', 3600)
+        with patch('api.utils.time.time', return_value=7000):
+            query = signer.query_string()
+        params = dict(part.split('=', 1) for part in query.split('&'))
+        policy = self.decode(params['Policy'])
+
+        self.key.public_key().verify(self.decode(params['Signature']), policy, padding.PKCS1v15(), hashes.SHA1())
+        statement = json.loads(policy)['Statement'][0]
+        self.assertEqual(statement['Resource'], 'https://cdn.example.com/*')
+        self.assertEqual(statement['Condition']['DateLessThan']['AWS:EpochTime'], 10800)
+        self.assertEqual(params['Key-Pair-Id'], 'KEYID')
+
+    def test_signature_is_reused_within_its_window(self):
+        signer = CloudFrontPolicySigner('KEYID', self.pem, 'cdn.example.com', 3600)
+        with patch('api.utils.time.time', return_value=7000):
+            query = signer.query_string()
+        with patch('api.utils.time.time', return_value=7199):
+            self.assertIs(signer.query_string(), query)
+        with patch('api.utils.time.time', return_value=7200):
+            self.assertNotEqual(signer.query_string(), query)
+
+    def test_signed_urls_point_at_cloudfront(self):
+        keys = {'AWS_CLOUDFRONT_KEY_ID': 'KEYID', 'AWS_CLOUDFRONT_PRIVATE_KEY': self.pem}
+        with override_settings(AWS_S3_CUSTOM_DOMAIN='bucket.s3.amazonaws.com', AWS_CLOUDFRONT_DOMAIN='cdn.example.com', **keys):
+            self.assertRegex(get_s3_audio_url('words/a.mp3'), r'^https://cdn\.example\.com/words/a\.mp3\?Policy=.+&Key-Pair-Id=KEYID$')
+
+        # S3 ignores CloudFront signatures, without a distribution nothing is signed
+        with override_settings(AWS_S3_CUSTOM_DOMAIN='bucket.s3.amazonaws.com', AWS_CLOUDFRONT_DOMAIN=None, **keys):
+            self.assertEqual(get_s3_audio_url('words/a.mp3'), 'https://bucket.s3.amazonaws.com/words/a.mp3')
+
+
+@override_settings(TIER_REGISTRY_PUBSUB=False)
+class TierRegistryTest(TestCase):
+    def setUp(self):
+        self.free_tier = SubscriptionTier.objects.create(name='free', display_name='Free', price=0, monthly_translation_limit=5, daily_translation_limit=1)
+        self.premium_tier = SubscriptionTier.objects.create(name='premium', display_name='Premium', price=9.99, monthly_translation_limit=100, daily_translation_limit=10)
+        self.user = User.objects.create_user(username='tieruser', email='tier@example.com', password='pqgdfgafhareyasg')
+        self.user.subscription_tier = self.premium_tier
+        self.user.is_subscription_active = True
+        tier_registry.invalidate()
+
+    def test_registry_loads_once(self):
+        with self.assertNumQueries(1):
+            tier_registry.all()
+            tier_registry.free()
+
+    def test_get_current_tier_runs_no_queries(self):
+        """Once warm, resolving a tier never touches the DB, for paid or free users."""
+        tier_registry.all()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user.get_current_tier(), self.premium_tier)
+            self.user.is_subscription_active = False
+            self.assertEqual(self.user.get_current_tier(), self.free_tier)
+
+    def test_expired_subscription_resolves_to_free_before_the_sweep(self):
+        tier_registry.all()
+        self.user.subscription_end_date = timezone.now() - timedelta(minutes=1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user.get_current_tier(), self.free_tier)
+
+    def test_saving_a_tier_reloads_and_broadcasts(self):
+        tier_registry.all()
+
+        with patch('api.tiers.get_redis_connection') as mock_redis:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.premium_tier.daily_translation_limit = 20
+                self.premium_tier.save()
+
+        mock_redis.return_value.publish.assert_called_once()
+        self.assertEqual(tier_registry.get(self.premium_tier.id).daily_translation_limit, 20)
+
+
+class UsageMeteringTest(SimpleTestCase):
+    def test_seeds_only_count_the_current_period(self):
+        today = date(2025, 3, 14)
+        user = User(daily_translations_used=3, monthly_translations_used=40, last_translation_date=today, last_monthly_reset=date(2025, 3, 1))
+        self.assertEqual(metering._seeds(user, today), (3, 40))
+
+        user.last_translation_date = date(2025, 3, 13)
+        user.last_monthly_reset = date(2024, 3, 1)
+        self.assertEqual(metering._seeds(user, today), (0, 0))
+
+    def test_consume_reports_the_limit_that_was_hit(self):
+        """The script's verdict decides the outcome, the instance mirrors the counters."""
+        user = User(id=7)
+        tier = SubscriptionTier(name='free', daily_translation_limit=5, monthly_translation_limit=150)
+
+        with patch.object(User, 'get_current_tier', return_value=tier), patch('api.metering._get_script') as mock_script:
+            mock_script.return_value.return_value = [1, 2, 9, 0]
+            self.assertEqual(user.consume_translation(), (True, "OK"))
+            self.assertEqual((user.daily_translations_used, user.monthly_translations_used), (2, 9))
+
+            mock_script.return_value.return_value = [0, 5, 9, 1]
+            self.assertEqual(user.consume_translation(), (False, metering.DAILY_LIMIT_MESSAGE))
+
+        args = mock_script.return_value.call_args.kwargs['args']
+        self.assertEqual(args[:2], [5, 150])
+        self.assertEqual(args[-1], '1')
+
+    def test_usage_reads_the_counters_of_the_current_period(self):
+        """The User row still holds yesterday's count until a counter exists for today."""
+        user = User(id=7, daily_translations_used=4, monthly_translations_used=30, last_translation_date=date(2025, 3, 13), last_monthly_reset=date(2025, 3, 1))
+        now = timezone.make_aware(datetime(2025, 3, 14, 12))
+
+        with patch('api.metering.timezone.now', return_value=now), patch('api.metering.get_redis_connection') as mock_redis:
+            mock_redis.return_value.mget.return_value = [None, b'31']
+            self.assertEqual(metering.usage(user), (0, 31))
+
+            mock_redis.return_value.mget.return_value = [b'2', b'33']
+            self.assertEqual(metering.usage(user), (2, 33))
+
+        mock_redis.return_value.mget.assert_called_with('usage:7:d:20250314', 'usage:7:m:202503')
+
+    def test_flush_keeps_users_dirty_until_their_rows_are_written(self):
+        from django.db import DatabaseError
+
+        members = [b'7:20250313', b'7:20250314']
+        redis = MagicMock()
+        redis.srandmember.return_value = members
+        with patch('api.metering.get_redis_connection', return_value=redis), patch.object(User.objects, 'bulk_update') as mock_update:
+            redis.mget.return_value = [b'2', b'33']
+            mock_update.side_effect = DatabaseError
+            with self.assertRaises(DatabaseError):
+                metering.flush_usage()
+            redis.srem.assert_not_called()
+
+            mock_update.side_effect = None
+            self.assertEqual(metering.flush_usage(), 1)
+
+        redis.mget.assert_called_with(['usage:7:d:20250314', 'usage:7:m:202503'])
+        redis.srem.assert_called_once_with(metering.DIRTY_SET_KEY, *members)
+        user = mock_update.call_args.args[0][0]
+        self.assertEqual((user.id, user.daily_translations_used, user.last_translation_date), (7, 2, date(2025, 3, 14)))
+
+
+class RateLimitMiddlewareTest(SimpleTestCase):
+    def setUp(self):
+        self.tier = SubscriptionTier(name='free', requests_per_minute=60, request_burst=10)
+
+    def test_rejection_carries_retry_after(self):
+        with patch('api.ratelimit.tier_registry') as mock_registry, patch('api.ratelimit._get_script') as mock_script:
+            mock_registry.free.return_value = self.tier
+            mock_script.return_value.return_value = [0, '2.4']
+            response = self.client.get(reverse('get_subscription_tiers'))
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '3')
+        # Anonymous clients share the free tier bucket of their address, at the route's cost
+        kwargs = mock_script.return_value.call_args.kwargs
+        self.assertEqual(kwargs['keys'], ['ratelimit:addr:127.0.0.1'])
+        self.assertEqual(kwargs['args'], [1.0, 10, 1])
+
+    def test_redis_outage_lets_requests_through(self):
+        with patch('api.ratelimit.tier_registry') as mock_registry, patch('api.ratelimit._get_script', side_effect=ConnectionError):
+            mock_registry.free.return_value = self.tier
+            self.assertEqual(take(None, '10.0.0.1', cost=5), (True, 0))
+
+    @patch('api.ratelimit.RATE_LIMIT_PROXY_DEPTH', 1)
+    def test_anonymous_clients_are_keyed_on_the_trusted_hop(self):
+        """The hop the proxy appended counts, whatever the client put before it."""
+        self.assertEqual(client_address('1.1.1.1, 203.0.113.7', '10.0.0.1'), '203.0.113.7')
+        self.assertEqual(client_address(None, '10.0.0.1'), '10.0.0.1')
+
+        with patch('api.ratelimit.tier_registry') as mock_registry, patch('api.ratelimit._get_script') as mock_script:
+            mock_registry.free.return_value = self.tier
+            mock_script.return_value.return_value = [1, '0']
+            self.client.get(reverse('get_subscription_tiers'), HTTP_X_FORWARDED_FOR='1.1.1.1, 203.0.113.7')
+
+        self.assertEqual(mock_script.return_value.call_args.kwargs['keys'], ['ratelimit:addr:203.0.113.7'])
+
+    def test_webhook_and_health_check_are_exempt(self):
+        with patch('api.ratelimit._get_script') as mock_script:
+            self.client.get(reverse('health_check'))
+            self.client.get(reverse('paypal_webhook'))
+
+        mock_script.assert_not_called()
+
+    def test_users_known_by_id_draw_from_their_own_bucket(self):
+        premium = SubscriptionTier(name='premium', requests_per_minute=600, request_burst=50)
+        with patch('api.ratelimit.tier_registry') as mock_registry, patch('api.ratelimit._get_script') as mock_script:
+            mock_registry.get_by_name.return_value = premium
+            mock_script.return_value.return_value = [1, '0']
+            self.assertEqual(take_user(42, 'premium'), (True, 0))
+
+        kwargs = mock_script.return_value.call_args.kwargs
+        self.assertEqual(kwargs['keys'], ['ratelimit:user:42'])
+        self.assertEqual(kwargs['args'], [10.0, 50, 1])
+
+
+class PayPalClientTest(FakePayPalMixin, SimpleTestCase):
+    def make_client(self, max_retries=3):
+        return PayPalClient(self.paypal.url, 'test-client', 'test-secret', timeout=5, max_retries=max_retries, backoff=0)
+
+    async def test_access_token_is_reused(self):
+        client = self.make_client()
+
+        await client.create_order({'intent': 'CAPTURE'})
+        await client.capture_order('PAYPAL_ORDER_ID')
+        await client.aclose()
+
+        self.assertEqual(self.paypal.paths().count('/v1/oauth2/token'), 1)
+
+    async def test_retries_keep_the_request_id(self):
+        """A retried POST must not create a second order."""
+        client = self.make_client()
+        self.paypal.fail('/v2/checkout/orders', 2)
+
+        order = await client.create_order({'intent': 'CAPTURE'})
+        await client.aclose()
+
+        self.assertEqual(order['id'], 'PAYPAL_ORDER_ID')
+        request_ids = {
+            headers['PayPal-Request-Id'] for path, headers in self.paypal.requests
+            if path == '/v2/checkout/orders'
+        }
+        self.assertEqual(self.paypal.paths().count('/v2/checkout/orders'), 3)
+        self.assertEqual(len(request_ids), 1)
+
+    async def test_gives_up_after_max_retries(self):
+        client = self.make_client(max_retries=1)
+        self.paypal.fail('/v2/checkout/orders', 5)
+
+        with self.assertRaises(PayPalError) as raised:
+            await client.create_order({'intent': 'CAPTURE'})
+        await client.aclose()
+
+        self.assertEqual(raised.exception.status_code, 503)
+
+    def test_reconcile_task_closes_its_client(self):
+        """Each run of the task gets a new loop, its client must not outlive it."""
+        async def reconcile(limit):
+            await get_paypal_client().get_order('PAYPAL_ORDER_ID')
+            return {}
+
+        opened = []
+        http = PayPalClient._http
+
+        def record_http(client):
+            opened.append(http(client))
+            return opened[-1]
+
+        with patch('api.payments.reconcile_stuck_captures', side_effect=reconcile), \
+                patch.object(PayPalClient, '_http', record_http):
+            tasks.reconcile_stuck_captures()
+            self.paypal.fail('/v2/checkout/orders/PAYPAL_ORDER_ID', 5)
+            with self.assertRaises(PayPalError):
+                tasks.reconcile_stuck_captures()
+
+        self.assertEqual(len({id(http_client) for http_client in opened}), 2)
+        self.assertTrue(all(http_client.is_closed for http_client in opened))
+
+
+def make_signing_cert():
+    """A throwaway key and self-signed certificate standing in for PayPal's."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'messageverificationcerts.paypal.com')])
+    now = timezone.now()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    return key, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def sign_webhook(key, body, webhook_id='WH-TEST', cert_url='https://api.paypal.com/v1/notifications/certs/CERT-TEST'):
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    signature = key.sign(signed_message('TX-1', '2026-10-18T10:00:00Z', webhook_id, body), padding.PKCS1v15(), hashes.SHA256())
+    return {
+        'Paypal-Transmission-Id': 'TX-1',
+        'Paypal-Transmission-Time': '2026-10-18T10:00:00Z',
+        'Paypal-Transmission-Sig': base64.b64encode(signature).decode(),
+        'Paypal-Cert-Url': cert_url,
+        'Paypal-Auth-Algo': 'SHA256withRSA',
+    }
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PAYPAL_WEBHOOK_ID='WH-TEST')
+class WebhookSignatureTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.key, cls.cert_pem = make_signing_cert()
+
+    def setUp(self):
+        self.body = b'{"id": "WH-EVENT-1", "event_type": "PAYMENT.CAPTURE.COMPLETED"}'
+
+    async def test_signed_delivery_is_accepted_with_a_cached_cert(self):
+        headers = sign_webhook(self.key, self.body)
+
+        with patch('api.webhooks._certs', {}), patch('api.webhooks.httpx.AsyncClient') as mock_client:
+            mock_client.return_value.__aenter__.return_value.get.return_value = MagicMock(status_code=200, text=self.cert_pem)
+            await verify_signature(headers, self.body)
+            await verify_signature(headers, self.body)
+
+        # The certificate is downloaded once
+        self.assertEqual(mock_client.call_count, 1)
+
+    async def test_tampered_body_is_rejected(self):
+        headers = sign_webhook(self.key, self.body)
+
+        with patch('api.webhooks._certs', {}), patch('api.webhooks.httpx.AsyncClient') as mock_client:
+            mock_client.return_value.__aenter__.return_value.get.return_value = MagicMock(status_code=200, text=self.cert_pem)
+            with self.assertRaises(WebhookVerificationError):
+                await verify_signature(headers, self.body.replace(b'COMPLETED', b'REFUNDED'))
+
+    async def test_certificate_must_come_from_paypal(self):
+        headers = sign_webhook(self.key, self.body, cert_url='https://paypal.com.example.org/cert')
+
+        with patch('api.webhooks._certs', {}), self.assertRaises(WebhookVerificationError):
+            await verify_signature(headers, self.body)
+
+
+class WebhookProcessingTest(TestCase):
+    def setUp(self):
+        self.tier = SubscriptionTier.objects.create(name='premium', display_name='Premium', price=9.99, monthly_translation_limit=100, daily_translation_limit=10)
+        self.user = User.objects.create_user(username='hookuser', email='hook@example.com', password='pqgdfgafhareyasg')
+        self.payment = PaymentTransaction.objects.create(
+            user=self.user,
+            subscription_tier=self.tier,
+            paypal_order_id='HOOK_ORDER',
+            amount=9.99,
+            status='pending'
+        )
+
+    def add_event(self, event_id, event_type, resource):
+        PayPalWebhookEvent.objects.create(
+            event_id=event_id,
+            event_type=event_type,
+            payload={'id': event_id, 'event_type': event_type, 'resource': resource},
+        )
+
+    def test_events_are_applied_in_order_in_one_batch(self):
+        """A completed capture followed by its refund leaves the payment refunded and the plan inactive."""
+        capture = {'id': 'HOOK_CAPTURE', 'supplementary_data': {'related_ids': {'order_id': 'HOOK_ORDER'}}}
+        refund = {'id': 'HOOK_REFUND', 'links': [{'rel': 'up', 'href': 'https://api.paypal.com/v2/payments/captures/HOOK_CAPTURE'}]}
+        self.add_event('WH-1', 'PAYMENT.CAPTURE.COMPLETED', capture)
+        self.add_event('WH-2', 'PAYMENT.CAPTURE.REFUNDED', refund)
+        self.add_event('WH-3', 'CHECKOUT.ORDER.APPROVED', {'id': 'HOOK_ORDER'})
+
+        processed = process_webhook_events()
+
+        self.assertEqual(processed, 3)
+        self.payment.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.payment.status, 'refunded')
+        self.assertEqual(self.payment.paypal_capture_id, 'HOOK_CAPTURE')
+        self.assertEqual(self.user.subscription_tier, self.tier)
+        self.assertFalse(self.user.is_subscription_active)
+        self.assertFalse(PayPalWebhookEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_bad_payload_is_set_aside_without_failing_the_batch(self):
+        capture = {'id': 'HOOK_CAPTURE', 'supplementary_data': {'related_ids': {'order_id': 'HOOK_ORDER'}}}
+        self.add_event('WH-1', 'PAYMENT.CAPTURE.COMPLETED', {'id': 'BAD', 'supplementary_data': None, 'links': None})
+        PayPalWebhookEvent.objects.create(event_id='WH-2', event_type='', payload={'id': 'WH-2'})
+        self.add_event('WH-3', 'PAYMENT.CAPTURE.COMPLETED', {**capture, 'payer': None})
+        self.add_event('WH-4', 'PAYMENT.CAPTURE.COMPLETED', capture)
+
+        self.assertEqual(process_webhook_events(), 4)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+        self.assertFalse(PayPalWebhookEvent.objects.filter(processed_at__isnull=True).exists())
+        self.assertEqual(
+            set(PayPalWebhookEvent.objects.exclude(error='').values_list('event_id', flat=True)),
+            {'WH-2', 'WH-3'},
+        )
+
+
+class SubscriptionExpiryTest(TestCase):
+    def setUp(self):
+        self.tier = SubscriptionTier.objects.create(name='premium', display_name='Premium', price=9.99, monthly_translation_limit=100, daily_translation_limit=10)
+        now = timezone.now()
+        self.expired = [
+            User.objects.create_user(
+                username=f'expired{i}', email=f'expired{i}@example.com', password='pqgdfgafhareyasg',
+                subscription_tier=self.tier, is_subscription_active=True,
+                subscription_end_date=now - timedelta(days=i + 1),
+            )
+            for i in range(3)
+        ]
+        self.current = User.objects.create_user(
+            username='current', email='current@example.com', password='pqgdfgafhareyasg',
+            subscription_tier=self.tier, is_subscription_active=True,
+            subscription_end_date=now + timedelta(days=10),
+        )
+
+    def test_sweep_downgrades_expired_users_in_batches(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(expire_subscriptions(batch_size=2), 2)
+        self.assertEqual(expire_subscriptions(batch_size=2), 1)
+        self.assertEqual(expire_subscriptions(batch_size=2), 0)
+
+        self.assertFalse(User.objects.filter(pk__in=[user.pk for user in self.expired], is_subscription_active=True).exists())
+        self.current.refresh_from_db()
+        self.assertTrue(self.current.is_subscription_active)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class WebSocketTicketTest(SimpleTestCase):
+    def setUp(self):
+        self.user = User(id=42)
+        tier = SubscriptionTier(name='premium')
+        with patch.object(User, 'get_current_tier', return_value=tier):
+            self.ticket = issue_ticket(self.user)
+
+    async def test_ticket_is_single_use(self):
+        claims = await aredeem_ticket(self.ticket)
+
+        self.assertEqual((claims['uid'], claims['tier']), (42, 'premium'))
+        with self.assertRaises(InvalidTicket):
+            await aredeem_ticket(self.ticket)
+
+    async def test_tampered_or_expired_ticket_is_rejected(self):
+        with self.assertRaises(InvalidTicket):
+            await aredeem_ticket(self.ticket[:-2] + 'xx')
+
+        with patch('api.ws_tickets.WS_TICKET_MAX_AGE', -1), self.assertRaises(InvalidTicket):
+            await aredeem_ticket(self.ticket)
+
+    async def test_connect_with_ticket_needs_no_user_row(self):
+        """SimpleTestCase fails on any query, so accepting the socket proves none ran."""
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), f"/ws/notifications/?token={self.ticket}")
+
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
+
+    async def test_socket_is_limited_per_user_after_redeeming_the_ticket(self):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), f"/ws/notifications/?token={self.ticket}")
+
+        with patch('api.consumers.take_user', side_effect=[(True, 0), (False, 1.0)]) as mock_take:
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_to(text_data=json.dumps({'type': 'ping'}))
+            output = await communicator.receive_output()
+
+        self.assertEqual(output, {'type': 'websocket.close', 'code': 4029})
+        mock_take.assert_called_with(42, 'premium')
+        await communicator.wait()
+
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), f"/ws/notifications/?token={self.ticket}")
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4001)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CachedJWTAuthenticationTest(SimpleTestCase):
+    def test_token_is_verified_once_per_request(self):
+        user = User(id=7, email='jwt@example.com', is_active=True)
+        request = APIRequestFactory().get('/api/user_profile_view/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+        def view(request):
+            return CachedJWTAuthentication().authenticate(Request(request))
+
+        with patch('api.authentication.get_cached_user', return_value=user) as mock_get_user, \
+                patch.object(CachedJWTAuthentication, 'get_validated_token', wraps=CachedJWTAuthentication().get_validated_token) as mock_validate:
+            authenticated_user, _ = JWTAuthenticationMiddleware(view)(request)
+
+        self.assertIs(request.user, user)
+        self.assertIs(authenticated_user, user)
+        mock_get_user.assert_called_once()
+        mock_validate.assert_called_once()
+
+    def test_invalid_token_is_rejected_by_drf_views(self):
+        response = self.client.get(reverse('get_subscription_tiers'), HTTP_AUTHORIZATION='Bearer not-a-token')
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_users_are_read_from_the_database_when_the_cache_is_down(self):
+        user = User(id=8, email='down@example.com', is_active=True)
+        request = APIRequestFactory().get('/api/user_profile_view/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        self.addCleanup(authentication._local_users.clear)
+
+        with patch('api.authentication.cache') as mock_cache, patch.object(User.objects, 'defer') as mock_defer:
+            mock_cache.get.side_effect = ConnectionError
+            mock_cache.set.side_effect = ConnectionError
+            mock_defer.return_value.get.return_value = user
+            authenticated_user = JWTAuthenticationMiddleware(lambda request: request.user)(request)
+
+        self.assertEqual(authenticated_user.email, 'down@example.com')
+        mock_defer.return_value.get.assert_called_once_with(pk=8)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UserCacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cacheuser', email='cache@example.com', password='pqgdfgafhareyasg')
+
+    def test_users_are_loaded_once_and_dropped_on_save(self):
+        with self.assertNumQueries(1):
+            get_cached_user(self.user.pk)
+            cached = get_cached_user(self.user.pk)
+        self.assertEqual(cached.email, 'cache@example.com')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.name = 'Renamed'
+            self.user.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_cached_user(self.user.pk).name, 'Renamed')
+
+
+class StructuredLoggingTest(SimpleTestCase):
+    def make_record(self, level=logging.INFO, msg='hello %s', args=('world',), **extra):
+        record = logging.makeLogRecord({'name': 'api.test', 'levelno': level, 'levelname': logging.getLevelName(level), 'msg': msg, 'args': args, **extra})
+        log.RequestIdFilter().filter(record)
+        return record
+
+    def test_records_are_json_with_request_id_and_extras(self):
+        tokens = log.begin('abc-123')
+        try:
+            record = self.make_record(route='chat_response')
+        finally:
+            log.end(tokens)
+
+        entry = json.loads(log.JSONFormatter().format(record))
+        self.assertEqual(entry['message'], 'hello world')
+        self.assertEqual(entry['request_id'], 'abc-123')
+        self.assertEqual(entry['route'], 'chat_response')
+
+    def test_unsampled_requests_keep_only_warnings(self):
+        with override_settings(LOG_SAMPLING_RATES={'get_graph_data': 0.0}):
+            tokens = log.begin(None, 'get_graph_data')
+        try:
+            self.assertFalse(log.SamplingFilter().filter(self.make_record(logging.INFO)))
+            self.assertTrue(log.SamplingFilter().filter(self.make_record(logging.ERROR)))
+        finally:
+            log.end(tokens)
+
+    def test_queue_handler_writes_from_listener_thread(self):
+        stream = io.StringIO()
+        handler = log.QueueLogHandler(stream)
+        handler.setFormatter(log.JSONFormatter())
+        words = ['world']
+        handler.handle(self.make_record(args=(words,)))
+        # Changing the arguments after the call must not change the message
+        words.append('changed')
+        handler._stop()
+
+        self.assertEqual(json.loads(stream.getvalue())['message'], "hello ['world']")
+
+    def test_request_id_is_echoed(self):
+        response = self.client.get(reverse('get-csrf-token'), HTTP_X_REQUEST_ID='req-42')
+        self.assertEqual(response['X-Request-ID'], 'req-42')
+
+        response = self.client.get(reverse('get-csrf-token'), HTTP_X_REQUEST_ID='bad id\n')
+        self.assertNotEqual(response['X-Request-ID'], 'bad id\n')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LLMRegistryTest(SimpleTestCase):
+    def setUp(self):
+        self.server = self.enterContext(FakeOllamaServer(tokens=3))
+        self.enterContext(self.settings(
+            OLLAMA_BASE_URL=self.server.url,
+            LLM_MODELS={'chat': {'model': 'test-model', 'keep_alive': '30m', 'num_ctx': 4096}},
+            LLM_WARMUP=False,
+        ))
+        self.record = self.enterContext(patch('api.llm.record_generation'))
+
+    def test_model_is_reused_within_a_loop(self):
+        async def stream_twice():
+            first = [token async for token in stream_chat(chat_messages('hello'))]
+            second = [token async for token in stream_chat(chat_messages('again'))]
+            return first, second, llm_registry.get() is llm_registry.get()
+
+        first, second, same = async_to_sync(stream_twice)()
+
+        self.assertEqual(first, ['token0 ', 'token1 ', 'token2 '])
+        self.assertEqual(second, first)
+        self.assertTrue(same)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.requests[0]['model'], 'test-model')
+        self.assertEqual(self.server.requests[0]['keep_alive'], '30m')
+        self.assertEqual(self.server.requests[0]['messages'][0]['content'], SYSTEM_PROMPT)
+
+    def test_generation_metrics_are_recorded(self):
+        async def consume():
+            return [token async for token in stream_chat(chat_messages('hello'))]
+
+        async_to_sync(consume)()
+
+        name, metadata, first_token = self.record.call_args.args
+        self.assertEqual(name, 'chat')
+        self.assertEqual(metadata['prompt_eval_count'], 1000)
+        self.assertIsNotNone(first_token)
+
+    def test_first_use_warms_up_the_system_prompt(self):
+        async def get_model():
+            llm_registry.get()
+            await asyncio.gather(*llm_registry._warmups)
+
+        with self.settings(LLM_WARMUP=True):
+            async_to_sync(get_model)()
+
+        warmup, = self.server.requests
+        self.assertEqual([message['role'] for message in warmup['messages']], ['system'])
+        self.assertEqual(warmup['options'], {'num_predict': 1, 'num_ctx': 4096})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ChatMemoryTest(TestCase):
+    def setUp(self):
+        self.server = self.enterContext(FakeOllamaServer(tokens=3))
+        self.enterContext(self.settings(OLLAMA_BASE_URL=self.server.url, LLM_WARMUP=False))
+        self.enterContext(patch('api.llm.record_generation'))
+        self.enterContext(patch('api.semantic_cache.SEMANTIC_CACHE_ENABLED', False))
+        self.user = User.objects.create_user(username='chatuser', email='chat@example.com', password='pqgdfgafhareyasg')
+        self.project = Project.objects.create(user=self.user, project_name='Chat')
+
+    def chat(self, message):
+        async def consume():
+            return ''.join([token async for token in stream_reply(self.project, message)])
+        return async_to_sync(consume)()
+
+    def add_turns(self, count, tokens=100):
+        start = timezone.now() - timedelta(hours=1)
+        ChatMemory.objects.bulk_create([
+            ChatMemory(
+                project=self.project,
+                role='human' if i % 2 == 0 else 'ai',
+                content=f"message {i}",
+                token_count=tokens,
+                created_at=start + timedelta(seconds=i),
+            )
+            for i in range(count * 2)
+        ])
+
+    def test_turns_are_appended_and_extend_the_prompt(self):
+        self.chat('hello')
+        self.chat('again')
+
+        self.assertEqual(
+            list(ChatMemory.objects.order_by('created_at').values_list('role', 'content', 'token_count')),
+            [('human', 'hello', 2), ('ai', 'token0 token1 token2 ', 3), ('human', 'again', 2), ('ai', 'token0 token1 token2 ', 3)],
+        )
+        first, second = (request['messages'] for request in self.server.requests)
+        self.assertEqual(second[:len(first)], first)
+        self.assertEqual(second[-1]['content'], 'again')
+
+    def test_context_is_cut_to_the_token_budget(self):
+        self.add_turns(5)
+
+        with patch('api.chat.CHAT_HISTORY_TOKEN_BUDGET', 450), self.assertNumQueries(2):
+            summary, history, unsummarized = load_context(self.project.pk)
+
+        self.assertIsNone(summary)
+        self.assertEqual([message.content for message in history], ['message 6', 'message 7', 'message 8', 'message 9'])
+        self.assertEqual(unsummarized, 1000)
+
+    def test_older_turns_are_folded_into_the_summary(self):
+        self.add_turns(5)
+
+        with patch('api.chat.CHAT_SUMMARIZE_AT', 800), \
+                patch('api.chat.summarize', AsyncMock(return_value=('They said hello five times.', 10))) as mock_summarize:
+            folded = summarize_project_chat(self.project.pk)
+            summary, history, _ = load_context(self.project.pk)
+
+        self.assertEqual(folded, 6)
+        self.assertEqual([memory.content for memory in mock_summarize.call_args.args[1]], [f"message {i}" for i in range(6)])
+        self.assertIn('They said hello five times.', summary.content)
+        self.assertEqual([message.content for message in history], ['message 6', 'message 7', 'message 8', 'message 9'])
+        self.assertEqual(ChatSummary.objects.get(project=self.project).token_count, 10)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RetrievalTest(SimpleTestCase):
+    def setUp(self):
+        self.search = self.enterContext(patch('cognee.search', new_callable=AsyncMock))
+        self.search.return_value = [{'project_data': 'Node: Seoul\nSeoul -- capital_of -- Korea'}]
+
+    def test_results_are_cached_per_normalized_query(self):
+        async def ask_twice():
+            return await retrieve_facts('nodeset_a', 'What is Seoul?'), await retrieve_facts('nodeset_a', '  what is SEOUL ')
+
+        first, second = async_to_sync(ask_twice)()
+
+        self.assertEqual(first, 'Node: Seoul\nSeoul -- capital_of -- Korea')
+        self.assertEqual(second, first)
+        self.search.assert_awaited_once()
+        kwargs = self.search.call_args.kwargs
+        self.assertEqual(kwargs['node_name'], ['nodeset_a'])
+        self.assertTrue(kwargs['only_context'])
+
+    def test_slow_search_misses_the_deadline_but_fills_the_cache(self):
+        facts = self.search.return_value
+
+        async def slow_search(**kwargs):
+            await asyncio.sleep(0.2)
+            return facts
+        self.search.side_effect = slow_search
+
+        async def ask():
+            missed = await retrieve_facts('nodeset_b', 'slow question', timeout=0.01)
+            await asyncio.sleep(0.3)
+            return missed, await retrieve_facts('nodeset_b', 'slow question', timeout=0.01)
+
+        missed, cached = async_to_sync(ask)()
+
+        self.assertEqual(missed, '')
+        self.assertIn('capital_of', cached)
+        self.search.assert_awaited_once()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@skipUnless(connection.vendor == 'postgresql', "The semantic cache needs pgvector")
+class SemanticCacheTest(TestCase):
+    def setUp(self):
+        self.server = self.enterContext(FakeOllamaServer(tokens=3))
+        self.enterContext(self.settings(OLLAMA_BASE_URL=self.server.url, LLM_WARMUP=False))
+        self.enterContext(patch('api.llm.record_generation'))
+        self.record_lookup = self.enterContext(patch('api.semantic_cache.record_lookup'))
+        self.embed = self.enterContext(patch('api.semantic_cache.embed', new_callable=AsyncMock))
+        self.embed.return_value = [1.0] + [0.0] * 767
+
+    def ask(self, message):
+        async def consume():
+            return ''.join([token async for token in stream_answer(message)])
+        return async_to_sync(consume)()
+
+    def test_similar_question_is_answered_from_the_cache(self):
+        first = self.ask('What is Seoul?')
+        self.embed.return_value = [0.99, 0.05] + [0.0] * 766
+        second = self.ask('what is seoul')
+
+        self.assertEqual(second, first)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(SemanticCacheEntry.objects.get().hits, 1)
+        missed, hit = (call.args[0] for call in self.record_lookup.call_args_list)
+        self.assertIsNone(missed)
+        self.assertEqual(hit.answer, first)
+
+    def test_entries_are_scoped_per_model_and_far_questions_miss(self):
+        self.ask('What is Seoul?')
+        with self.settings(LLM_MODELS={'chat': {'model': 'other-model'}}):
+            self.ask('What is Seoul?')
+        self.embed.return_value = [0.0, 1.0] + [0.0] * 766
+        self.ask('Something else entirely')
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(SemanticCacheEntry.objects.count(), 3)
+
+    def test_same_scope_entry_is_found_among_many_closer_scopes(self):
+        """Filters apply after the HNSW scan, it must keep scanning past other scopes."""
+        SemanticCacheEntry.objects.bulk_create([
+            SemanticCacheEntry(
+                model=semantic_cache._model(),
+                prompt_version=semantic_cache.PROMPT_VERSION,
+                scope=f"user_{i}-topic-abcd:v1",
+                question='What is Seoul?',
+                embedding=[1.0] + [0.0] * 767,
+                answer='other project',
+            )
+            for i in range(200)
+        ])
+        SemanticCacheEntry.objects.create(
+            model=semantic_cache._model(),
+            prompt_version=semantic_cache.PROMPT_VERSION,
+            scope='user_1000-topic-abcd:v1',
+            question='what is seoul',
+            embedding=[0.99, 0.05] + [0.0] * 766,
+            answer='this project',
+        )
+
+        entry = semantic_cache.lookup([1.0] + [0.0] * 767, 'user_1000-topic-abcd:v1')
+
+        self.assertEqual(entry.answer, 'this project')
+
+    def test_only_first_messages_of_a_project_chat_use_the_cache(self):
+        user = User.objects.create_user(username='cacheduser', email='cached@example.com', password='pqgdfgafhareyasg')
+        project = Project.objects.create(user=user, project_name='Cached')
+
+        async def chat(message):
+            return [token async for token in stream_reply(project, message)]
+
+        async_to_sync(chat)('hello')
+        async_to_sync(chat)('hello')
+
+        self.embed.assert_awaited_once()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_expired_and_least_recently_hit_entries_are_evicted(self):
+        now = timezone.now()
+        for age_days in (10, 3, 2, 1):
+            SemanticCacheEntry.objects.create(
+                model='m',
+                prompt_version='v',
+                question=f"{age_days} days",
+                embedding=[1.0] + [0.0] * 767,
+                answer='a',
+                last_hit_at=now - timedelta(days=age_days),
+            )
+
+        self.assertEqual(semantic_cache.evict_entries(now=now), 1)
+        with patch('api.semantic_cache.SEMANTIC_CACHE_MAX_ENTRIES', 2):
+            self.assertEqual(semantic_cache.evict_entries(now=now), 1)
+        self.assertEqual(
+            sorted(SemanticCacheEntry.objects.values_list('question', flat=True)),
+            ['1 days', '2 days'],
+        )
+
+
+class SemanticCacheScanTest(SimpleTestCase):
+    def test_iterative_scan_needs_pgvector_0_8(self):
+        for version, expected in (('0.8.0', True), ('0.10.1', True), ('0.7.4', False), (None, False)):
+            cursor = MagicMock()
+            cursor.fetchone.return_value = (version,) if version else None
+            with self.subTest(version=version), patch('api.semantic_cache._iterative_scan', None):
+                self.assertIs(semantic_cache._supports_iterative_scan(cursor), expected)
@@ -0,0 +1,136 @@
+# api/tiers.py
+"""
+Process-wide registry of subscription tiers.
+
+There are only a handful of SubscriptionTier rows and they rarely change, so
+every process loads them once and resolves tiers from memory. Saving or
+deleting a tier clears the local copy and publishes on a Redis channel so
+that every other process drops its copy as well.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'subscription_tiers:invalidate'
+
+# Reload even without an invalidation, in case this process missed a broadcast
+TIER_REGISTRY_MAX_AGE = getattr(settings, 'TIER_REGISTRY_MAX_AGE', 60 * 10)
+
+FREE_TIER_DEFAULTS = {
+    'display_name': 'Free',
+    'price': 0,
+    'monthly_translation_limit': 150,
+    'daily_translation_limit': 5,
+    'features': ['Basic translation', 'Limited vocabulary tracking']
+}
+
+
+class TierRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiers = None
+        self._loaded_at = 0
+        self._generation = 0
+        self._pid = None
+        self._listener = None
+
+    def _load(self):
+        from .models import SubscriptionTier
+
+        # A forked child inherits the parent's copy but not its listener thread
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._tiers = None
+            self._listener = None
+
+        if self._tiers is not None and time.monotonic() - self._loaded_at > TIER_REGISTRY_MAX_AGE:
+            self._tiers = None
+
+        tiers = self._tiers
+        if tiers is not None:
+            return tiers
+
+        with self._lock:
+            if self._tiers is not None:
+                return self._tiers
+
+            self._start_listener()
+            generation = self._generation
+
+            by_id = {tier.id: tier for tier in SubscriptionTier.objects.all()}
+            if not any(tier.name == 'free' for tier in by_id.values()):
+                free_tier, _ = SubscriptionTier.objects.get_or_create(name='free', defaults=FREE_TIER_DEFAULTS)
+                by_id[free_tier.id] = free_tier
+
+            tiers = {
+                'by_id': by_id,
+                'by_name': {tier.name: tier for tier in by_id.values()},
+            }
+            # An invalidation that raced with the query means the rows may be stale
+            if generation == self._generation:
+                self._tiers = tiers
+                self._loaded_at = time.monotonic()
+            return tiers
+
+    def get(self, tier_id):
+        return self._load()['by_id'].get(tier_id)
+
+    def get_by_name(self, name):
+        return self._load()['by_name'].get(name)
+
+    def free(self):
+        return self._load()['by_name']['free']
+
+    def all(self):
+        return sorted(self._load()['by_id'].values(), key=lambda tier: (tier.price, tier.id))
+
+    def invalidate(self):
+        """
+        Drops this process's copy, the next lookup reloads it.
+        """
+        with self._lock:
+            self._generation += 1
+            self._tiers = None
+
+    def publish_invalidation(self):
+        """
+        Drops the copy of this and every other process.
+        """
+        self.invalidate()
+        try:
+            get_redis_connection('default').publish(INVALIDATION_CHANNEL, os.getpid())
+        except Exception as e:
+            logger.warning(f"Could not broadcast subscription tier invalidation: {e}")
+
+    def _start_listener(self):
+        if self._listener is not None or not getattr(settings, 'TIER_REGISTRY_PUBSUB', True):
+            return
+        self._listener = threading.Thread(target=self._listen, name='tier-registry-listener', daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        reconnecting = False
+        while True:
+            try:
+                pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                if reconnecting:
+                    # Anything may have changed while we were not subscribed
+                    self.invalidate()
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self.invalidate()
+            except Exception as e:
+                logger.warning(f"Subscription tier listener disconnected: {e}")
+                reconnecting = True
+                time.sleep(5)
+
+
+tier_registry = TierRegistry()
@@ -12,12 +12,16 @@ urlpatterns = [
     path('create_project/', views.create_project, name='create_new_project'),
     path('get_projects/', views.get_project_list, name='get_project_list'),
     path('chat/', views.chat_response, name='chat_response'),
+    path('llm-metrics/', views.llm_metrics, name='llm_metrics'),
     path('get_graph_data/', views.get_graph_data, name='get_graph_data'),
+    path('add_project_data/', views.add_project_data_view, name='add_project_data'),
+    path('learning-events/', views.record_learning_events_view, name='record_learning_events'),
 
     # Subscription and Payment URLs
     path('subscription-tiers/', views.get_subscription_tiers, name='get_subscription_tiers'),
     path('create-paypal-order/', views.create_paypal_order, name='create_paypal_order'),
     path('capture-paypal-payment/', views.capture_paypal_payment, name='capture_paypal_payment'),
+    path('paypal-webhook/', views.paypal_webhook, name='paypal_webhook'),
     
     # PayPal return URLs (for frontend routing)
     path('payment/success/', views.payment_success_view, name='payment_success'),
@@ -1,26 +1,144 @@
+import base64
+import json
+import time
+from functools import lru_cache
+
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+# Serialized fields that hold storage paths
+AUDIO_URL_FIELDS = ('word_audio', 'sentence_audio')
+
+
+def _cloudfront_b64(data):
+    return base64.b64encode(data).decode().replace('+', '-').replace('=', '_').replace('/', '~')
+
+
+class CloudFrontPolicySigner:
+    """
+    Signs a CloudFront custom policy that covers every path on the domain.
+
+    One RSA signature is reused for all URLs until the current window ends,
+    so signing a whole result list costs a string concatenation per URL.
+    """
+
+    def __init__(self, key_pair_id, private_key_pem, domain, expires_in):
+        from cryptography.hazmat.primitives import serialization
+
+        self.key_pair_id = key_pair_id
+        self.private_key = serialization.load_pem_private_key(private_key_pem.encode(), password=None)
+        self.domain = domain
+        self.expires_in = expires_in
+        self._query = None
+        self._renew_at = 0
+
+    def query_string(self):
+        now = int(time.time())
+        if self._query is None or now >= self._renew_at:
+            from cryptography.hazmat.primitives import hashes
+            from cryptography.hazmat.primitives.asymmetric import padding
+
+            # Windows are aligned so that every process signs the same policy,
+            # and a URL stays valid for at least expires_in seconds
+            window_end = (now // self.expires_in + 2) * self.expires_in
+            policy = json.dumps({
+                'Statement': [{
+                    'Resource': f"https://{self.domain}/*",
+                    'Condition': {'DateLessThan': {'AWS:EpochTime': window_end}},
+                }]
+            }, separators=(',', ':')).encode()
+            signature = self.private_key.sign(policy, padding.PKCS1v15(), hashes.SHA1())
+
+            self._query = (
+                f"Policy={_cloudfront_b64(policy)}"
+                f"&Signature={_cloudfront_b64(signature)}"
+                f"&Key-Pair-Id={self.key_pair_id}"
+            )
+            self._renew_at = window_end - self.expires_in
+        return self._query
+
+
+class S3URLResolver:
+    """
+    Turns storage paths into full URLs. Settings are read once when the
+    resolver is built, not on every call.
+    """
+
+    def __init__(self, domain=None, media_url='/media/', signer=None):
+        self.prefix = f"https://{domain}/" if domain else media_url
+        self.signer = signer
+
+    def resolve(self, path):
+        if not path:
+            return None
+
+        path = str(path)
+        # If it's already a complete URL, return it
+        if path.startswith(('http://', 'https://')):
+            return path
+
+        # Clean up the path to avoid double slashes
+        url = self.prefix + path.lstrip('/')
+        if self.signer is not None:
+            url = f"{url}?{self.signer.query_string()}"
+        return url
+
+    def resolve_rows(self, rows, fields=AUDIO_URL_FIELDS):
+        """
+        Replaces the storage paths in a list of serialized rows, in place.
+        """
+        resolve = self.resolve
+        for row in rows:
+            for field in fields:
+                if row.get(field):
+                    row[field] = resolve(row[field])
+        return rows
+
+
+@lru_cache(maxsize=None)
+def get_url_resolver():
+    """
+    Returns the process-wide resolver built from settings.
+    With AWS_CLOUDFRONT_DOMAIN and a key pair, URLs point at CloudFront and
+    are signed. S3 does not check CloudFront signatures, so otherwise they
+    point at AWS_S3_CUSTOM_DOMAIN unsigned, or fall back to MEDIA_URL.
+    """
+    domain = getattr(settings, 'AWS_S3_CUSTOM_DOMAIN', None)
+
+    signer = None
+    cloudfront_domain = getattr(settings, 'AWS_CLOUDFRONT_DOMAIN', None)
+    key_pair_id = getattr(settings, 'AWS_CLOUDFRONT_KEY_ID', None)
+    private_key = getattr(settings, 'AWS_CLOUDFRONT_PRIVATE_KEY', None)
+    if cloudfront_domain and key_pair_id and private_key:
+        domain = cloudfront_domain
+        signer = CloudFrontPolicySigner(
+            key_pair_id,
+            private_key,
+            domain,
+            getattr(settings, 'AWS_SIGNED_URL_EXPIRE', 3600),
+        )
+
+    return S3URLResolver(domain, getattr(settings, 'MEDIA_URL', '/media/'), signer)
+
+
+@receiver(setting_changed)
+def _reset_url_resolver(setting, **kwargs):
+    if setting.startswith('AWS_') or setting == 'MEDIA_URL':
+        get_url_resolver.cache_clear()
+
 
 def get_s3_audio_url(path):
     """
     Constructs a full S3 URL for a given file path using Django settings.
     If AWS_S3_CUSTOM_DOMAIN is not defined, falls back to MEDIA_URL.
     """
-    if not path:
-        return None
-    
-    # If it's already a complete URL, return it
-    if str(path).startswith('http://') or str(path).startswith('https://'):
-        return path
-
-    aws_domain = getattr(settings, 'AWS_S3_CUSTOM_DOMAIN', None)
-    
-    # Clean up the path to avoid double slashes
-    clean_path = str(path).lstrip('/')
-
-    if aws_domain:
-        # Standardizing construction: https://{domain}/{path}
-        return f"https://{aws_domain}/{clean_path}"
-    
-    # Fallback for local development or if S3 is not configured
-    media_url = getattr(settings, 'MEDIA_URL', '/media/')
-    return f"{media_url}{clean_path}"
+    return get_url_resolver().resolve(path)
+
+
+def resolve_audio_urls(rows):
+    """
+    Resolves the audio fields of a whole serialized result list at once.
+    """
+    return get_url_resolver().resolve_rows(rows)
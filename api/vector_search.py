@@ -0,0 +1,304 @@
+# api/vector_search.py
+"""
+Nearest-neighbour search over vocabulary embeddings.
+
+Two engines are available, selected with ``VOCAB_SEARCH_ENGINE``:
+
+* ``pgvector`` (default) asks Postgres, which answers from the HNSW index.
+* ``numpy`` keeps every embedding in a memory-mapped float32 matrix on local
+  disk. All worker processes on a host share the same pages through the OS
+  page cache, and queries never leave the process.
+"""
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from pgvector.django import L2Distance
+
+logger = logging.getLogger(__name__)
+
+# Rows of the matrix scored per block, bounds the temporary distance matrix
+SEARCH_BLOCK_ROWS = 131072
+
+BUILD_CHUNK_ROWS = 10000
+
+# Pending vocab ids waiting to be folded into the matrix
+DIRTY_SET_KEY = 'vocab_index:dirty'
+
+
+def _set_search_params(cursor, ef_search=None, probes=None):
+    """
+    Applies the ANN recall knobs to the current transaction only.
+    """
+    ef_search = ef_search or getattr(settings, 'VOCAB_HNSW_EF_SEARCH', 40)
+    probes = probes or getattr(settings, 'VOCAB_IVFFLAT_PROBES', 10)
+    cursor.execute("SET LOCAL hnsw.ef_search = %s", [int(ef_search)])
+    cursor.execute("SET LOCAL ivfflat.probes = %s", [int(probes)])
+
+
+def _pgvector_nearest_ids(embedding, k=5, ef_search=None, probes=None):
+    """
+    The ORDER BY ... LIMIT shape lets Postgres answer from the HNSW index.
+    """
+    from .models import Vocabulary
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            _set_search_params(cursor, ef_search, probes)
+        return list(
+            Vocabulary.objects
+            .order_by(L2Distance('embedding', embedding))
+            .values_list('id', flat=True)[:k]
+        )
+
+
+def nearest_vocab_ids(embedding, k=5, ef_search=None, probes=None):
+    """
+    Returns the ids of the k vocabs closest to an embedding, closest first.
+    """
+    if getattr(settings, 'VOCAB_SEARCH_ENGINE', 'pgvector') == 'numpy':
+        index = get_vocab_index()
+        if index is not None:
+            return index.search(np.asarray([embedding], dtype=np.float32), k)[0]
+        logger.warning("Vocab index files missing, falling back to pgvector")
+
+    return _pgvector_nearest_ids(embedding, k, ef_search, probes)
+
+
+def _pgvector_nearest_ids_for_users(user_ids, k=5, ef_search=None, probes=None):
+    """
+    One round trip for every user: a LATERAL join runs the indexed
+    ORDER BY ... LIMIT k search once per user row.
+    """
+    from .models import User, Vocabulary
+
+    results = {user_id: [] for user_id in user_ids}
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            _set_search_params(cursor, ef_search, probes)
+            cursor.execute(
+                f"""
+                SELECT u.id, v.id
+                FROM {User._meta.db_table} u
+                CROSS JOIN LATERAL (
+                    SELECT vocab.id, vocab.embedding <-> u.embedding AS distance
+                    FROM {Vocabulary._meta.db_table} vocab
+                    ORDER BY vocab.embedding <-> u.embedding
+                    LIMIT %s
+                ) v
+                WHERE u.id = ANY(%s) AND u.embedding IS NOT NULL
+                ORDER BY u.id, v.distance
+                """,
+                [k, list(user_ids)],
+            )
+            for user_id, vocab_id in cursor.fetchall():
+                results[user_id].append(vocab_id)
+    return results
+
+
+def nearest_vocab_ids_for_users(user_ids, k=5, ef_search=None, probes=None):
+    """
+    Returns {user_id: [vocab ids, closest first]} for many users at once.
+    Users without an embedding get an empty list.
+    """
+    from .models import User
+
+    if getattr(settings, 'VOCAB_SEARCH_ENGINE', 'pgvector') == 'numpy':
+        index = get_vocab_index()
+        if index is not None:
+            results = {user_id: [] for user_id in user_ids}
+            rows = list(
+                User.objects.filter(id__in=user_ids)
+                .exclude(embedding=None)
+                .values_list('id', 'embedding')
+            )
+            if rows:
+                queries = np.vstack([np.asarray(embedding, dtype=np.float32) for _, embedding in rows])
+                for (user_id, _), vocab_ids in zip(rows, index.search(queries, k)):
+                    results[user_id] = vocab_ids
+            return results
+        logger.warning("Vocab index files missing, falling back to pgvector")
+
+    return _pgvector_nearest_ids_for_users(user_ids, k, ef_search, probes)
+
+
+def nearest_vocab(embedding, k=5, ef_search=None, probes=None):
+    """
+    Returns the k vocabs closest to an embedding, closest first.
+    """
+    from .models import Vocabulary
+
+    ids = nearest_vocab_ids(embedding, k, ef_search, probes)
+    vocab_by_id = Vocabulary.objects.in_bulk(ids)
+    return [vocab_by_id[vocab_id] for vocab_id in ids if vocab_id in vocab_by_id]
+
+
+# ===================================================================================
+# NumPy engine
+# ===================================================================================
+
+def _index_dir():
+    return str(getattr(settings, 'VOCAB_INDEX_DIR', os.path.join(settings.BASE_DIR, 'vocab_index')))
+
+
+def _index_paths(directory):
+    return (
+        os.path.join(directory, 'ids.npy'),
+        os.path.join(directory, 'embeddings.npy'),
+        os.path.join(directory, 'norms.npy'),
+    )
+
+
+class VocabIndex:
+    """
+    Memory-mapped embedding matrix with precomputed squared norms.
+
+    For a query q, ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2, and the last term
+    does not change the ranking, so a batch of queries is scored with a single
+    matrix product per block of rows.
+    """
+
+    def __init__(self, directory):
+        ids_path, embeddings_path, norms_path = _index_paths(directory)
+        self.mtime = os.stat(ids_path).st_mtime_ns
+        self.ids = np.load(ids_path, mmap_mode='r')
+        self.embeddings = np.load(embeddings_path, mmap_mode='r')
+        self.norms = np.load(norms_path, mmap_mode='r')
+        self.row_by_id = {int(vocab_id): row for row, vocab_id in enumerate(self.ids)}
+
+    def search(self, queries, k=5):
+        """
+        Returns a list of id lists, closest first, one per query row.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        k = min(k, len(self.ids))
+        if k == 0:
+            return [[] for _ in queries]
+
+        best_dist = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+
+        for start in range(0, len(self.ids), SEARCH_BLOCK_ROWS):
+            block = self.embeddings[start:start + SEARCH_BLOCK_ROWS]
+            dist = self.norms[start:start + SEARCH_BLOCK_ROWS][None, :] - 2.0 * (queries @ block.T)
+            rows = np.arange(start, start + len(block))
+
+            # Keep only the running top-k of everything seen so far
+            dist = np.concatenate([best_dist, dist], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(rows, (len(queries), len(rows)))], axis=1)
+            top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            best_dist = np.take_along_axis(dist, top, axis=1)
+            best_rows = np.take_along_axis(rows, top, axis=1)
+
+        order = np.argsort(best_dist, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_dist = np.take_along_axis(best_dist, order, axis=1)
+
+        return [
+            [int(self.ids[row]) for row, distance in zip(rows, dists) if np.isfinite(distance)]
+            for rows, dists in zip(best_rows, best_dist)
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_vocab_index():
+    """
+    Returns this process's VocabIndex, reopening it when the files were rebuilt.
+    Returns None if the index was never built.
+    """
+    global _index
+    ids_path = _index_paths(_index_dir())[0]
+    try:
+        mtime = os.stat(ids_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    if _index is None or _index.mtime != mtime:
+        with _index_lock:
+            if _index is None or _index.mtime != mtime:
+                _index = VocabIndex(_index_dir())
+    return _index
+
+
+def _write_index(directory, ids, embeddings):
+    """
+    Writes the three arrays next to the live ones and swaps them in.
+    ids.npy is replaced last since readers use its mtime as the version.
+    """
+    os.makedirs(directory, exist_ok=True)
+    norms = np.einsum('ij,ij->i', embeddings, embeddings).astype(np.float32)
+    for path, array in zip(reversed(_index_paths(directory)), (norms, embeddings, ids)):
+        tmp_path = f"{path}.tmp.npy"
+        np.save(tmp_path, array)
+        os.replace(tmp_path, path)
+
+
+def build_vocab_index():
+    """
+    Dumps every vocab embedding into a fresh index. Returns the row count.
+    """
+    from .models import Vocabulary
+
+    ids, vectors = [], []
+    rows = Vocabulary.objects.exclude(embedding=None).values_list('id', 'embedding').order_by('id')
+    for vocab_id, embedding in rows.iterator(chunk_size=BUILD_CHUNK_ROWS):
+        ids.append(vocab_id)
+        vectors.append(np.asarray(embedding, dtype=np.float32))
+
+    embeddings = np.vstack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+    _write_index(_index_dir(), np.asarray(ids, dtype=np.int64), embeddings)
+    return len(ids)
+
+
+def refresh_vocab_index(vocab_ids):
+    """
+    Folds changed vocab rows into the index without a full rebuild.
+
+    Rows already in the matrix are overwritten in place, which every process
+    mapping the file sees immediately. Deleted rows get an infinite norm so
+    they never rank. Only new rows force the files to be rewritten, which
+    drops the deleted rows since the norms are recomputed from embeddings.
+    """
+    from .models import Vocabulary
+
+    index = get_vocab_index()
+    if index is None:
+        return build_vocab_index()
+
+    fresh = {
+        vocab_id: np.asarray(embedding, dtype=np.float32)
+        for vocab_id, embedding in Vocabulary.objects.filter(id__in=vocab_ids)
+        .exclude(embedding=None).values_list('id', 'embedding')
+    }
+    ids_path, embeddings_path, norms_path = _index_paths(_index_dir())
+
+    embeddings = np.load(embeddings_path, mmap_mode='r+')
+    norms = np.load(norms_path, mmap_mode='r+')
+    for vocab_id in vocab_ids:
+        row = index.row_by_id.get(int(vocab_id))
+        if row is None:
+            continue
+        if vocab_id in fresh:
+            embeddings[row] = fresh[vocab_id]
+            norms[row] = float(fresh[vocab_id] @ fresh[vocab_id])
+        else:
+            norms[row] = np.inf
+    embeddings.flush()
+    norms.flush()
+
+    new_ids = [vocab_id for vocab_id in fresh if int(vocab_id) not in index.row_by_id]
+    if new_ids:
+        live = np.isfinite(norms)
+        kept = [np.asarray(embeddings[live])] if live.any() else []
+        _write_index(
+            _index_dir(),
+            np.concatenate([np.asarray(index.ids)[live], np.asarray(new_ids, dtype=np.int64)]),
+            np.vstack(kept + [fresh[vocab_id] for vocab_id in new_ids]),
+        )
+    return len(vocab_ids)
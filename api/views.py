@@ -7,15 +7,15 @@ from django.http import StreamingHttpResponse
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.db import transaction
 from django.utils.text import slugify
 from django.utils.crypto import get_random_string
 import uuid
+import time
 from .serializers import UserSerializer, ProjectSerializer
 
 from adrf.decorators import api_view as async_api_view
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from rest_framework.exceptions import NotFound
@@ -23,20 +23,37 @@ from .forms import CustomUserCreationForm
 
 from celery.result import AsyncResult
 
-from langchain_ollama import ChatOllama
-import textwrap
-
 import json
 import openai
 from openai import OpenAI
-import requests
 import os
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from django.utils import timezone
 from pgvector.django import L2Distance
 
-from cognee.infrastructure.databases.graph import get_graph_engine
+from .graph import (
+    GRAPH_PAGE_DEFAULT_LIMIT,
+    GRAPH_PAGE_MAX_LIMIT,
+    GraphCacheMiss,
+    add_project_data,
+    ainvalidate_project_graph,
+    decode_cursor,
+    encode_cursor,
+    load_project_graph,
+    stream_project_graph,
+)
+from .graph_clusters import expand_cluster, summarize_graph
+from .embeddings import record_learning_events
+from .tiers import tier_registry
+from .paypal import PayPalError, get_paypal_client
+from .payments import capture_payment
+from .webhooks import WebhookVerificationError, store_event, verify_signature
+from .ws_tickets import WS_TICKET_MAX_AGE, issue_ticket
+from . import metering, semantic_cache
+from .chat import stream_answer, stream_reply
+from .llm import generation_metrics, reset_generation_metrics
+from .tasks import cognify_project
 
 
 # Load environment variables from .env file
@@ -47,12 +64,6 @@ openai.api_key = os.getenv('OPENAI_API_KEY')
 client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
 
-# PayPal setup
-PAYPAL_CLIENT_ID = os.getenv('PAYPAL_CLIENT_ID')
-PAYPAL_CLIENT_SECRET = os.getenv('PAYPAL_CLIENT_SECRET')
-PAYPAL_BASE_URL = os.getenv('PAYPAL_BASE_URL', 'https://api.sandbox.paypal.com')  # Use sandbox for testing
-
-
 @api_view(['GET']) # Use DRF's decorator
 @permission_classes([AllowAny]) # Make this view public
 @ensure_csrf_cookie
@@ -65,13 +76,14 @@ def get_csrf_token(request):
 
 
 @api_view(['GET'])
-@login_required
+@permission_classes([IsAuthenticated])
 def get_ws_token(request):
     """
-    Returns the session key as a token for WebSocket authentication.
+    Returns a short-lived, single-use ticket for WebSocket authentication.
     """
     return JsonResponse({
-        'token': request.session.session_key
+        'token': issue_ticket(request.user),
+        'expires_in': WS_TICKET_MAX_AGE,
     })
 
 
@@ -118,185 +130,204 @@ def get_project_list(request):
     })
 
 
-@async_api_view(['GET'])
+@async_api_view(['POST'])
 @permission_classes([IsAuthenticated])
-async def get_graph_data(request):
-    project_id = request.GET.get("projectId")
+async def add_project_data_view(request):
+    """
+    Adds text and/or uploaded files to a project, then cognifies it in the
+    background. The project's cached graph is rebuilt once that is done.
+    """
+    project_id = request.data.get("projectId")
+    text = request.data.get("text")
+    files = request.FILES.getlist("files")
 
     if not project_id:
-        return Response({"error": "project_id is required"}, status=400)
+        return Response({"error": "projectId is required"}, status=400)
+    if not text and not files:
+        return Response({"error": "text or files are required"}, status=400)
 
     try:
         project = await Project.objects.aget(project_id=project_id, user=request.user)
-        logging.info(project.project_id)
-        logging.info(project.project_name)
-        logging.info(project.cognee_nodeset_name)
     except Project.DoesNotExist:
         raise NotFound("Project not found or you do not have permission.")
 
-    graph_engine = await get_graph_engine()
-
-    try:
-        # graph_data = await graph_engine.get_nodeset_subgraph(node_name=project.cognee_nodeset_name, node_type=object)
-        graph_data = await graph_engine.get_graph_data()
-        logging.info(f"!!!!!Succeed extracting node_set from {project.cognee_nodeset_name}")
-    except:
-        graph_data = await graph_engine.get_graph_data()
-        logging.info("Sadly graph_data won't come from the sub graph")
+    data = ([text] if text else []) + files
+    await add_project_data(project.cognee_nodeset_name, data)
+    task = cognify_project.delay(str(project.project_id))
 
-    nodes_data, edges_data = graph_data
-
-    return Response({
-        'nodes_data': nodes_data,
-        'edges_data': edges_data
-    })
+    return Response({"task_id": task.id}, status=202)
 
 
-
-@async_api_view(['GET'])
+@api_view(['POST'])
 @permission_classes([IsAuthenticated])
-async def chat_response(request):
+def record_learning_events_view(request):
     """
-    Returns LLM response to chat as a streaming HTTP response.
+    Queues learning events, e.g. {"events": [{"vocab_id": 1, "kind": "known"}]}.
+    They are folded into the user embedding in the background.
     """
-    
-    # 1. robustly get the message (assuming it's a query param since this is a GET)
-    user_message = request.query_params.get('message', '')
-
-    INSTRUCTIONS = textwrap.dedent("""
-        PROMPT="You are a very strong reasoner and planner. Use these critical instructions to structure your plans, thoughts, and responses.
-
-        Before taking any action (either tool calls or responses to the user), you must proactively, methodically, and independently plan and reason about:
-
-        1) Logical dependencies and constraints:
+    events = request.data.get("events")
 
-        Analyze the intended action against the following factors. Resolve conflicts in order of importance:
-        1.1) Policy-based rules, mandatory prerequisites, and constraints.
-        1.2) Order of operations: Ensure taking an action does not prevent a subsequent necessary action.
+    if not isinstance(events, list):
+        return Response({"error": "events must be a list"}, status=400)
 
-        1.2.1) The user may request actions in a random order, but you may need to reorder operations to maximize successful completion of the task.
-        1.3) Other prerequisites (information and/or actions needed).
-        1.4) Explicit user constraints or preferences.
-
-        2) Risk assessment:
-
-        What are the consequences of taking the action? Will the new state cause any future issues?
-        2.1) For exploratory tasks (like searches), missing optional parameters is a LOW risk.
-        Prefer calling the tool with the available information over asking the user, unless your Rule 1 (Logical Dependencies) reasoning determines that optional information is required for a later step in your plan.
+    try:
+        queued = record_learning_events(request.user.id, events)
+    except (KeyError, TypeError, ValueError) as e:
+        return Response({"error": f"Invalid event: {e}"}, status=400)
 
-        3) Abductive reasoning and hypothesis exploration:
+    return Response({"queued": queued}, status=202)
 
-        At each step, identify the most logical and likely reason for any problem encountered.
-        3.1) Look beyond immediate or obvious causes. The most likely reason may not be the simplest and may require deeper inference.
-        3.2) Hypotheses may require additional research. Each hypothesis may take multiple steps to test.
-        3.3) Prioritize hypotheses based on likelihood, but do not discard less likely ones prematurely. A low-probability event may still be the root cause.
 
-        4) Outcome evaluation and adaptability:
+@async_api_view(['GET'])
+@permission_classes([IsAuthenticated])
+async def get_graph_data(request):
+    project_id = request.GET.get("projectId")
 
-        Does the previous observation require any changes to your plan?
-        4.1) If your initial hypotheses are disproven, actively generate new ones based on gathered information.
+    if not project_id:
+        return Response({"error": "project_id is required"}, status=400)
 
-        5) Information availability:
+    try:
+        project = await Project.objects.aget(project_id=project_id, user=request.user)
+    except Project.DoesNotExist:
+        raise NotFound("Project not found or you do not have permission.")
 
-        Incorporate all applicable and alternative sources of information, including:
-        5.1) Using available tools and their capabilities
-        5.2) All policies, rules, checklists, and constraints
-        5.3) Previous observations and conversation history
-        5.4) Information only available by asking the user
+    start = time.perf_counter()
 
-        6) Precision and Grounding:
+    try:
+        graph = await load_project_graph(project.cognee_nodeset_name)
+    except Exception:
+        # Never fall back to the full graph, it holds every other project's data too
+        logging.exception(f"Failed extracting node_set {project.cognee_nodeset_name}")
+        return Response({"error": "Failed to load project graph"}, status=502)
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    cache_state = "warm" if graph.cache_hit else "cold"
+    logging.info(
+        f"Graph for {project.cognee_nodeset_name} loaded {cache_state} in {elapsed_ms:.1f}ms "
+        f"({graph.node_count} nodes, {graph.edge_count} edges)"
+    )
+    server_timing = f'graph;desc="{cache_state}";dur={elapsed_ms:.1f}'
 
-        Ensure your reasoning is extremely precise and relevant to each exact ongoing situation.
-        6.1) Verify your claims by quoting the exact applicable information (including policies) when referring to them.
+    # 1. NDJSON stream, one line per node/edge so the frontend can render progressively
+    if request.GET.get("stream"):
+        response = StreamingHttpResponse(
+            stream_project_graph(graph),
+            content_type='application/x-ndjson',
+        )
+        response['Server-Timing'] = server_timing
+        return response
 
-        7) Completeness:
+    try:
+        # 2. Level-of-detail view, either a node budget or one expanded cluster
+        if "expand" in request.GET:
+            nodes_data, edges_data, level = await expand_cluster(graph, request.GET["expand"])
+            response = Response({
+                'nodes_data': nodes_data,
+                'edges_data': edges_data,
+                'level': level,
+            })
+        elif "max_nodes" in request.GET:
+            try:
+                max_nodes = max(1, int(request.GET["max_nodes"]))
+            except ValueError:
+                return Response({"error": "max_nodes must be an integer"}, status=400)
+
+            nodes_data, edges_data, level = await summarize_graph(graph, max_nodes)
+            response = Response({
+                'nodes_data': nodes_data,
+                'edges_data': edges_data,
+                'level': level,
+            })
+        # 3. Cursor pagination over the nodes followed by the edges
+        elif "cursor" in request.GET or "limit" in request.GET:
+            cursor = request.GET.get("cursor")
+            offset = decode_cursor(graph, cursor) if cursor else 0
+            try:
+                limit = int(request.GET.get("limit", GRAPH_PAGE_DEFAULT_LIMIT))
+            except ValueError:
+                return Response({"error": "limit must be an integer"}, status=400)
+            limit = max(1, min(limit, GRAPH_PAGE_MAX_LIMIT))
+
+            nodes_data, edges_data = await graph.page(offset, limit)
+            next_offset = offset + limit
+
+            response = Response({
+                'nodes_data': nodes_data,
+                'edges_data': edges_data,
+                'node_count': graph.node_count,
+                'edge_count': graph.edge_count,
+                'next_cursor': encode_cursor(graph, next_offset) if next_offset < graph.total else None,
+            })
+        # 4. Whole graph in one document
+        else:
+            nodes_data, edges_data = await graph.all()
+            response = Response({
+                'nodes_data': nodes_data,
+                'edges_data': edges_data
+            })
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    except GraphCacheMiss:
+        await ainvalidate_project_graph(project.cognee_nodeset_name)
+        return Response({"error": "Graph cache expired, please retry"}, status=409)
 
-        Ensure that all requirements, constraints, options, and preferences are exhaustively incorporated into your plan.
-        7.1) Resolve conflicts using the order of importance in #1.
-        7.2) Avoid premature conclusions: There may be multiple relevant options for a given situation.
+    response['Server-Timing'] = server_timing
+    return response
 
-        7.2.1) To check whether an option is relevant, reason about all information sources from #5.
-        7.2.2) You may need to consult the user to even know whether something is applicable. Do not assume it is not applicable without checking.
-        7.3) Review applicable sources of information from #5 to confirm which are relevant to the current state.
 
-        8) Persistence and patience:
 
-        Do not give up unless all the reasoning above is exhausted.
-        8.1) Don't be dissuaded by time taken or user frustration.
-        8.2) This persistence must be intelligent:
-        - On transient errors (e.g. please try again), you must retry unless an explicit retry limit (e.g. max x tries) has been reached. If such a limit is hit, you must stop.
-        - On other errors, you must change your strategy or arguments, not repeat the same failed call.
+@async_api_view(['GET'])
+@permission_classes([IsAuthenticated])
+async def chat_response(request):
+    """
+    Returns LLM response to chat as a streaming HTTP response.
+    """
+    
+    # 1. robustly get the message (assuming it's a query param since this is a GET)
+    user_message = request.query_params.get('message', '')
 
-        9) Inhibit your response:
+    # The model and its connections are reused across requests (see api.llm)
+    project_id = request.query_params.get('projectId')
+    if not project_id:
+        return StreamingHttpResponse(stream_answer(user_message), content_type='text/plain')
 
-        Only take an action after all the above reasoning is completed. Once you’ve taken an action, you cannot take it back."
-    """)
+    try:
+        project = await Project.objects.aget(project_id=project_id, user=request.user)
+    except Project.DoesNotExist:
+        raise NotFound("Project not found or you do not have permission.")
 
-    llm = ChatOllama(
-        model="gemma3:4b",
-        temperature=0,
-    )
+    # Earlier turns of the project are remembered, see api.chat
+    return StreamingHttpResponse(stream_reply(project, user_message), content_type='text/plain')
 
-    messages = [
-        (
-            "system",
-            INSTRUCTIONS,
-        ),
-        ("human", user_message),
-    ]
-
-    # 2. Create a generator function to yield strings from the AIMessageChunks
-    async def event_stream():
-        # This calls the .stream() method signature you requested
-        stream_iterator = llm.astream(
-            input=messages, 
-            # config=None, stop=None, **kwargs can be added here if needed
-        )
-        
-        async for chunk in stream_iterator:
-            # We must yield the string content, not the object
-            if chunk.content:
-                yield chunk.content
 
-    # 3. Return a StreamingHttpResponse
-    return StreamingHttpResponse(event_stream(), content_type='text/plain')
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def llm_metrics(request):
+    """
+    Average prompt evaluation time, tokens and time to first token per model,
+    and the semantic cache's hit rate and time saved.
+    DELETE resets the counters.
+    """
+    if request.method == 'DELETE':
+        reset_generation_metrics()
+        semantic_cache.reset_stats()
+        return Response(status=204)
+    return Response({
+        'models': generation_metrics(),
+        'semantic_cache': semantic_cache.stats(),
+    })
 
 # ===================================================================================
 # Payment related start
 # ===================================================================================
 
-def get_paypal_access_token():
-    """Get access token from PayPal"""
-    url = f"{PAYPAL_BASE_URL}/v1/oauth2/token"
-    
-    headers = {
-        'Accept': 'application/json',
-        'Accept-Language': 'en_US',
-    }
-    
-    data = 'grant_type=client_credentials'
-    
-    response = requests.post(
-        url,
-        headers=headers,
-        data=data,
-        auth=(PAYPAL_CLIENT_ID, PAYPAL_CLIENT_SECRET)
-    )
-    
-    if response.status_code == 200:
-        return response.json()['access_token']
-    else:
-        raise Exception(f"Failed to get PayPal access token: {response.text}")
-
-
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_subscription_tiers(request):
     """Get all available subscription tiers"""
-    tiers = SubscriptionTier.objects.all()
     tier_data = []
     
-    for tier in tiers:
+    for tier in tier_registry.all():
         tier_data.append({
             'id': tier.id,
             'name': tier.name,
@@ -304,24 +335,28 @@ def get_subscription_tiers(request):
             'price': float(tier.price),
             'monthly_translation_limit': tier.monthly_translation_limit,
             'daily_translation_limit': tier.daily_translation_limit,
+            'requests_per_minute': tier.requests_per_minute,
             'features': tier.features
         })
     
+    current_tier = request.user.get_current_tier()
+    daily_used, monthly_used = metering.usage(request.user)
+
     return Response({
         'tiers': tier_data,
-        'current_tier': request.user.get_current_tier().name,
+        'current_tier': current_tier.name,
         'usage': {
-            'monthly_used': request.user.monthly_translations_used,
-            'daily_used': request.user.daily_translations_used,
-            'monthly_limit': request.user.get_current_tier().monthly_translation_limit,
-            'daily_limit': request.user.get_current_tier().daily_translation_limit
+            'monthly_used': monthly_used,
+            'daily_used': daily_used,
+            'monthly_limit': current_tier.monthly_translation_limit,
+            'daily_limit': current_tier.daily_translation_limit
         }
     })
 
 
-@api_view(['POST'])
+@async_api_view(['POST'])
 @permission_classes([IsAuthenticated])
-def create_paypal_order(request):
+async def create_paypal_order(request):
     """Create a PayPal order for subscription payment"""
     try:
         tier_id = request.data.get('tier_id')
@@ -330,7 +365,7 @@ def create_paypal_order(request):
             return Response({'error': 'Tier ID is required'}, status=400)
         
         try:
-            tier = SubscriptionTier.objects.get(id=tier_id)
+            tier = await SubscriptionTier.objects.aget(id=tier_id)
         except SubscriptionTier.DoesNotExist:
             return Response({'error': 'Invalid tier ID'}, status=400)
         
@@ -338,9 +373,6 @@ def create_paypal_order(request):
         if tier.name == 'free':
             return Response({'error': 'Cannot purchase free tier'}, status=400)
         
-        # Get PayPal access token
-        access_token = get_paypal_access_token()
-        
         # Create PayPal order
         order_data = {
             "intent": "CAPTURE",
@@ -357,122 +389,94 @@ def create_paypal_order(request):
             }
         }
         
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {access_token}',
-        }
-        
-        response = requests.post(
-            f"{PAYPAL_BASE_URL}/v2/checkout/orders",
-            headers=headers,
-            json=order_data
+        try:
+            order = await get_paypal_client().create_order(order_data)
+        except PayPalError as e:
+            logging.error(f"PayPal order creation failed: {e}")
+            return Response({'error': 'Failed to create PayPal order'}, status=500)
+            
+        # Store payment transaction
+        await PaymentTransaction.objects.acreate(
+            user=request.user,
+            subscription_tier=tier,
+            paypal_order_id=order['id'],
+            amount=tier.price,
+            currency='USD',
+            status='pending'
         )
         
-        if response.status_code == 201:
-            order = response.json()
-            
-            # Store payment transaction
-            transaction = PaymentTransaction.objects.create(
-                user=request.user,
-                subscription_tier=tier,
-                paypal_order_id=order['id'],
-                amount=tier.price,
-                currency='USD',
-                status='pending'
-            )
-            
-            # Get approval URL
-            approval_url = None
-            for link in order['links']:
-                if link['rel'] == 'approve':
-                    approval_url = link['href']
-                    break
-            
-            return Response({
-                'order_id': order['id'],
-                'approval_url': approval_url
-            })
-        else:
-            logging.error(f"PayPal order creation failed: {response.text}")
-            return Response({'error': 'Failed to create PayPal order'}, status=500)
+        # Get approval URL
+        approval_url = None
+        for link in order['links']:
+            if link['rel'] == 'approve':
+                approval_url = link['href']
+                break
+        
+        return Response({
+            'order_id': order['id'],
+            'approval_url': approval_url
+        })
             
     except Exception as e:
         logging.error(f"Error creating PayPal order: {str(e)}")
         return Response({'error': 'Internal server error'}, status=500)
 
 
-@api_view(['POST'])
+@async_api_view(['POST'])
 @permission_classes([IsAuthenticated])
-def capture_paypal_payment(request):
-    """Capture PayPal payment after user approval (with atomic transaction)"""
+async def capture_paypal_payment(request):
+    """Capture PayPal payment after user approval (two-phase, see api.payments)"""
 
     try:
         order_id = request.data.get('order_id')
         
         if not order_id:
             return Response({'error': 'Order ID is required'}, status=400)
-            
-        # Use a transaction to ensure atomicity
-        with transaction.atomic():
-            # Use select_for_update() to lock the row until the transaction is complete
-            transaction_obj = PaymentTransaction.objects.select_for_update().get(
-                paypal_order_id=order_id,
-                user=request.user,
-                status='pending'
-            )
-
-            # Get PayPal access token
-            access_token = get_paypal_access_token()
-            
-            # ... (rest of the PayPal API call logic is the same) ...
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {access_token}',
-            }
-            
-            response = requests.post(
-                f"{PAYPAL_BASE_URL}/v2/checkout/orders/{order_id}/capture",
-                headers=headers
-            )
-
-            if response.status_code == 201:
-                capture_data = response.json()
-                
-                # Update transaction
-                transaction_obj.status = 'completed'
-                transaction_obj.paypal_capture_id = capture_data['id']
-                transaction_obj.is_verified = True
-                transaction_obj.verification_date = timezone.now()
-                if 'payer' in capture_data and 'payer_id' in capture_data['payer']:
-                    transaction_obj.paypal_payer_id = capture_data['payer']['payer_id']
-                transaction_obj.save()
-                
-                # Update user subscription
-                user = request.user
-                user.subscription_tier = transaction_obj.subscription_tier
-                user.subscription_start_date = timezone.now()
-                user.subscription_end_date = timezone.now() + timedelta(days=30)
-                user.is_subscription_active = True
-                # Reset usage counters upon new subscription
-                user.daily_translations_used = 0
-                user.monthly_translations_used = 0
-                user.save()
-                
-                return Response({ 'success': True, 'message': 'Payment successful!' }) # Simplified response
-            else:
-                # The 'with' block will automatically roll back the transaction on error
-                logging.error(f"PayPal capture failed: {response.text}")
-                transaction_obj.status = 'failed'
-                transaction_obj.save()
-                return Response({'error': 'Payment capture failed'}, status=500)
+
+        status = await capture_payment(order_id, request.user)
 
     except PaymentTransaction.DoesNotExist:
         return Response({'error': 'Transaction not found or already processed'}, status=404)
     except Exception as e:
         logging.error(f"Error capturing PayPal payment: {str(e)}")
         return Response({'error': 'Internal server error'}, status=500)
+
+    if status == 'completed':
+        return Response({ 'success': True, 'message': 'Payment successful!' }) # Simplified response
+    if status == 'capturing':
+        # PayPal did not answer in time, reconciliation will settle it
+        return Response({'success': False, 'status': 'capturing', 'message': 'Payment is being confirmed.'}, status=202)
+    return Response({'error': 'Payment capture failed'}, status=500)
     
 
+@async_api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+async def paypal_webhook(request):
+    """
+    Receives PayPal webhook deliveries. Events are verified and stored only,
+    api.tasks.process_paypal_webhook_events applies them.
+    """
+    body = request.body
+
+    try:
+        await verify_signature(request.headers, body)
+    except WebhookVerificationError as e:
+        logging.warning(f"Rejected PayPal webhook: {e}")
+        return Response({'error': 'Invalid signature'}, status=400)
+
+    try:
+        event = json.loads(body)
+        event_id = event['id']
+    except (ValueError, KeyError, TypeError):
+        return Response({'error': 'Invalid event'}, status=400)
+
+    await store_event(event)
+    logging.info(f"Stored PayPal webhook {event.get('event_type')} {event_id}")
+
+    return Response({'received': True})
+
+
 # Add these views to your views.py for handling PayPal redirects
 def payment_success_view(request):
     """Handle successful payment redirect from PayPal"""
@@ -510,17 +514,7 @@ def register(request):
         user.is_active = True
 
         # Set user to free tier by default
-        free_tier, created = SubscriptionTier.objects.get_or_create(
-            name='free',
-            defaults={
-                'display_name': 'Free',
-                'price': 0,
-                'monthly_translation_limit': 50,
-                'daily_translation_limit': 5,
-                'features': ['Vocab usage', 'Quote usage']
-            }
-        )
-        user.subscription_tier = free_tier
+        user.subscription_tier = tier_registry.free()
         user.save()
 
         return Response({'message': 'Account created successfully!'}, status=201)
@@ -546,17 +540,19 @@ def user_profile_view(request):
     serializer = UserSerializer(user)
     
     profile_data = serializer.data
+    current_tier = user.get_current_tier()
+    daily_used, monthly_used = metering.usage(user)
     profile_data['subscription'] = {
-        'tier': user.get_current_tier().name,
-        'tier_display_name': user.get_current_tier().display_name,
-        'is_active': user.is_subscription_active,
+        'tier': current_tier.name,
+        'tier_display_name': current_tier.display_name,
+        'is_active': user.has_active_subscription(),
         'start_date': user.subscription_start_date,
         'end_date': user.subscription_end_date,
         'usage': {
-            'daily_used': user.daily_translations_used,
-            'monthly_used': user.monthly_translations_used,
-            'daily_limit': user.get_current_tier().daily_translation_limit,
-            'monthly_limit': user.get_current_tier().monthly_translation_limit
+            'daily_used': daily_used,
+            'monthly_used': monthly_used,
+            'daily_limit': current_tier.daily_translation_limit,
+            'monthly_limit': current_tier.monthly_translation_limit
         }
     }
     
@@ -0,0 +1,282 @@
+# api/webhooks.py
+"""
+PayPal webhook ingestion.
+
+The endpoint only verifies the signature and appends the raw event to
+PayPalWebhookEvent, then answers 200. A Celery task applies stored events to
+PaymentTransaction and User in batches, so a burst of deliveries costs one
+insert per event on the request path and a few bulk statements per batch.
+
+Signatures are checked offline against PayPal's signing certificate, which is
+kept in the Django cache and in memory, instead of calling the
+verify-webhook-signature API for every delivery.
+"""
+import base64
+import hashlib
+import logging
+import zlib
+from urllib.parse import urlparse
+
+import httpx
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metering
+from .authentication import invalidate_cached_users
+from .models import PaymentTransaction, PayPalWebhookEvent, User
+from .payments import USER_SUBSCRIPTION_FIELDS, mark_completed
+
+logger = logging.getLogger(__name__)
+
+CERT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Parsed certificates by URL, PayPal rotates them rarely
+_certs = {}
+
+CAPTURE_COMPLETED = 'PAYMENT.CAPTURE.COMPLETED'
+CAPTURE_FAILED = {'PAYMENT.CAPTURE.DENIED', 'PAYMENT.CAPTURE.DECLINED'}
+CAPTURE_REVERSED = {'PAYMENT.CAPTURE.REFUNDED', 'PAYMENT.CAPTURE.REVERSED'}
+
+
+class WebhookVerificationError(Exception):
+    pass
+
+
+def _is_paypal_cert_url(url):
+    parsed = urlparse(url)
+    host = parsed.hostname or ''
+    return parsed.scheme == 'https' and (host == 'paypal.com' or host.endswith('.paypal.com'))
+
+
+async def get_signing_cert(url):
+    """
+    Returns the certificate at url, from memory, the Django cache or PayPal.
+    """
+    from cryptography import x509
+
+    cert = _certs.get(url)
+    if cert is None:
+        if not _is_paypal_cert_url(url):
+            raise WebhookVerificationError(f"Untrusted certificate URL: {url}")
+
+        cache_key = f"paypal:webhook_cert:{hashlib.sha256(url.encode()).hexdigest()}"
+        pem = await cache.aget(cache_key)
+        if pem is None:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                response = await client.get(url)
+            if response.status_code != 200:
+                raise WebhookVerificationError(f"Could not fetch certificate: {response.status_code}")
+            pem = response.text
+            await cache.aset(cache_key, pem, timeout=CERT_CACHE_TIMEOUT)
+
+        cert = x509.load_pem_x509_certificate(pem.encode())
+        _certs[url] = cert
+
+    if cert.not_valid_after_utc < timezone.now():
+        _certs.pop(url, None)
+        raise WebhookVerificationError("Signing certificate has expired")
+    return cert
+
+
+def signed_message(transmission_id, transmission_time, webhook_id, body):
+    return f"{transmission_id}|{transmission_time}|{webhook_id}|{zlib.crc32(body)}".encode()
+
+
+async def verify_signature(headers, body):
+    """
+    Raises WebhookVerificationError unless the delivery was signed by PayPal
+    for our webhook.
+    """
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    webhook_id = getattr(settings, 'PAYPAL_WEBHOOK_ID', None)
+    if not webhook_id:
+        raise WebhookVerificationError("PAYPAL_WEBHOOK_ID is not configured")
+
+    try:
+        transmission_id = headers['Paypal-Transmission-Id']
+        transmission_time = headers['Paypal-Transmission-Time']
+        signature = base64.b64decode(headers['Paypal-Transmission-Sig'])
+        cert_url = headers['Paypal-Cert-Url']
+    except (KeyError, ValueError) as e:
+        raise WebhookVerificationError(f"Missing or malformed signature header: {e}")
+
+    if headers.get('Paypal-Auth-Algo', 'SHA256withRSA') != 'SHA256withRSA':
+        raise WebhookVerificationError(f"Unsupported algorithm {headers.get('Paypal-Auth-Algo')}")
+
+    cert = await get_signing_cert(cert_url)
+    try:
+        cert.public_key().verify(
+            signature,
+            signed_message(transmission_id, transmission_time, webhook_id, body),
+            padding.PKCS1v15(),
+            hashes.SHA256(),
+        )
+    except InvalidSignature:
+        raise WebhookVerificationError("Invalid signature")
+
+
+async def store_event(event):
+    """
+    Appends a verified event. Redeliveries of the same event are ignored.
+    """
+    await PayPalWebhookEvent.objects.abulk_create([
+        PayPalWebhookEvent(
+            event_id=event['id'],
+            event_type=event.get('event_type', ''),
+            payload=event,
+        )
+    ], ignore_conflicts=True)
+
+
+def _related_ids(event):
+    """
+    Returns (order id, capture id) of a capture or refund event.
+    """
+    resource = event.get('resource') or {}
+    order_id = ((resource.get('supplementary_data') or {}).get('related_ids') or {}).get('order_id')
+
+    capture_id = None
+    if event['event_type'].startswith('PAYMENT.CAPTURE.'):
+        capture_id = resource.get('id')
+        # Refunds point back to the capture they refund
+        for link in resource.get('links') or []:
+            if link.get('rel') == 'up' and '/captures/' in link.get('href', ''):
+                capture_id = link['href'].rstrip('/').rsplit('/', 1)[1]
+    return order_id, capture_id
+
+
+def _apply(event, payment, now):
+    """
+    Applies one event to a loaded payment and its user.
+    Returns (payment changed, user changed).
+    """
+    event_type = event['event_type']
+
+    if event_type == CAPTURE_COMPLETED:
+        if payment.status not in ('pending', 'capturing'):
+            return False, False
+        payer_id = event['resource'].get('payer', {}).get('payer_id')
+        mark_completed(payment, event['resource']['id'], payer_id, now)
+        return True, True
+
+    if event_type in CAPTURE_FAILED:
+        if payment.status not in ('pending', 'capturing'):
+            return False, False
+        payment.status = 'failed'
+        return True, False
+
+    if event_type in CAPTURE_REVERSED:
+        if payment.status != 'completed':
+            return False, False
+        payment.status = 'refunded'
+        user = payment.user
+        if user.subscription_tier_id == payment.subscription_tier_id:
+            user.is_subscription_active = False
+            return True, True
+        return True, False
+
+    return False, False
+
+
+def _reject(event, error):
+    """
+    Records why an event could not be applied. Returns the event.
+    """
+    logger.error(f"PayPal event {event.event_id} could not be applied: {error!r}")
+    event.error = repr(error)
+    return event
+
+
+def process_webhook_events(batch_size=500):
+    """
+    Applies one batch of unprocessed events in order, with one query for the
+    events, one for their payments and bulk updates for the rest.
+    Workers running in parallel take disjoint batches. An event whose payload
+    cannot be applied is marked processed with its error instead of failing
+    the batch. Returns the number of events processed.
+    """
+    with transaction.atomic():
+        events = list(
+            PayPalWebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by('received_at', 'id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        related = {}
+        failed = []
+        for event in events:
+            try:
+                related[event.pk] = _related_ids(event.payload)
+            except Exception as e:
+                failed.append(_reject(event, e))
+        order_ids = {order_id for order_id, _ in related.values() if order_id}
+        capture_ids = {capture_id for _, capture_id in related.values() if capture_id}
+
+        payments = list(
+            PaymentTransaction.objects.select_for_update()
+            .select_related('user', 'subscription_tier')
+            .filter(Q(paypal_order_id__in=order_ids) | Q(paypal_capture_id__in=capture_ids))
+        )
+        by_order = {payment.paypal_order_id: payment for payment in payments}
+        by_capture = {payment.paypal_capture_id: payment for payment in payments if payment.paypal_capture_id}
+        # The same user may appear through several payments, keep one instance
+        users = {}
+        for payment in payments:
+            payment.user = users.setdefault(payment.user_id, payment.user)
+
+        now = timezone.now()
+        changed_payments = {}
+        changed_users = {}
+        activated = set()
+        for event in events:
+            if event.pk not in related:
+                continue
+            order_id, capture_id = related[event.pk]
+            payment = by_order.get(order_id) or by_capture.get(capture_id)
+            if payment is None:
+                if order_id or capture_id:
+                    logger.warning(f"PayPal event {event.event_id} matches no payment (order {order_id})")
+                continue
+
+            # _apply reads everything it needs before it changes the payment
+            try:
+                payment_changed, user_changed = _apply(event.payload, payment, now)
+            except Exception as e:
+                failed.append(_reject(event, e))
+                continue
+            if payment_changed:
+                payment.updated_at = now
+                changed_payments[payment.pk] = payment
+                by_capture[payment.paypal_capture_id] = payment
+            if user_changed:
+                changed_users[payment.user_id] = payment.user
+                if payment.status == 'completed':
+                    activated.add(payment.user_id)
+
+        PaymentTransaction.objects.bulk_update(changed_payments.values(), [
+            'status',
+            'paypal_capture_id',
+            'paypal_payer_id',
+            'is_verified',
+            'verification_date',
+            'updated_at',
+        ])
+        User.objects.bulk_update(changed_users.values(), USER_SUBSCRIPTION_FIELDS)
+        PayPalWebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=now)
+        PayPalWebhookEvent.objects.bulk_update(failed, ['error'])
+
+        for user_id in activated:
+            transaction.on_commit(lambda user_id=user_id: metering.reset(user_id))
+        if changed_users:
+            # bulk_update sends no post_save
+            transaction.on_commit(lambda: invalidate_cached_users(list(changed_users)))
+
+    return len(events)
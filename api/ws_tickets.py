@@ -0,0 +1,50 @@
+# api/ws_tickets.py
+"""
+Short-lived, single-use tickets for opening a WebSocket.
+
+A ticket is a signed payload holding the user id, the tier name and a random
+id. Connecting checks the signature and age and burns the random id in the
+cache (an atomic add), so validating a ticket never touches the database and
+a ticket cannot be replayed.
+"""
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+WS_TICKET_MAX_AGE = getattr(settings, 'WS_TICKET_MAX_AGE', 30)
+
+_SALT = 'api.ws_tickets'
+
+
+class InvalidTicket(Exception):
+    pass
+
+
+def issue_ticket(user):
+    return signing.dumps({
+        'uid': user.pk,
+        'tier': user.get_current_tier().name,
+        'jti': uuid.uuid4().hex,
+    }, salt=_SALT)
+
+
+def _claims(ticket):
+    try:
+        return signing.loads(ticket, salt=_SALT, max_age=WS_TICKET_MAX_AGE)
+    except signing.SignatureExpired:
+        raise InvalidTicket("Ticket expired")
+    except signing.BadSignature:
+        raise InvalidTicket("Invalid ticket")
+
+
+async def aredeem_ticket(ticket):
+    """
+    Returns the claims of a valid, unused ticket and marks it used.
+    Raises InvalidTicket otherwise.
+    """
+    claims = _claims(ticket)
+    if not await cache.aadd(f"ws_ticket:{claims['jti']}", 1, timeout=WS_TICKET_MAX_AGE):
+        raise InvalidTicket("Ticket already used")
+    return claims
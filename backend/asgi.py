@@ -24,37 +24,17 @@ from api.middleware import WebSocketScopeLogger
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 # This is a critical step. It initializes Django's settings and application registry.
-print("--- ASGI.PY: Initializing Django settings... ---")
 django.setup()
-print("--- ASGI.PY: Django setup complete. ---")
 
 django_asgi_app = get_asgi_application()
 
-# A simple custom middleware to log the connection scope
-class ScopeLoggingMiddleware:
-    def __init__(self, app):
-        self.app = app
-
-    async def __call__(self, scope, receive, send):
-        # We are only interested in WebSocket connections
-        if scope['type'] == 'websocket':
-            print("\n--- ASGI.PY SCOPE LOGGER ---")
-            print(f"  Received WebSocket scope for path: {scope.get('path')}")
-            print(f"  Client Host/Port: {scope.get('client')}")
-            # To see all headers, uncomment the next line, but it can be very verbose.
-            # print(f"  Headers: {scope.get('headers')}")
-            print("--------------------------\n")
-        
-        # Pass the connection to the next layer in the stack
-        return await self.app(scope, receive, send)
-
 application = ProtocolTypeRouter({
     # Django's ASGI application to handle traditional HTTP requests
     "http": django_asgi_app,
 
     # WebSocket handler, now wrapped with our custom logger
     "websocket": OriginValidator(
-        ScopeLoggingMiddleware(
+        WebSocketScopeLogger(
             AuthMiddlewareStack(
                 URLRouter(
                     api.routing.websocket_urlpatterns
@@ -68,5 +48,3 @@ application = ProtocolTypeRouter({
         ],
     )
 })
-
-print("--- ASGI.PY: ProtocolTypeRouter configured. Application is ready. ---")
\ No newline at end of file
@@ -75,6 +75,7 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'api.log.RequestIdMiddleware',
     'django.middleware.security.SecurityMiddleware',
 
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -87,7 +88,8 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
 
-    'api.middleware.DebugUserMiddleware',
+    'api.authentication.JWTAuthenticationMiddleware',
+    'api.ratelimit.RateLimitMiddleware',
 
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -343,6 +345,26 @@ AWS_S3_REGION_NAME = os.environ.get("AWS_S3_REGION_NAME")
 
 AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
 
+# Optional CloudFront signed URLs for audio files (see api.utils.CloudFrontPolicySigner).
+# Signing needs the distribution's domain, S3 itself ignores the signature.
+AWS_CLOUDFRONT_DOMAIN = os.environ.get("AWS_CLOUDFRONT_DOMAIN")
+AWS_CLOUDFRONT_KEY_ID = os.environ.get("AWS_CLOUDFRONT_KEY_ID")
+AWS_CLOUDFRONT_PRIVATE_KEY = os.environ.get("AWS_CLOUDFRONT_PRIVATE_KEY")
+AWS_SIGNED_URL_EXPIRE = int(os.environ.get("AWS_SIGNED_URL_EXPIRE", 3600))
+
+# PayPal (see api.paypal.PayPalClient)
+PAYPAL_CLIENT_ID = os.environ.get("PAYPAL_CLIENT_ID")
+PAYPAL_CLIENT_SECRET = os.environ.get("PAYPAL_CLIENT_SECRET")
+PAYPAL_BASE_URL = os.environ.get("PAYPAL_BASE_URL", "https://api.sandbox.paypal.com")  # Use sandbox for testing
+PAYPAL_TIMEOUT = float(os.environ.get("PAYPAL_TIMEOUT", 10))
+PAYPAL_MAX_RETRIES = int(os.environ.get("PAYPAL_MAX_RETRIES", 3))
+PAYPAL_WEBHOOK_ID = os.environ.get("PAYPAL_WEBHOOK_ID")  # Webhook signatures are verified against it
+# Captures still in flight after this many seconds are settled by api.tasks.reconcile_stuck_captures
+PAYMENT_CAPTURE_RECONCILE_AFTER = int(os.environ.get("PAYMENT_CAPTURE_RECONCILE_AFTER", 120))
+
+# Expired subscriptions are downgraded by api.tasks.expire_subscriptions in batches of this size
+SUBSCRIPTION_SWEEP_BATCH_SIZE = int(os.environ.get("SUBSCRIPTION_SWEEP_BATCH_SIZE", 1000))
+
 STORAGES = {
     # For media files (FileField, ImageField)
     "default": {
@@ -421,7 +443,8 @@ REST_FRAMEWORK = {
         # is what you are using. It correctly handles CSRF for POST/PUT/DELETE
         # requests while allowing safe GET requests.
         # 'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication'
+        # simplejwt's JWTAuthentication, reusing JWTAuthenticationMiddleware's result
+        'api.authentication.CachedJWTAuthentication'
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         # This sets a sensible default: all API endpoints require the
@@ -446,3 +469,161 @@ if CACHE_BACKEND_URL:
     CELERY_RESULT_BACKEND = CACHE_BACKEND_URL
 else:
     CELERY_RESULT_BACKEND = 'redis://127.0.0.1:6379/0'
+
+
+# Vocabulary vector search
+# recommend_vocab uses the HNSW index on api_vocabulary.embedding. Raising
+# ef_search (HNSW) or probes (IVFFlat) trades latency for recall.
+VOCAB_HNSW_EF_SEARCH = int(os.environ.get('VOCAB_HNSW_EF_SEARCH', 40))
+VOCAB_IVFFLAT_PROBES = int(os.environ.get('VOCAB_IVFFLAT_PROBES', 10))
+
+# 'pgvector' queries Postgres, 'numpy' searches a memory-mapped matrix in each
+# worker (build it first with: python manage.py build_vocab_index)
+VOCAB_SEARCH_ENGINE = os.environ.get('VOCAB_SEARCH_ENGINE', 'pgvector')
+VOCAB_INDEX_DIR = os.environ.get('VOCAB_INDEX_DIR', os.path.join(BASE_DIR, 'vocab_index'))
+
+CELERY_BEAT_SCHEDULE = {
+    'refresh-vocab-index': {
+        'task': 'api.tasks.refresh_vocab_index',
+        'schedule': 30.0,
+    },
+    'refresh-recommendations': {
+        'task': 'api.tasks.refresh_recommendations',
+        'schedule': 60.0 * 5,
+    },
+    'apply-embedding-events': {
+        'task': 'api.tasks.apply_embedding_events',
+        'schedule': 10.0,
+    },
+    'flush-translation-usage': {
+        'task': 'api.tasks.flush_translation_usage',
+        'schedule': 60.0,
+    },
+    'reconcile-stuck-captures': {
+        'task': 'api.tasks.reconcile_stuck_captures',
+        'schedule': 60.0,
+    },
+    'process-paypal-webhook-events': {
+        'task': 'api.tasks.process_paypal_webhook_events',
+        'schedule': 5.0,
+    },
+    'expire-subscriptions': {
+        'task': 'api.tasks.expire_subscriptions',
+        'schedule': 60.0 * 5,
+    },
+    'evict-semantic-cache': {
+        'task': 'api.tasks.evict_semantic_cache',
+        'schedule': 60.0 * 60,
+    },
+}
+
+# Stored recommendation lists are rebuilt once the user embedding moved this
+# far (cosine distance) from the one they were computed with
+RECOMMENDATION_TOP_N = 5
+RECOMMENDATION_DRIFT_THRESHOLD = float(os.environ.get('RECOMMENDATION_DRIFT_THRESHOLD', 0.05))
+
+# How far one learning event moves the user embedding towards (or, when
+# negative, away from) the vocab's embedding
+LEARNING_EVENT_WEIGHTS = {
+    'seen': 0.02,
+    'known': 0.05,
+    'failed': -0.02,
+}
+
+# Per-client token buckets sized from SubscriptionTier.requests_per_minute and
+# request_burst. Expensive routes take several tokens per call.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True') == 'True'
+RATE_LIMIT_COSTS = {
+    'chat_response': 5,
+    'get_graph_data': 2,
+}
+# Webhooks and health checks come from shared machine addresses, never limit them
+RATE_LIMIT_EXEMPT = {'paypal_webhook', 'health_check'}
+# Proxies in front of the app that append to X-Forwarded-For, Render has one.
+# Anonymous clients are keyed on the address the outermost of them saw.
+RATE_LIMIT_PROXY_DEPTH = int(os.environ.get('RATE_LIMIT_PROXY_DEPTH', 1 if RENDER_EXTERNAL_HOSTNAME else 0))
+
+# Seconds a WebSocket ticket from get_ws_token stays valid (see api.ws_tickets)
+WS_TICKET_MAX_AGE = int(os.environ.get('WS_TICKET_MAX_AGE', 30))
+
+# Authenticated users are cached per process for USER_CACHE_LOCAL_TTL seconds
+# and in Redis for USER_CACHE_TIMEOUT seconds (see api.authentication)
+USER_CACHE_LOCAL_TTL = int(os.environ.get('USER_CACHE_LOCAL_TTL', 5))
+USER_CACHE_TIMEOUT = int(os.environ.get('USER_CACHE_TIMEOUT', 60 * 5))
+
+# Ollama chat models by name, each entry holds ChatOllama arguments (see api.llm).
+# keep_alive keeps the model and its evaluated prompt prefix loaded, a
+# different num_ctx would reload the model so it stays fixed.
+OLLAMA_BASE_URL = os.environ.get('OLLAMA_BASE_URL', 'http://localhost:11434')
+OLLAMA_TIMEOUT = float(os.environ.get('OLLAMA_TIMEOUT', 120))
+LLM_MODELS = {
+    'chat': {
+        'model': os.environ.get('OLLAMA_CHAT_MODEL', 'gemma3:4b'),
+        'temperature': 0,
+        'keep_alive': os.environ.get('OLLAMA_KEEP_ALIVE', '30m'),
+        'num_ctx': int(os.environ.get('OLLAMA_NUM_CTX', 8192)),
+    },
+}
+# Same num_ctx as 'chat' so switching between them does not reload the model
+LLM_MODELS['summary'] = {**LLM_MODELS['chat'], 'temperature': 0.2}
+LLM_WARMUP = os.environ.get('LLM_WARMUP', 'True') == 'True'
+
+# Chat prompts hold the project's chat summary and at most this many tokens of
+# later messages. Past CHAT_SUMMARIZE_AT unsummarized tokens the older
+# messages are folded into the summary (see api.chat).
+CHAT_HISTORY_MAX_MESSAGES = 50
+CHAT_HISTORY_TOKEN_BUDGET = 3000
+CHAT_SUMMARIZE_AT = 2000
+
+# Chat messages are looked up in the project's knowledge graph, the top
+# RETRIEVAL_TOP_K triplets are added to the prompt unless the search takes
+# longer than RETRIEVAL_TIMEOUT seconds (see api.retrieval)
+RETRIEVAL_TOP_K = 5
+RETRIEVAL_TIMEOUT = float(os.environ.get('RETRIEVAL_TIMEOUT', 1.0))
+RETRIEVAL_CACHE_TIMEOUT = 60 * 60
+
+# First chat messages are answered from an earlier answer when their
+# embeddings are at least SEMANTIC_CACHE_THRESHOLD cosine-similar. Entries not
+# hit for SEMANTIC_CACHE_TTL seconds, and the least recently hit ones over
+# SEMANTIC_CACHE_MAX_ENTRIES, are evicted (see api.semantic_cache).
+OLLAMA_EMBEDDING_MODEL = os.environ.get('OLLAMA_EMBEDDING_MODEL', 'nomic-embed-text')
+SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'True') == 'True'
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.95))
+SEMANTIC_CACHE_TTL = 60 * 60 * 24 * 7
+SEMANTIC_CACHE_MAX_ENTRIES = 100_000
+
+# JSON logs written by a background thread (see api.log). INFO and DEBUG
+# records are kept for this share of requests per URL name, 'websocket' covers
+# socket connections. Warnings and errors are always kept.
+LOG_SAMPLING_RATES = {
+    'default': float(os.environ.get('LOG_SAMPLING_RATE', 1.0)),
+    'get_graph_data': 0.1,
+    'get_ws_token': 0.1,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'api.log.RequestIdFilter'},
+        'sampling': {'()': 'api.log.SamplingFilter'},
+    },
+    'formatters': {
+        'json': {'()': 'api.log.JSONFormatter'},
+    },
+    'handlers': {
+        'queue': {
+            '()': 'api.log.QueueLogHandler',
+            'formatter': 'json',
+            'filters': ['request_id', 'sampling'],
+        },
+    },
+    'root': {
+        'handlers': ['queue'],
+        'level': os.environ.get('LOG_LEVEL', 'INFO'),
+    },
+    'loggers': {
+        # Replaced by the access line of RequestIdMiddleware
+        'django.server': {'level': 'WARNING'},
+    },
+}